@@ -15,12 +15,12 @@ if sys.platform == 'win32':
 else:
     CREATE_NO_WINDOW = 0
 import re
-from threading import Thread
+from threading import Thread, Event
 from queue import Queue, Empty
 import ctypes
 import tkinter as tk
 import customtkinter as ctk
-from comfy_venvtools import ComfyVenvTools, PYPI_MIRRORS
+from comfy_venvtools import ComfyVenvTools, IoThrottle, JobManager, JobCancelled, current_job, job_checkpoint, env_key, spawn_process, set_subprocess_limit, PYPI_MIRRORS, SDIST_ONLY_MARK, BACKUP_MANIFEST, ARCHIVE_SUFFIX, load_mirror_config, mirror_url
 import shutil
 
 ctk.set_appearance_mode("dark")
@@ -119,6 +119,24 @@ class ComfyUIEnvironmentManager(ctk.CTk):
         self.python_paths = []
         self.python_exe_path = ""
         self.selected_mirror = '阿里云'
+        # 备份/还原的复制后端：native（跨平台并行复制，默认）或 robocopy（仅 Windows）
+        self.copy_backend = 'native'
+        # 环境备份方式：snapshot（增量快照，未变文件硬链接复用，默认）、full（每次完整复制）
+        # 或 archive（流式分块压缩为单个 .cvpack 文件，便于传到 NAS/云存储）；快照保留策略
+        self.backup_mode = 'snapshot'
+        self.archive_codec = 'zlib'
+        # 备份限速（0 为不限）与低 I/O 优先级，避免备份拖慢正在出图的 ComfyUI
+        self.backup_bandwidth_mb = 0
+        self.backup_files_per_sec = 0
+        self.backup_low_priority = True
+        self.snapshot_keep_last = 5
+        self.snapshot_keep_daily = 7
+        self.snapshot_auto_prune = False  # 快照完成后是否自动按保留策略清理旧快照（默认只提示）
+        # 目录还原方式：delta（按清单只复制有差异的文件，默认）或 full（整体复制覆盖）
+        self.restore_mode = 'delta'
+        # 同时运行的 pip/git/robocopy 子进程上限（0 为按 CPU 核数自动）
+        self.max_subprocesses = 0
+        self._copy_cancel = Event()
         self.requirements_path = ""
         self.custom_nodes_history = []
         self.plugin_history = []
@@ -127,13 +145,21 @@ class ComfyUIEnvironmentManager(ctk.CTk):
         self.comfy_paths_history = []  # ComfyUI路径历史记录
         self.progress_var = ctk.DoubleVar(value=0.0)
         self._ui_queue = Queue()  # 主线程刷新队列
+        # 所有后台操作（备份/还原/迁移/克隆/安装等）统一交给任务管理器，便于查看、取消与暂停；
+        # 修改同一环境的任务按提交顺序排队，只读任务可并发
+        self.jobs = JobManager(on_change=self._on_job_change)
+        self._announced_waits = set()
 
         # 后端工具
         self.tools = ComfyVenvTools(self.update_result_text)
+        # 自定义镜像（config.json 的 "mirrors"）需在构建镜像下拉框之前加载
+        mirror_problems = load_mirror_config(self.config_file)
 
         self._init_data()
         self._build_ui()
         self.load_config()
+        for msg in mirror_problems:
+            self.update_result_text(f"[镜像配置] {msg}")
         # 绑定关闭事件，退出前保存配置
         try:
             self.protocol("WM_DELETE_WINDOW", self._on_close)
@@ -150,6 +176,16 @@ class ComfyUIEnvironmentManager(ctk.CTk):
             self.after(50, self._drain_ui_queue)
         except Exception:
             pass
+        # 检查上次未完成的长任务
+        try:
+            self.after(1200, self._check_pending_jobs)
+        except Exception:
+            pass
+        # 后台持续评估镜像健康度，安装失败时据此切换镜像
+        try:
+            self.tools.start_mirror_monitor()
+        except Exception:
+            pass
 
     # ---------------- 数据初始化 ----------------
     def _init_data(self):
@@ -159,8 +195,20 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                     cfg = json.load(f)
                     self.python_paths = [p for p in cfg.get('python_paths', []) if os.path.exists(p)]
                     self.selected_mirror = cfg.get('fastest_mirror', self.selected_mirror)
+                    self.copy_backend = cfg.get('copy_backend', self.copy_backend)
+                    self.backup_mode = cfg.get('backup_mode', self.backup_mode)
+                    self.archive_codec = cfg.get('archive_codec', self.archive_codec)
+                    self.backup_bandwidth_mb = float(cfg.get('backup_bandwidth_mb', self.backup_bandwidth_mb) or 0)
+                    self.backup_files_per_sec = float(cfg.get('backup_files_per_sec', self.backup_files_per_sec) or 0)
+                    self.backup_low_priority = bool(cfg.get('backup_low_priority', self.backup_low_priority))
+                    self.snapshot_keep_last = int(cfg.get('snapshot_keep_last', self.snapshot_keep_last))
+                    self.snapshot_keep_daily = int(cfg.get('snapshot_keep_daily', self.snapshot_keep_daily))
+                    self.snapshot_auto_prune = bool(cfg.get('snapshot_auto_prune', self.snapshot_auto_prune))
+                    self.restore_mode = cfg.get('restore_mode', self.restore_mode)
+                    self.max_subprocesses = int(cfg.get('max_subprocesses', self.max_subprocesses) or 0)
             except Exception:
                 pass
+        set_subprocess_limit(self.max_subprocesses)
         if not self.python_paths:
             cands = [
                 os.path.join(os.getcwd(), 'python.exe'),                  
@@ -231,6 +279,7 @@ class ComfyUIEnvironmentManager(ctk.CTk):
         self.mirror_cb.pack(side='left', padx=2)
         # 点击下拉触发测速
         self.mirror_cb.bind("<Button-1>", self._on_mirror_dropdown_click)
+        ctk.CTkButton(r1, text="排名", width=44, command=self.show_mirror_ranking, font=ctk.CTkFont(family="Microsoft YaHei", size=12)).pack(side='left', padx=2)
         self.python_env_var = ctk.StringVar(value=self.python_exe_path)
         self.python_env_cb = ctk.CTkComboBox(r1, variable=self.python_env_var, values=self.python_paths, width=180, command=self.on_python_env_change, font=ctk.CTkFont(family="Microsoft YaHei", size=12))
         self.python_env_cb.pack(side='left', fill='x', expand=True, padx=2)
@@ -285,13 +334,18 @@ class ComfyUIEnvironmentManager(ctk.CTk):
             ("环境备份", self.backup_environment_files),
             ("目录还原", self.restore_environment_files),
             ("库列表还原", self.restore_from_env_list),
+            ("回滚安装", self.rollback_last_install),
+            ("快照管理", self.manage_snapshots),
+            ("归档还原", self.restore_from_archive),
+            ("包备份", self.backup_selected_packages),
+            ("校验备份", self.verify_backup_directory),
         ]
         for i in range(5):
             try:
                 s3grid.grid_columnconfigure(i, weight=1, uniform="envops")
             except Exception:
                 pass
-        for i in range(2):
+        for i in range(3):
             try:
                 s3grid.grid_rowconfigure(i, weight=1)
             except Exception:
@@ -353,7 +407,9 @@ class ComfyUIEnvironmentManager(ctk.CTk):
         ctk.CTkButton(s6r1, text="管理", width=50, command=self._stub_version_manage, font=ctk.CTkFont(family="Microsoft YaHei", size=12)).pack(side='left', padx=2)
 
     def _build_right_panel(self):
-        ctk.CTkLabel(self.right, text="执行结果", font=("Microsoft YaHei", 14, 'bold')).pack(fill='x', pady=(6, 4))
+        header = ctk.CTkFrame(self.right, fg_color="transparent"); header.pack(fill='x', pady=(6, 4))
+        ctk.CTkLabel(header, text="执行结果", font=("Microsoft YaHei", 14, 'bold')).pack(side='left', fill='x', expand=True)
+        ctk.CTkButton(header, text="任务管理", width=70, command=self.show_jobs_panel, font=ctk.CTkFont(family="Microsoft YaHei", size=12)).pack(side='right', padx=2)
         self.result_text = ctk.CTkTextbox(self.right, wrap='word', font=ctk.CTkFont(family="Microsoft YaHei", size=12))
         self.result_text.pack(fill='both', expand=True, padx=2, pady=2)
 
@@ -439,6 +495,11 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                         item[1]()  # 执行错误处理函数
                     except Exception:
                         pass
+                elif kind == 'call':
+                    try:
+                        item[1]()
+                    except Exception:
+                        pass
                 elif kind == 'update_git_combobox':
                     try:
                         values = item[1] or []
@@ -458,6 +519,7 @@ class ComfyUIEnvironmentManager(ctk.CTk):
     def _enqueue_text(self, text: str):
         try:
             if text:
+                self._job_message(text)
                 self._ui_queue.put(('text', text))
         except Exception:
             pass
@@ -485,9 +547,42 @@ class ComfyUIEnvironmentManager(ctk.CTk):
         try:
             # 统一使用 'progress' 事件键，_drain_ui_queue 中会调用 progress_bar.set
             self._ui_queue.put(('progress', value))
+            job = current_job()
+            if job is not None:
+                job.set_progress(value)
+        except Exception:
+            pass
+
+    def _enqueue_call(self, fn):
+        """在主线程执行 fn（任务结束后恢复按钮状态等）"""
+        try:
+            self._ui_queue.put(('call', fn))
         except Exception:
             pass
 
+    def _on_job_change(self, job):
+        """任务因同一环境上的其他任务而排队时，在结果区提示一次（任务线程调用）"""
+        if job.state == 'pending' and job.waiting_for is not None and job.id not in self._announced_waits:
+            self._announced_waits.add(job.id)
+            self._enqueue_text(f"[任务调度] ⏳ #{job.id} {job.title} 与 #{job.waiting_for.id} {job.waiting_for.title} "
+                               f"涉及同一环境，等待其结束后自动开始")
+
+    def _job_message(self, text):
+        """任务线程中的日志同步为该任务的最近消息，供任务面板显示"""
+        job = current_job()
+        if job is not None and text:
+            job.set_message(str(text).strip().splitlines()[-1] if str(text).strip() else '')
+
+    def _job_cancelled(self):
+        """窗口正在关闭或当前任务已被取消"""
+        job = current_job()
+        return bool(getattr(self, '_closing', False) or (job is not None and job.cancelled))
+
+    def _cancel_token(self):
+        """复制/归档/校验接口的取消令牌：任务线程中使用该任务的令牌（同时支持暂停），否则退回全局取消事件"""
+        job = current_job()
+        return job.token if job is not None else self._copy_cancel
+
     def _enqueue_progress_hide(self):
         try:
             self._ui_queue.put(('progress_hide', None))
@@ -946,6 +1041,7 @@ class ComfyUIEnvironmentManager(ctk.CTk):
     # comfyui路径列表框已移除
 
     def update_result_text(self, text):
+        self._job_message(text)
         self.result_text.insert('end', text + "\n")
         self.result_text.see('end')
 
@@ -958,6 +1054,17 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                 'python_paths': self.python_paths,
                 'current_python_exe': self.python_exe_path,
                 'fastest_mirror': self.mirror_var.get(),
+                'copy_backend': self.copy_backend,
+                'backup_mode': self.backup_mode,
+                'archive_codec': self.archive_codec,
+                'backup_bandwidth_mb': self.backup_bandwidth_mb,
+                'backup_files_per_sec': self.backup_files_per_sec,
+                'backup_low_priority': self.backup_low_priority,
+                'snapshot_keep_last': self.snapshot_keep_last,
+                'snapshot_keep_daily': self.snapshot_keep_daily,
+                'snapshot_auto_prune': self.snapshot_auto_prune,
+                'restore_mode': self.restore_mode,
+                'max_subprocesses': self.max_subprocesses,
                 'custom_nodes_dir': self.custom_nodes_var.get(),
                 'requirements_cache': list(getattr(self, 'requirements_cache', set())),
                 'custom_nodes_history': self.custom_nodes_history,
@@ -967,6 +1074,14 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                 'comfy_paths_history': self.comfy_paths_history,
                 '_missing_cache':   {k: v for k, v in getattr(self, '_missing_cache', {}).items()}
             }
+            # 保留用户手工维护的自定义镜像定义
+            try:
+                with open(self.config_file, 'r', encoding='utf-8') as f:
+                    old_cfg = json.load(f)
+                if 'mirrors' in old_cfg:
+                    cfg['mirrors'] = old_cfg['mirrors']
+            except Exception:
+                pass
             with open(self.config_file, 'w', encoding='utf-8') as f:
                 json.dump(cfg, f, ensure_ascii=False, indent=2)
         except Exception as e:
@@ -1036,12 +1151,76 @@ class ComfyUIEnvironmentManager(ctk.CTk):
         except Exception as e:
             self.update_result_text(f"加载配置失败: {e}")
 
+    def _check_pending_jobs(self):
+        """启动时检查任务日志，提示继续上次中断的安装/还原任务"""
+        try:
+            journal = self.tools.journal
+            journal.compact()
+            for job in journal.pending_jobs():
+                remaining = job.get('remaining') or []
+                total = len(job.get('steps') or [])
+                if not remaining or job.get('kind') not in ('env_list_restore', 'install_missing'):
+                    journal.finish_job(job['id'])
+                    continue
+                started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job.get('started') or 0))
+                if self._show_dark_confirm(
+                    "继续未完成的任务",
+                    f"检测到上次未完成的任务：{job.get('title')}\n\n"
+                    f"开始时间: {started}\n"
+                    f"已完成: {total - len(remaining)}/{total} 步，失败 {len(job.get('failed') or [])} 步（继续时将重试）\n\n"
+                    "是否从第一个未完成的步骤继续？（选择否将放弃该任务）"
+                ):
+                    self._resume_job(job)
+                    break  # 同一时间只继续一个任务，其余任务下次启动再提示
+                journal.finish_job(job['id'], 'discarded')
+                self._text_enqueue(f"[任务日志] 已放弃未完成任务: {job.get('title')}")
+        except Exception as e:
+            self._text_enqueue(f"[任务日志] 读取未完成任务失败: {e}")
+
+    def _resume_job(self, job):
+        """按任务类型继续执行中断的任务"""
+        params = job.get('params') or {}
+        self._text_enqueue(f"[任务日志] ⏯️ 继续任务: {job.get('title')}")
+        if job.get('kind') == 'env_list_restore':
+            self.jobs.submit(
+                'env_list_restore', f"继续: {job.get('title')}", self._perform_env_list_restore,
+                params.get('packages') or [], params.get('env_file') or '', bool(params.get('upgrade')),
+                bool(params.get('force_reinstall')), params.get('index_url') or '',
+                resume_job=job, writes=(params.get('python_exe') or self.python_exe_path,)
+            )
+        elif job.get('kind') == 'install_missing':
+            def _task():
+                try:
+                    self._enqueue_progress_show(0.1)
+                    result = self.tools.actual_install_missing(
+                        job.get('remaining') or [],
+                        params.get('python_exe') or self.python_exe_path,
+                        params.get('mirror_name') or self.mirror_var.get(),
+                        progress_cb=lambda v: self._enqueue_progress(0.1 + 0.8 * v),
+                        job_id=job['id']
+                    )
+                    self._enqueue_text(result)
+                except Exception as e:
+                    self._text_enqueue(f"[实际安装] ❌ 继续安装出错: {e}")
+                finally:
+                    self._enqueue_progress(1.0)
+                    self._enqueue_progress_hide()
+            self.jobs.submit('install', f"继续: {job.get('title')}", _task,
+                             writes=(params.get('python_exe') or self.python_exe_path,))
+
     def _on_close(self):
         """窗口关闭时保存当前选择并退出。"""
         try:
             # 设置关闭标志，停止新的定时器调度
             self._closing = True
 
+            # 取消所有后台任务（终止其子进程），并停止非任务线程中的目录复制
+            self._copy_cancel.set()
+            try:
+                self.jobs.cancel_all()
+            except Exception:
+                pass
+
             # 如果有正在运行的robocopy，立即终止
             try:
                 if hasattr(self, '_robocopy_proc') and self._robocopy_proc:
@@ -1057,6 +1236,12 @@ class ComfyUIEnvironmentManager(ctk.CTk):
             except Exception:
                 pass
             
+            # 停止后台镜像测速
+            try:
+                self.tools.stop_mirror_monitor()
+            except Exception:
+                pass
+            
             # 保存配置
             self.save_config()
             
@@ -1119,31 +1304,21 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                 self._text_enqueue("[备份] 用户取消备份操作")
                 return
             
-            # 按日期时间创建备份子目录
-            from datetime import datetime
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_name = f"comfyui_env_backup_{timestamp}"
-            backup_dir = os.path.join(backup_root, backup_name)
+            # 按日期时间创建备份子目录（立即占用，同一秒内的多次备份自动追加序号）
+            backup_dir = self.tools.reserve_backup_path(backup_root, ARCHIVE_SUFFIX if self.backup_mode == 'archive' else '')
+            backup_name = os.path.basename(backup_dir)
             
             self._text_enqueue(f"[备份] 备份根目录: {backup_root}")
             self._text_enqueue(f"[备份] 备份子目录: {backup_name}")
             self._text_enqueue(f"[备份] 完整备份路径: {backup_dir}")
             
-            # 直接使用Windows系统复制命令，不再询问模式
-            self._text_enqueue("[备份] 🚀 使用Windows系统复制命令进行备份...")
-            self._text_enqueue("[备份] 💡 直接调用系统复制命令，速度最快")
-            
-            # 初始化备份状态
-            self.backup_status = {
-                'total_items': 0,
-                'backed_up_items': 0,
-                'last_progress_update': 0,
-                'backup_dir': backup_dir,
-                'python_dir': python_dir,
-                'completed': False,
-                'error': None,
-                'use_os_speed_mode': True  # 直接使用系统复制模式
-            }
+            if self.backup_mode == 'snapshot':
+                backend_name = '增量快照（未变文件硬链接复用）'
+            elif self.backup_mode == 'archive':
+                backend_name = f'流式压缩归档（{self.archive_codec}）'
+            else:
+                backend_name = 'robocopy' if self.copy_backend == 'robocopy' and sys.platform == 'win32' else '并行复制引擎'
+            self._text_enqueue(f"[备份] 🚀 使用{backend_name}进行备份...")
             
             # 禁用备份按钮，防止重复点击
             if hasattr(self, 'backup_button'):
@@ -1152,19 +1327,11 @@ class ComfyUIEnvironmentManager(ctk.CTk):
             else:
                 self._text_enqueue("[备份] ⚠️ 备份按钮引用不存在")
             
-            # 直接启动系统复制备份线程
-            self._text_enqueue("[备份] 🚀 启动Windows系统复制备份...")
-            backup_thread = Thread(target=self._os_speed_backup_worker, 
-                                 args=(python_dir, backup_dir), 
-                                 daemon=True)
-            
-            # 启动后台备份线程
-            backup_thread.start()
-            self._text_enqueue("[备份] ✅ 后台备份线程已启动")
-            
-            # 启动UI更新定时器
-            self._start_backup_ui_update()
-            self._text_enqueue("[备份] ✅ UI更新定时器已启动")
+            # 作为可暂停的后台任务运行，结束（含失败/取消）后在主线程恢复按钮状态
+            job = self.jobs.submit('backup', f"备份 {os.path.basename(backup_dir)}", self._os_speed_backup_worker,
+                                   python_dir, backup_dir, pausable=True, reads=(python_exe,), writes=(backup_root,),
+                                   on_done=lambda j: self._enqueue_call(self._restore_backup_ui_state))
+            self._text_enqueue(f"[备份] ✅ 后台备份任务 #{job.id} 已启动（可在「任务管理」中暂停或取消）")
             
         except Exception as e:
             self._text_enqueue(f"[备份] ❌ 启动备份失败: {e}")
@@ -1179,8 +1346,21 @@ class ComfyUIEnvironmentManager(ctk.CTk):
             
             # 验证目录
             if not os.path.exists(python_dir):
-                self._text_enqueue(f"[极速备份] ❌ Python目录不存在: {python_dir}")
-                self.backup_status['error'] = f"Python目录不存在: {python_dir}"
+                raise RuntimeError(f"Python目录不存在: {python_dir}")
+            
+            if self.backup_mode == 'archive':
+                start_time = time.time()
+                success, copy_stats = self._archive_directory(python_dir, backup_dir)
+                if success and not self._job_cancelled():
+                    self._text_enqueue(f"[极速备份] ✅ 备份完成！耗时: {time.time() - start_time:.1f}秒")
+                    self._text_enqueue(f"[极速备份] 📦 归档文件: {backup_dir}")
+                else:
+                    # 归档未写成时删除启动备份时创建的空占位文件
+                    try:
+                        if os.path.getsize(backup_dir) == 0:
+                            os.remove(backup_dir)
+                    except OSError:
+                        pass
                 return
             
             # 创建目标目录
@@ -1188,16 +1368,16 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                 os.makedirs(backup_dir, exist_ok=True)
                 self._text_enqueue(f"[极速备份] ✅ 目标目录创建成功")
             except Exception as e:
-                self._text_enqueue(f"[极速备份] ❌ 目标目录创建失败: {e}")
-                self.backup_status['error'] = f"目标目录创建失败: {e}"
-                return
+                raise RuntimeError(f"目标目录创建失败: {e}")
             
             start_time = time.time()
             
-            # 只使用Windows robocopy
-            success = self._windows_os_copy(python_dir, backup_dir)
+            if self.backup_mode == 'snapshot':
+                success, copy_stats = self._snapshot_directory(python_dir, backup_dir)
+            else:
+                success, copy_stats = self._copy_directory(python_dir, backup_dir, write_manifest=True)
             
-            if success and not self._closing:
+            if success and not self._job_cancelled():
                 elapsed_time = time.time() - start_time
                 self._text_enqueue(f"[极速备份] ✅ 备份完成！")
                 self._text_enqueue(f"[极速备份] ⏱️ 耗时: {elapsed_time:.1f}秒")
@@ -1205,7 +1385,7 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                 
                 # 显示备份统计信息
                 try:
-                    total_size = self._get_directory_size(backup_dir)
+                    total_size = copy_stats['total_bytes']
                     self._text_enqueue(f"[极速备份] 💾 备份大小: {total_size / (1024**3):.2f} GB")
                     if elapsed_time > 0:
                         speed_mbps = (total_size / (1024**2)) / elapsed_time
@@ -1213,19 +1393,465 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                 except Exception:
                     pass
                     
-            elif self._closing:
+            elif self._job_cancelled():
                 self._text_enqueue("[极速备份] ⚠️ 备份操作被取消")
             else:
-                self._text_enqueue("[极速备份] ❌ robocopy复制失败")
+                raise RuntimeError("复制失败")
                 
         except Exception as e:
-            self.backup_status['error'] = str(e)
-            self._text_enqueue(f"[极速备份] 备份失败: {e}")
+            self._text_enqueue(f"[极速备份] ❌ 备份失败: {e}")
+            raise
         finally:
-            self.backup_status['completed'] = True
+            self._enqueue_progress_hide()
     
-    def _windows_os_copy(self, src_dir, dst_dir):
-        """Windows系统使用robocopy，每50个文件显示进度"""
+    def _copy_directory(self, src_dir, dst_dir, exclude=(), write_manifest=False):
+        """按配置的复制后端复制目录，返回 (是否成功, 统计信息)。
+        源目录只遍历一次生成清单，总量、进度与最终大小都由清单和复制计数得出；
+        write_manifest=True（备份）时把清单写入目标目录：native 后端在复制的同时计算每个文件的哈希；
+        robocopy 无法计算哈希，复制后按清单核对文件数与大小（robocopy 返回码 ≤7 时也可能跳过了文件）。
+        robocopy 仅在 Windows 上可用，其他平台自动使用 native 后端。"""
+        manifest = self.tools.scan_tree(src_dir, exclude=tuple(exclude))
+        throttle = self._backup_throttle() if write_manifest else None  # 只对备份限速，还原按全速进行
+        if self.copy_backend == 'robocopy' and sys.platform == 'win32':
+            success, stats = self._windows_os_copy(src_dir, dst_dir, manifest, exclude, throttle)
+            if success and write_manifest:
+                check = self.tools.verify_backup(dst_dir, manifest=manifest, quick=True)
+                if not check['ok']:
+                    success = False
+                    self._report_verify_result("[系统复制]", check)
+        else:
+            success, stats = self._native_copy(src_dir, dst_dir, manifest, hash_files=write_manifest, throttle=throttle)
+        if write_manifest and stats is not None:
+            self.tools.write_backup_manifest(dst_dir, manifest, {'complete': bool(success)})
+        return success, stats
+
+    def _backup_throttle(self):
+        """按配置生成备份用的 IoThrottle；未设置限速且不降低优先级时返回 None。"""
+        throttle = IoThrottle(bytes_per_sec=self.backup_bandwidth_mb * 1024 * 1024,
+                              files_per_sec=self.backup_files_per_sec, low_priority=self.backup_low_priority)
+        if not throttle.active:
+            return None
+        limits = []
+        if throttle.bytes_per_sec:
+            limits.append(f"{self.backup_bandwidth_mb:g} MB/s")
+        if throttle.files_per_sec:
+            limits.append(f"{self.backup_files_per_sec:g} 文件/s")
+        if throttle.low_priority:
+            limits.append("低 I/O 优先级")
+        self._text_enqueue(f"[备份] 🐢 后台模式: {'，'.join(limits)}")
+        return throttle
+
+    def _copy_stats_logger(self, tag):
+        """返回 copy_tree 的 stats_cb：每 5 秒输出一次文件数/字节数进度、实时速度（最近 5 秒）与平均速度。"""
+        last = {'elapsed': 0.0, 'bytes': 0}
+
+        def _on_stats(st):
+            if st['elapsed'] - last['elapsed'] < 5.0:
+                return
+            live = (st['bytes'] - last['bytes']) / (1024**2) / max(st['elapsed'] - last['elapsed'], 1e-6)
+            last.update(elapsed=st['elapsed'], bytes=st['bytes'])
+            pct = st['bytes'] / st['total_bytes'] * 100 if st['total_bytes'] else 0
+            speed = st['bytes'] / (1024**2) / max(st['elapsed'], 1e-6)
+            self._text_enqueue(f"{tag} 📈 进度: {st['files']}/{st['total_files']} 文件，"
+                               f"{st['bytes'] / (1024**3):.2f}/{st['total_bytes'] / (1024**3):.2f} GB ({pct:.1f}%)，"
+                               f"实时 {live:.1f} MB/s，平均 {speed:.1f} MB/s")
+        return _on_stats
+
+    def _snapshot_directory(self, src_dir, backup_dir):
+        """增量快照备份：backup_dir 的上级目录作为快照库，与上一快照相同的文件硬链接复用；
+        完成后仅在开启 snapshot_auto_prune 时按保留策略自动清理旧快照，否则只提示可在「快照管理」中清理。"""
+        backup_root, name = os.path.split(os.path.abspath(backup_dir))
+        try:
+            self._enqueue_progress_show(0.0)
+        except Exception:
+            pass
+        stats = self.tools.snapshot_tree(src_dir, backup_root, name=name,
+                                         progress_cb=lambda v: self._enqueue_progress(min(0.99, v)),
+                                         stats_cb=self._copy_stats_logger("[快照]"), cancel=self._cancel_token(),
+                                         throttle=self._backup_throttle())
+        errors = stats.get('errors') or []
+        if errors:
+            self._text_enqueue(f"[快照] ⚠️ {len(errors)} 个项目备份失败：")
+            for path, reason in errors[:10]:
+                self._text_enqueue(f"  - {path}: {reason}")
+        if stats.get('cancelled'):
+            self._text_enqueue("[快照] ⚠️ 备份已取消")
+        elif stats.get('ok'):
+            self._enqueue_progress(1.0)
+            self._text_enqueue(f"[快照] ✅ 完成！{stats['total_files']} 文件，新写入 {stats['stored_files']} 个 "
+                               f"({stats['stored_bytes'] / (1024**2):.1f} MB)，复用 {stats['linked_files']} 个，{stats['elapsed']:.1f}秒")
+            policy = f"最近 {self.snapshot_keep_last} 个 + 最近 {self.snapshot_keep_daily} 天每天 1 个"
+            if self.snapshot_auto_prune:
+                removed = self.tools.prune_snapshots(backup_root, self.snapshot_keep_last, self.snapshot_keep_daily)
+                if removed:
+                    self._text_enqueue(f"[快照] 🧹 按保留策略（{policy}）清理 {len(removed)} 个旧快照")
+            else:
+                stale = self.tools.prune_snapshots(backup_root, self.snapshot_keep_last, self.snapshot_keep_daily, dry_run=True)
+                if stale:
+                    self._text_enqueue(f"[快照] 💡 有 {len(stale)} 个旧快照超出保留策略（{policy}），可在「快照管理」中确认清理")
+        return bool(stats.get('ok')), stats
+
+    def _delta_restore_directory(self, backup_dir, python_dir, delete_extras=False, allow_incomplete=False):
+        """增量还原：先按清单与当前目录比对（仅在 mtime 不一致时计算哈希），只复制有差异的文件，可选删除多余文件。"""
+        try:
+            self._enqueue_progress_show(0.0)
+        except Exception:
+            pass
+        stats = self.tools.delta_restore(backup_dir, python_dir, delete_extras=delete_extras,
+                                         progress_cb=lambda v: self._enqueue_progress(min(0.99, v)),
+                                         stats_cb=self._copy_stats_logger("[增量还原]"), cancel=self._cancel_token(),
+                                         allow_incomplete=allow_incomplete)
+        if stats.get('extras_skipped'):
+            kept = "（复制未全部成功，已保留）"
+        else:
+            kept = f"（已删除 {stats['removed']} 个）" if delete_extras else "（已保留）"
+        self._text_enqueue(f"[增量还原] 📊 复制 {stats['files']}/{stats['planned_copy']} 个文件，未变 {stats['same']} 个，"
+                           f"仅修正时间 {stats['touched']} 个，多余 {stats['extras']} 个" + kept)
+        errors = list(stats.get('errors') or []) + list(stats.get('remove_errors') or [])
+        if errors:
+            self._text_enqueue(f"[增量还原] ⚠️ {len(errors)} 个项目处理失败：")
+            for path, reason in errors[:10]:
+                self._text_enqueue(f"  - {path}: {reason}")
+        if stats.get('cancelled'):
+            self._text_enqueue("[增量还原] ⚠️ 还原已取消")
+        elif stats.get('ok'):
+            self._enqueue_progress(1.0)
+            self._text_enqueue(f"[增量还原] ✅ 完成！{stats['elapsed']:.1f}秒")
+        return bool(stats.get('ok')), stats
+
+    def _archive_directory(self, src_dir, archive_path):
+        """流式压缩归档备份：分块并行压缩，边压缩边写盘。"""
+        try:
+            self._enqueue_progress_show(0.0)
+        except Exception:
+            pass
+        last = {'elapsed': 0.0, 'bytes': 0}
+
+        def _on_stats(st):
+            if st['elapsed'] - last['elapsed'] < 5.0:
+                return
+            live = (st['bytes'] - last['bytes']) / (1024**2) / max(st['elapsed'] - last['elapsed'], 1e-6)
+            last.update(elapsed=st['elapsed'], bytes=st['bytes'])
+            speed = st['bytes'] / (1024**2) / max(st['elapsed'], 1e-6)
+            self._text_enqueue(f"[归档] 📈 进度: {st['files']}/{st['total_files']} 文件，"
+                               f"{st['bytes'] / (1024**3):.2f}/{st['total_bytes'] / (1024**3):.2f} GB → "
+                               f"{st['compressed'] / (1024**3):.2f} GB，实时 {live:.1f} MB/s，平均 {speed:.1f} MB/s")
+        try:
+            stats = self.tools.create_archive(src_dir, archive_path, codec=self.archive_codec,
+                                              progress_cb=lambda v: self._enqueue_progress(min(0.99, v)),
+                                              stats_cb=_on_stats, cancel=self._cancel_token(), throttle=self._backup_throttle())
+        except ValueError as e:
+            self._text_enqueue(f"[归档] ❌ {e}")
+            return False, None
+        for path, reason in (stats.get('errors') or [])[:10]:
+            self._text_enqueue(f"  - {path}: {reason}")
+        if stats.get('cancelled'):
+            self._text_enqueue("[归档] ⚠️ 归档已取消")
+        elif stats.get('ok'):
+            self._enqueue_progress(1.0)
+            ratio = stats['compressed'] / stats['bytes'] * 100 if stats['bytes'] else 0
+            speed = stats['bytes'] / (1024**2) / max(stats['elapsed'], 1e-6)
+            self._text_enqueue(f"[归档] ✅ {stats['files']} 文件 {stats['bytes'] / (1024**3):.2f} GB → "
+                               f"{stats['compressed'] / (1024**3):.2f} GB（{ratio:.0f}%），{stats['chunks']} 块，{speed:.1f} MB/s")
+        return bool(stats.get('ok')), stats
+
+    def restore_from_archive(self):
+        """从 .cvpack 归档还原：可只提取指定的包（如 torch），只读取涉及的数据块"""
+        try:
+            python_exe = self.python_exe_path
+            if not python_exe or not os.path.exists(python_exe):
+                self._show_dark_warning("⚠️ Python环境无效", "请先设置有效的Python环境路径！",
+                                        "Python环境路径无效或不存在，无法还原环境文件。")
+                return
+            python_dir = os.path.dirname(python_exe)
+            archive_path = self._ask_open_filename_dark("选择环境归档文件", filetypes=[("环境归档", "*" + ARCHIVE_SUFFIX), ("All files", "*.*")])
+            if not archive_path:
+                return
+            try:
+                index = self.tools.read_archive_index(archive_path)
+            except (OSError, ValueError) as e:
+                self._show_dark_warning("⚠️ 归档无效", "无法读取归档索引！", str(e))
+                return
+            created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(index.get('created') or 0))
+            if index.get('kind') == 'packages':
+                # 包级备份：一键还原其中的全部包
+                pkgs = ', '.join(f"{p['name']}=={p['version']}" for p in index.get('packages') or [])
+                src_py = str(index.get('python_exe') or '')
+                if src_py and env_key(src_py) != env_key(python_exe):
+                    self._show_dark_warning("⚠️ 环境不一致", "该包备份来自其他Python环境，已拒绝还原！",
+                                            f"备份来源: {src_py}\n当前环境: {python_exe}\n\n请先切换到备份来源环境后再还原。")
+                    return
+                if not self._show_dark_confirm("⚠️ 还原包备份", f"将还原以下包（创建于 {created}）：\n\n{pkgs}\n\n版本不同的包会先卸载当前版本，是否继续？"):
+                    return
+
+                def _restore_bundle():
+                    try:
+                        self._text_enqueue(self.tools.restore_package_bundle(archive_path, python_exe))
+                    except Exception as e:
+                        self._text_enqueue(f"[包还原] ❌ 还原失败: {e}")
+                self.jobs.submit('restore', f"包还原 {os.path.basename(archive_path)}", _restore_bundle, writes=(python_exe,))
+                return
+            self._text_enqueue(f"[归档还原] 📦 {archive_path}：{index['total_files']} 文件 "
+                               f"{index['total_bytes'] / (1024**3):.2f} GB，{index['codec']}，创建于 {created}")
+            names = self._show_dark_input_dialog("归档还原", "要还原的包名（多个用空格或逗号分隔，留空还原全部）:")
+            if names is None:
+                return
+            packages = [n for n in re.split(r'[\s,;]+', names) if n]
+            target = '、'.join(packages) if packages else '全部文件'
+            if not self._show_dark_confirm("⚠️ 确认还原", f"将从归档还原 {target} 到:\n\n{python_dir}\n\n同名文件会被覆盖"
+                                           f"{'，版本不同的包会先卸载当前版本' if packages else ''}，是否继续？"):
+                return
+
+            def _worker():
+                try:
+                    self._enqueue_progress_show(0.0)
+                except Exception:
+                    pass
+                try:
+                    if packages:
+                        # 只还原个别包时先卸载版本不同的当前版本，避免新旧 dist-info 与模块文件混在一起
+                        self.tools.uninstall_changed_packages(python_exe, self.tools.archive_package_versions(index, packages), '[归档还原]')
+                    stats = self.tools.extract_archive(archive_path, python_dir, packages=packages or None,
+                                                       progress_cb=lambda v: self._enqueue_progress(min(0.99, v)),
+                                                       cancel=self._cancel_token())
+                    for name in stats['missing']:
+                        self._text_enqueue(f"[归档还原] ⚠️ 归档中未找到: {name}")
+                    for path, reason in stats['errors'][:10]:
+                        self._text_enqueue(f"  - {path}: {reason}")
+                    self._text_enqueue(f"[归档还原] {'✅' if stats['ok'] else '⚠️'} 还原 {stats['files']} 文件 "
+                                       f"{stats['bytes'] / (1024**2):.1f} MB，读取 {stats['chunks_read']}/{stats['total_chunks']} 块，"
+                                       f"{stats['elapsed']:.1f}秒")
+                except Exception as e:
+                    self._text_enqueue(f"[归档还原] ❌ 还原失败: {e}")
+                finally:
+                    self._enqueue_progress_hide()
+            self.jobs.submit('restore', f"归档还原 {os.path.basename(archive_path)}（{target}）", _worker, pausable=True,
+                             writes=(python_exe,))
+        except Exception as e:
+            self._text_enqueue(f"[归档还原] ❌ 启动还原失败: {e}")
+
+    def backup_selected_packages(self):
+        """包级备份：按 RECORD 只备份指定包的文件，生成可一键还原的 .cvpack 小包"""
+        try:
+            python_exe = self.python_exe_path
+            if not python_exe or not os.path.exists(python_exe):
+                self._show_dark_warning("⚠️ Python环境无效", "请先设置有效的Python环境路径！",
+                                        "Python环境路径无效或不存在，无法备份。")
+                return
+            names = self._show_dark_input_dialog("包备份", "要备份的包名（多个用空格或逗号分隔）:")
+            packages = [n for n in re.split(r'[\s,;]+', names or '') if n]
+            if not packages:
+                return
+
+            def _worker():
+                try:
+                    stats = self.tools.backup_packages(python_exe, packages, codec=self.archive_codec, cancel=self._cancel_token())
+                    for name in stats.get('missing') or []:
+                        self._text_enqueue(f"[包备份] ⚠️ 未安装或缺少 RECORD，已跳过: {name}")
+                    if stats.get('path') and stats.get('files'):
+                        self._text_enqueue(f"[包备份] ✅ {stats['path']}（可通过「归档还原」一键还原）")
+                    else:
+                        self._text_enqueue("[包备份] ❌ 没有可备份的文件")
+                except Exception as e:
+                    self._text_enqueue(f"[包备份] ❌ 备份失败: {e}")
+            self.jobs.submit('backup', f"包备份 {', '.join(packages)}", _worker, pausable=True, reads=(python_exe,))
+        except Exception as e:
+            self._text_enqueue(f"[包备份] ❌ 启动备份失败: {e}")
+
+    def _report_verify_result(self, tag, result):
+        """输出备份校验结果：缺失/大小不符/内容损坏的文件各列出前 10 个。"""
+        for path, reason in result['errors'][:10]:
+            self._text_enqueue(f"{tag} ⚠️ {path}: {reason}")
+        groups = [("缺失", result['missing']), ("内容损坏", result['corrupted']), ("缺失目录", result['missing_dirs']),
+                  ("大小不符", [f"{p}（应为 {a} 字节，实际 {b} 字节）" for p, a, b in result['size_mismatch']])]
+        for label, items in groups:
+            if items:
+                self._text_enqueue(f"{tag} ❌ {label} {len(items)} 个：")
+                for item in items[:10]:
+                    self._text_enqueue(f"  - {item}")
+                if len(items) > 10:
+                    self._text_enqueue(f"  ... 另有 {len(items) - 10} 个")
+
+    def verify_backup_directory(self):
+        """按备份清单并行校验备份目录的完整性（大小 + 哈希）"""
+        try:
+            backup_dir = self._ask_directory_dark("选择要校验的备份目录")
+            if not backup_dir:
+                return
+
+            def _worker():
+                try:
+                    self._enqueue_progress_show(0.0)
+                except Exception:
+                    pass
+                try:
+                    self._text_enqueue(f"[校验备份] 🔍 {backup_dir}")
+                    result = self.tools.verify_backup(backup_dir, progress_cb=lambda v: self._enqueue_progress(min(0.99, v)),
+                                                      stats_cb=self._copy_stats_logger("[校验备份]"), cancel=self._cancel_token())
+                    self._report_verify_result("[校验备份]", result)
+                    speed = result['bytes'] / (1024**2) / max(result['elapsed'], 1e-6)
+                    mode = f"哈希 {result['hash_algo']}" if result['hash_algo'] else "仅大小（清单无哈希）"
+                    if result['unhashed']:
+                        mode += f"，{result['unhashed']} 个文件无哈希仅核对大小"
+                    self._text_enqueue(f"[校验备份] {'✅ 备份完整' if result['ok'] else '❌ 备份不完整'}："
+                                       f"{result['checked']}/{result['total_files']} 文件 {result['bytes'] / (1024**3):.2f} GB，"
+                                       f"{mode}，{result['elapsed']:.1f}秒，{speed:.1f} MB/s")
+                except Exception as e:
+                    self._text_enqueue(f"[校验备份] ❌ 校验失败: {e}")
+                finally:
+                    self._enqueue_progress_hide()
+            self.jobs.submit('verify', f"校验备份 {os.path.basename(backup_dir)}", _worker, pausable=True,
+                             reads=(os.path.dirname(os.path.abspath(backup_dir)),))
+        except Exception as e:
+            self._text_enqueue(f"[校验备份] ❌ 启动校验失败: {e}")
+
+    def manage_snapshots(self):
+        """列出备份目录中的快照，并可按保留策略清理"""
+        try:
+            backup_root = self._ask_directory_dark("选择快照所在的备份目录")
+            if not backup_root:
+                return
+            snaps = self.tools.list_snapshots(backup_root)
+            if not snaps:
+                self._text_enqueue(f"[快照] 目录中没有带清单的快照: {backup_root}")
+                return
+            self._text_enqueue(f"[快照] 📚 {backup_root} 中共 {len(snaps)} 个快照：")
+            stored_total = 0
+            for snap in snaps:
+                stored_total += snap['stored_bytes']
+                created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snap['created']))
+                state = '' if snap['complete'] else '（未完成）'
+                if snap['kind'] != 'snapshot':
+                    state += '（完整备份，不参与清理）'
+                self._text_enqueue(f"  - {snap['name']}{state}  {created}  {snap['total_files']} 文件 "
+                                   f"{snap['total_bytes'] / (1024**3):.2f} GB，新写入 {snap['stored_bytes'] / (1024**2):.1f} MB")
+            self._text_enqueue(f"[快照] 💾 实际占用约 {stored_total / (1024**3):.2f} GB")
+            to_remove = self.tools.prune_snapshots(backup_root, self.snapshot_keep_last, self.snapshot_keep_daily, dry_run=True)
+            if not to_remove:
+                self._text_enqueue(f"[快照] 当前快照均在保留策略内（最近 {self.snapshot_keep_last} 个 + 最近 {self.snapshot_keep_daily} 天每天 1 个）")
+                return
+            names = '\n'.join(os.path.basename(p) for p in to_remove)
+            if not self._show_dark_confirm("🧹 清理快照", f"按保留策略（最近 {self.snapshot_keep_last} 个 + 最近 {self.snapshot_keep_daily} 天每天 1 个）将删除以下快照：\n\n{names}\n\n是否继续？"):
+                return
+
+            def _prune():
+                removed = self.tools.prune_snapshots(backup_root, self.snapshot_keep_last, self.snapshot_keep_daily)
+                self._text_enqueue(f"[快照] ✅ 已清理 {len(removed)} 个快照")
+            self.jobs.submit('backup', f"清理快照 {os.path.basename(backup_root)}", _prune, writes=(backup_root,))
+        except Exception as e:
+            self._text_enqueue(f"[快照] ❌ 快照管理失败: {e}")
+
+    def show_jobs_panel(self):
+        """任务管理面板：列出运行中与已结束的后台任务（状态、进度、耗时、最近消息），可取消/暂停/继续"""
+        panel = getattr(self, '_jobs_panel', None)
+        if panel is not None and panel.winfo_exists():
+            panel.deiconify()
+            panel.lift()
+            return
+        panel = ctk.CTkToplevel(self)
+        panel.title("任务管理")
+        panel.geometry("760x420")
+        panel.transient(self)
+        self._set_dark_titlebar(panel)
+        self._jobs_panel = panel
+
+        state_names = {'pending': '等待中', 'running': '运行中', 'paused': '已暂停', 'cancelling': '取消中',
+                       'finished': '已完成', 'failed': '失败', 'cancelled': '已取消'}
+        font = ctk.CTkFont(family="Microsoft YaHei", size=12)
+        body = ctk.CTkScrollableFrame(panel)
+        body.pack(fill='both', expand=True, padx=10, pady=(10, 4))
+        bottom = ctk.CTkFrame(panel, fg_color="transparent")
+        bottom.pack(fill='x', padx=10, pady=(0, 10))
+        summary = ctk.CTkLabel(bottom, text="", font=font, anchor='w')
+        summary.pack(side='left', fill='x', expand=True)
+        ctk.CTkButton(bottom, text="清除已完成", width=90, command=lambda: self.jobs.clear_finished(), font=font).pack(side='right', padx=4)
+        ctk.CTkButton(bottom, text="全部取消", width=80, command=lambda: self.jobs.cancel_all(), font=font).pack(side='right', padx=4)
+        rows = {}  # job.id -> (行框架, 标签, 按钮框架, 上次的状态)
+
+        def _row_buttons(frame, job):
+            for w in frame.winfo_children():
+                w.destroy()
+            if job.state == 'paused':
+                ctk.CTkButton(frame, text="继续", width=50, command=job.resume, font=font).pack(side='left', padx=2)
+            elif job.pausable and job.state == 'running':
+                ctk.CTkButton(frame, text="暂停", width=50, command=job.pause, font=font).pack(side='left', padx=2)
+            if job.active and job.state != 'cancelling':
+                ctk.CTkButton(frame, text="取消", width=50, command=job.cancel, font=font).pack(side='left', padx=2)
+
+        def _refresh():
+            if not panel.winfo_exists():
+                return
+            try:
+                jobs = self.jobs.jobs()
+                alive = {j.id for j in jobs}
+                for job_id in [i for i in rows if i not in alive]:
+                    rows.pop(job_id)[0].destroy()
+                for job in jobs:
+                    row = rows.get(job.id)
+                    if row is None:
+                        # 新任务插到最上方
+                        slaves = body.pack_slaves()
+                        first = slaves[0] if slaves else None
+                        frame = ctk.CTkFrame(body)
+                        if first is not None:
+                            frame.pack(fill='x', pady=2, before=first)
+                        else:
+                            frame.pack(fill='x', pady=2)
+                        label = ctk.CTkLabel(frame, text="", font=font, anchor='w', justify='left')
+                        label.pack(side='left', fill='x', expand=True, padx=6)
+                        buttons = ctk.CTkFrame(frame, fg_color="transparent")
+                        buttons.pack(side='right', padx=4)
+                        row = rows[job.id] = [frame, label, buttons, None]
+                    if row[3] != job.state:
+                        _row_buttons(row[2], job)
+                        row[3] = job.state
+                    progress = '' if job.state in ('pending', 'finished') else f"  {job.progress * 100:.0f}%"
+                    detail = job.error if job.state == 'failed' and job.error else job.message
+                    if len(detail) > 70:
+                        detail = detail[:70] + '…'
+                    row[1].configure(text=f"#{job.id} {job.title}\n{state_names.get(job.state, job.state)}{progress}  "
+                                          f"耗时 {job.duration:.1f}秒  {detail}")
+                running = len([j for j in jobs if j.active])
+                summary.configure(text=f"运行中 {running} 个，共 {len(jobs)} 个任务")
+            except Exception:
+                pass
+            panel.after(500, _refresh)
+
+        _refresh()
+
+    def _native_copy(self, src_dir, dst_dir, manifest, hash_files=False, throttle=None):
+        """使用后端的并行复制引擎，按字节推进进度条，每 5 秒输出一次精确进度。"""
+        self._text_enqueue(f"[系统复制] 📁 源目录: {src_dir}")
+        self._text_enqueue(f"[系统复制] 💾 目标目录: {dst_dir}")
+        try:
+            self._enqueue_progress_show(0.0)
+        except Exception:
+            pass
+        stats = self.tools.copy_tree(src_dir, dst_dir, progress_cb=lambda v: self._enqueue_progress(min(0.99, v)),
+                                     stats_cb=self._copy_stats_logger("[系统复制]"), cancel=self._cancel_token(), manifest=manifest,
+                                     hash_files=hash_files, throttle=throttle)
+        self._text_enqueue(f"[系统复制] 📊 {stats['total_files']} 个文件，{stats['dirs']} 个目录，"
+                           f"{stats['total_bytes'] / (1024**3):.2f} GB，{stats['workers']} 线程")
+        errors = stats.get('errors') or []
+        if errors:
+            self._text_enqueue(f"[系统复制] ⚠️ {len(errors)} 个项目复制失败：")
+            for path, reason in errors[:10]:
+                self._text_enqueue(f"  - {path}: {reason}")
+        if stats.get('cancelled'):
+            self._text_enqueue("[系统复制] ⚠️ 复制已取消")
+        elif stats.get('ok'):
+            self._enqueue_progress(1.0)
+            speed = stats['bytes'] / (1024**2) / max(stats['elapsed'], 1e-6)
+            self._text_enqueue(f"[系统复制] ✅ 完成！{stats['files']} 文件 {stats['elapsed']:.1f}秒，平均 {speed:.1f} MB/s")
+            if stats.get('throttle_wait'):
+                self._text_enqueue(f"[系统复制] 🐢 限速等待累计 {stats['throttle_wait']:.1f} 线程·秒")
+        return bool(stats.get('ok')), stats
+
+    def _windows_os_copy(self, src_dir, dst_dir, manifest, exclude=(), throttle=None):
+        """Windows系统使用robocopy：总量取自清单，进度取自robocopy自身逐文件输出（/BYTES），不再轮询遍历目标目录"""
+        stats = {'ok': False, 'files': 0, 'bytes': 0, 'dirs': len(manifest['dirs']),
+                 'total_files': manifest['total_files'], 'total_bytes': manifest['total_bytes'],
+                 'errors': [], 'elapsed': 0.0, 'workers': 1, 'cancelled': False}
         try:
             # 路径验证
             src_dir = os.path.normpath(src_dir)
@@ -1233,51 +1859,16 @@ class ComfyUIEnvironmentManager(ctk.CTk):
             
             if not os.path.exists(src_dir):
                 self._text_enqueue(f"[系统复制] ❌ 源目录不存在: {src_dir}")
-                return False
+                return False, stats
             
             self._text_enqueue(f"[系统复制] 📁 源目录: {src_dir}")
             self._text_enqueue(f"[系统复制] 💾 目标目录: {dst_dir}")
-            
-            # 强制立即处理初始消息
-            try:
-                self._drain_ui_queue()
-            except Exception:
-                pass
-            
-            # 先统计总文件数用于显示
-            total_files = 0
-            for root, dirs, files in os.walk(src_dir):
-                total_files += len(files)
-            
-            self._text_enqueue(f"[系统复制] 📊 总计: {total_files} 个文件")
-            
-            # 估算平均每目录文件数（用于更准确的进度估算）
-            dir_count = 0
-            file_count = 0
-            try:
-                for root, dirs, files in os.walk(src_dir):
-                    if len(root.replace(src_dir, '').split(os.sep)) <= 2:  # 只统计前两层
-                        dir_count += len(dirs)
-                        file_count += len(files)
-                avg_files_per_dir = file_count / max(dir_count, 1)
-            except:
-                avg_files_per_dir = 10  # 默认值
-            
-            self._text_enqueue(f"[系统复制] 📊 平均每目录文件数: {avg_files_per_dir:.1f}")
-            
-            # 使用robocopy，每50个文件显示一次进度
+            total_files = stats['total_files']
+            total_bytes = stats['total_bytes']
+            self._text_enqueue(f"[系统复制] 📊 总计: {total_files} 个文件，{total_bytes / (1024**3):.2f} GB")
             self._text_enqueue(f"[系统复制] 🚀 robocopy开始复制...")
             self._text_enqueue(f"[系统复制] ⏱️ 开始时间: {time.strftime('%H:%M:%S')}")
-            self._text_enqueue(f"[系统复制] ⏰ 进度更新间隔: 5秒")
-            start_time = time.time()
             
-            # 强制立即处理开始消息
-            try:
-                self._drain_ui_queue()
-            except Exception:
-                pass
-            
-            # 优化方案：后台robocopy + 轻量级进度监控
             robocopy_cmd = [
                 'robocopy', src_dir, dst_dir, 
                 '/E',        # 复制子目录，包括空目录
@@ -1286,195 +1877,146 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                 '/W:2',      # 等待2秒
                 '/NP',       # 无进度百分比（减少输出）
                 '/NDL',      # 不记录目录名（减少输出）
-                '/NFL'       # 不记录文件名（减少输出）
+                '/NJH',      # 无作业头
+                '/NJS',      # 无作业摘要
+                '/BYTES',    # 文件大小以字节输出，用于按字节统计进度
             ]
+            if exclude:
+                robocopy_cmd += ['/XF', *exclude]
+            creationflags = subprocess.CREATE_NO_WINDOW if hasattr(subprocess, 'CREATE_NO_WINDOW') else 0
+            if throttle is not None:
+                # robocopy 以 64KB 为块，/IPG 为块间等待毫秒数，据此换算带宽上限；低优先级时以低于正常的进程优先级运行
+                if throttle.bytes_per_sec:
+                    robocopy_cmd.append(f"/IPG:{max(1, int(64 * 1024 * 1000 / throttle.bytes_per_sec))}")
+                if throttle.low_priority:
+                    creationflags |= getattr(subprocess, 'BELOW_NORMAL_PRIORITY_CLASS', 0)
             
             self._text_enqueue(f"[系统复制] 📝 执行命令: {' '.join(robocopy_cmd[:3])} ...")
-            self._text_enqueue(f"[系统复制] ⚡ 极速模式：最小性能影响")
             try:
                 self._enqueue_progress_show(0.0)
             except Exception:
                 pass
             
-            # 方案：后台线程执行robocopy + 轻量级进度检查
-            import threading
-            
+            counters = {'files': 0, 'bytes': 0}
             copy_completed = False
             copy_error = None
             copy_return_code = -1
+            job = current_job()
             
             def copy_thread():
                 nonlocal copy_completed, copy_error, copy_return_code
                 try:
                     # 在后台线程中启动robocopy进程，便于程序退出时可终止
-                    self._robocopy_proc = subprocess.Popen(
+                    self._robocopy_proc = spawn_process(
                         robocopy_cmd,
-                        stdout=subprocess.DEVNULL,
+                        stdout=subprocess.PIPE,
                         stderr=subprocess.DEVNULL,
                         text=True,
-                        creationflags=subprocess.CREATE_NO_WINDOW if hasattr(subprocess, 'CREATE_NO_WINDOW') else 0
+                        errors='replace',
+                        creationflags=creationflags
                     )
+                    if job is not None:
+                        job.attach_process(self._robocopy_proc)  # 取消任务时终止 robocopy
+                    # 每个已复制文件输出一行：\t 类型 \t\t 字节数 \t 文件名
+                    for line in self._robocopy_proc.stdout:
+                        fields = [f.strip() for f in line.split('\t') if f.strip()]
+                        if len(fields) >= 2 and fields[-2].isdigit():
+                            counters['files'] += 1
+                            counters['bytes'] += int(fields[-2])
                     copy_return_code = self._robocopy_proc.wait()
-                    copy_completed = True
                 except Exception as e:
                     copy_error = str(e)
+                finally:
                     copy_completed = True
             
-            # 启动后台复制线程
-            thread = threading.Thread(target=copy_thread, daemon=True)
+            thread = Thread(target=copy_thread, daemon=True)
             thread.start()
             
-            self._text_enqueue(f"[系统复制] 🚀 robocopy后台进程已启动")
             start_time = time.time()
-            last_files_count = 0
-            last_full_scan_time = time.time() - 10.0
-            
+            last_log = start_time
+            last_bytes = 0
             while not copy_completed and thread.is_alive():
-                time.sleep(5.0)
-                now = time.time()
-                elapsed = now - start_time
-                
-                if now - last_full_scan_time >= 10.0:
-                    scan_files = 0
-                    try:
-                        if os.path.exists(dst_dir):
-                            for root, dirs, files in os.walk(dst_dir):
-                                scan_files += len(files)
-                    except Exception:
-                        scan_files = last_files_count
-                    
-                    last_files_count = scan_files
-                    last_full_scan_time = now
-                    progress_percent = (scan_files / total_files) * 100 if total_files > 0 else 0
-                    self._text_enqueue(f"[系统复制] 📈 进度: {scan_files}/{total_files} ({progress_percent:.1f}%) 已用: {elapsed:.1f}秒")
-                    try:
-                        self.progress_var.set(min(95, progress_percent))
-                        self._enqueue_progress(min(0.95, (progress_percent / 100.0)))
-                    except Exception:
-                        pass
-                else:
-                    progress_percent = (last_files_count / total_files) * 100 if total_files > 0 else 0
-                    try:
-                        self.progress_var.set(min(95, progress_percent))
-                        self._enqueue_progress(min(0.95, (progress_percent / 100.0)))
-                    except Exception:
-                        pass
-                
+                time.sleep(0.5)
+                done_bytes = counters['bytes']
+                fraction = done_bytes / total_bytes if total_bytes else counters['files'] / max(1, total_files)
                 try:
-                    self._drain_ui_queue()
-                except:
+                    self._enqueue_progress(min(0.99, fraction))
+                except Exception:
                     pass
+                now = time.time()
+                if now - last_log >= 5.0:
+                    live = (done_bytes - last_bytes) / (1024**2) / max(now - last_log, 1e-6)
+                    last_log, last_bytes = now, done_bytes
+                    speed = done_bytes / (1024**2) / max(now - start_time, 1e-6)
+                    self._text_enqueue(f"[系统复制] 📈 进度: {counters['files']}/{total_files} 文件 ({fraction * 100:.1f}%)，"
+                                       f"实时 {live:.1f} MB/s，平均 {speed:.1f} MB/s，已用: {now - start_time:.1f}秒")
             
-            # 等待线程完成
             thread.join(timeout=10)  # 最多等待10秒收尾
-            
-            # 获取最终结果
-            total_time = time.time() - start_time
-            
-            if copy_error:
-                self._text_enqueue(f"[系统复制] ⚠️ 复制错误: {copy_error}")
-            
-            # 最终文件统计
-            final_files = 0
-            try:
-                if os.path.exists(dst_dir):
-                    for root, dirs, files in os.walk(dst_dir):
-                        final_files += len(files)
-            except:
-                pass
-            
-            # 最终文件统计（完整遍历一次）
-            final_files = 0
-            try:
-                if os.path.exists(dst_dir):
-                    for root, dirs, files in os.walk(dst_dir):
-                        final_files += len(files)
-            except:
-                final_files = last_files_count  # 使用最后一次的估算值
-            
             total_time = time.time() - start_time
+            stats.update(files=counters['files'], bytes=counters['bytes'], elapsed=total_time)
             
             if copy_error:
                 self._text_enqueue(f"[系统复制] ⚠️ 复制错误: {copy_error}")
+                stats['errors'] = [(src_dir, copy_error)]
             
-            # robocopy返回码判断
-            success = (copy_return_code <= 7) and not copy_error
+            # robocopy返回码判断（0~7 为成功，未变化的文件不会输出，故完成后以清单总量为准）
+            success = (0 <= copy_return_code <= 7) and not copy_error
+            stats['ok'] = success
             if success:
-                self.progress_var.set(100)
+                stats['bytes'] = total_bytes
                 try:
                     self._enqueue_progress(1.0)
                 except Exception:
                     pass
-                # 简洁的完成信息
-                self._text_enqueue(f"[系统复制] ✅ 完成！{final_files} 文件 {total_time:.1f}秒")
-                if total_time > 0 and final_files > 0:
-                    speed = final_files / total_time
-                    self._text_enqueue(f"[系统复制] 🚀 {speed:.1f} 文件/秒")
-                # 清理进程句柄
-                try:
-                    self._robocopy_proc = None
-                except Exception:
-                    pass
-            
-            return success
+                speed = total_bytes / (1024**2) / max(total_time, 1e-6)
+                self._text_enqueue(f"[系统复制] ✅ 完成！复制 {counters['files']}/{total_files} 文件 {total_time:.1f}秒，{speed:.1f} MB/s")
+            self._robocopy_proc = None
+            return success, stats
                 
         except Exception as e:
             self._text_enqueue(f"[系统复制] ❌ 系统复制异常: {e}")
-            return False
+            return False, stats
     
-    def _get_directory_size(self, path):
-        """获取目录总大小"""
-        total_size = 0
-        try:
-            for dirpath, dirnames, filenames in os.walk(path):
-                for filename in filenames:
-                    filepath = os.path.join(dirpath, filename)
-                    if os.path.exists(filepath):
-                        total_size += os.path.getsize(filepath)
-        except Exception:
-            pass
-        return total_size
-
-    def _start_backup_ui_update(self):
-        """启动备份UI更新定时器"""
-        try:
-            self.backup_ui_update_id = self.after(100, self._update_backup_ui)
-            self._text_enqueue("[备份] UI更新定时器已启动")
-        except Exception as e:
-            self._text_enqueue(f"[备份] ❌ 启动UI更新定时器失败: {e}")
-            self._restore_backup_ui_state()
+    def _restore_backup_ui_state(self):
+        """恢复备份UI状态"""
+        if hasattr(self, 'backup_button'):
+            self.backup_button.configure(state="normal")
 
-    def _update_backup_ui(self):
-        """更新备份UI状态"""
+    def rollback_last_install(self):
+        """回滚最近一次安装事务（恢复安装前被改动包的旧版本）"""
         try:
-            if hasattr(self, 'backup_status') and self.backup_status.get('completed'):
-                # 备份完成，恢复UI状态
-                self._text_enqueue("[备份] 检测到备份完成，正在恢复UI状态...")
-                self._restore_backup_ui_state()
-                self._enqueue_progress_hide()
-                self._text_enqueue("[备份] UI状态恢复完成")
+            txns = self.tools.list_install_transactions()
+            if not txns:
+                self._show_dark_info("回滚安装", "没有可回滚的安装记录。", "实际安装、库安装和库列表还原前会自动记录将被改动的包。")
+                return
+            txn = txns[0]
+            changed = [f"{v.get('name')}=={v.get('version')}" for v in txn.previous.values()]
+            created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(txn.created))
+            msg = (f"最近一次安装: {txn.label}\n时间: {created}\n环境: {txn.python_exe}\n\n"
+                   f"将恢复 {len(changed)} 个包的安装前版本，卸载 {len(txn.added)} 个新增包。\n")
+            if changed:
+                msg += "\n恢复: " + ", ".join(changed[:10]) + (" 等" if len(changed) > 10 else "") + "\n"
+            if txn.added:
+                msg += "卸载: " + ", ".join(txn.added[:10]) + (" 等" if len(txn.added) > 10 else "") + "\n"
+            if os.path.normcase(txn.python_exe) != os.path.normcase(self.python_exe_path or ''):
+                msg += "\n⚠️ 该记录不属于当前选择的 Python 环境。\n"
+            if not self._show_dark_confirm("确认回滚安装", msg + "\n是否回滚？"):
                 return
-            
-            # 继续更新
-            if hasattr(self, 'backup_ui_update_id'):
-                self.backup_ui_update_id = self.after(100, self._update_backup_ui)
         except Exception as e:
-            self._text_enqueue(f"[备份] UI更新出错: {e}")
-            self._restore_backup_ui_state()
+            self._text_enqueue(f"[安装回滚] ❌ 读取安装记录失败: {e}")
+            return
 
-    def _restore_backup_ui_state(self):
-        """恢复备份UI状态"""
-        if hasattr(self, 'backup_button'):
-            self.backup_button.configure(state="normal")
-        
-        # 清理备份状态
-        if hasattr(self, 'backup_status'):
-            del self.backup_status
-        
-        if hasattr(self, 'backup_ui_update_id'):
-            if self.backup_ui_update_id:
-                self.after_cancel(self.backup_ui_update_id)
-            del self.backup_ui_update_id
+        def _task():
+            try:
+                self._enqueue_progress_show(0.2)
+                self._text_enqueue(f"[安装回滚] 🔄 正在回滚: {txn.label}")
+                self._enqueue_text(self.tools.rollback_install_transaction(txn))
+            except Exception as e:
+                self._text_enqueue(f"[安装回滚] ❌ 回滚出错: {e}")
+            finally:
+                self._enqueue_progress(1.0)
+                self._enqueue_progress_hide()
+        self.jobs.submit('install', f"回滚安装 {txn.label}", _task, writes=(txn.python_exe,))
 
     def restore_from_env_list(self):
         """从环境库列表TXT文件还原Python库（从查看环境保存的文件还原）"""
@@ -1545,7 +2087,7 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                 return
             
             self._text_enqueue(f"[库列表还原] 已读取到 {len(packages)} 个包")
-            mirror_url = PYPI_MIRRORS.get(self.mirror_var.get(), '')
+            index_url = mirror_url(self.mirror_var.get())
             confirm1 = self._show_dark_confirm(
                 "⚠️ 第一次确认",
                 f"确定要按库列表进行环境对齐吗？\n\n源文件: {os.path.basename(env_file)}\n包数量: {len(packages)}\n\n此操作将比较当前环境与库列表：\n1. 多余的包将被卸载\n2. 版本不一致的包将按列表版本安装\n3. 缺少的包将被安装\n\n是否继续？"
@@ -1567,139 +2109,85 @@ class ComfyUIEnvironmentManager(ctk.CTk):
             if not confirm3:
                 self._text_enqueue("[库列表还原] 用户在最终确认时取消")
                 return
-            def _run():
-                try:
-                    self._perform_env_list_restore(packages, env_file, False, True, mirror_url)
-                except Exception as e:
-                    self._text_enqueue(f"[库列表还原] 运行出错: {e}")
-            Thread(target=_run, daemon=True).start()
+            self.jobs.submit('env_list_restore', f"按库列表还原 {os.path.basename(env_file)}",
+                             self._perform_env_list_restore, packages, env_file, False, True, index_url,
+                             writes=(self.python_exe_path,))
             
         except Exception as e:
             self._text_enqueue(f"[库列表还原] 启动还原失败: {str(e)}")
             self._enqueue_progress_hide()
     
-    def _perform_env_list_restore(self, packages, env_file, upgrade=False, force_reinstall=False, index_url=""):
-        """执行库列表还原操作"""
+    def _perform_env_list_restore(self, packages, env_file, upgrade=False, force_reinstall=False, index_url="", resume_job=None):
+        """执行库列表还原操作（每个步骤写入任务日志，中断后可从未完成步骤继续）"""
+        job_id = None
         try:
             self._text_enqueue(f"[库列表还原] 开始对比并按库列表还原环境...")
             self._enqueue_progress_show(0.05)
             python_exe = self.python_exe_path
-            desired = {}
-            for s in packages:
-                t = (s or '').strip()
-                if not t:
-                    continue
-                if '==' in t:
-                    name, ver = t.split('==', 1)
-                    desired[(name or '').strip().lower()] = (ver or '').strip().lstrip('v')
-                else:
-                    parts = t.split()
-                    if len(parts) >= 2:
-                        desired[(parts[0] or '').strip().lower()] = (parts[1] or '').strip().lstrip('v')
-                    elif len(parts) == 1:
-                        desired[(parts[0] or '').strip().lower()] = ''
-            self._text_enqueue(f"[库列表还原] 列表包数量: {len(desired)}")
-            res = subprocess.run([python_exe, '-m', 'pip', 'list', '--format=json'], capture_output=True, text=True, timeout=300, creationflags=CREATE_NO_WINDOW)
-            installed_json = (res.stdout or '').strip() if res.returncode == 0 else '[]'
-            try:
-                installed_list = json.loads(installed_json)
-            except Exception:
-                installed_list = []
-            installed = {str(x.get('name', '')).strip().lower(): str(x.get('version', '')).strip() for x in installed_list if x.get('name')}
-            protected = {'pip', 'setuptools', 'wheel'}
-            to_uninstall = [n for n in installed.keys() if n not in desired and n not in protected]
-            to_install = []
-            matched = 0
-            total_check = max(len(desired), 1)
-            idx_check = 0
-            for n, v in desired.items():
-                idx_check += 1
-                cur = installed.get(n, '')
-                if v:
-                    if cur == v:
-                        matched += 1
-                        self._text_enqueue(f"[库列表还原] 已匹配: {n}=={v}")
-                    else:
-                        to_install.append(f"{n}=={v}")
-                else:
-                    if n in installed:
-                        matched += 1
-                        self._text_enqueue(f"[库列表还原] 已存在: {n}=={cur}")
-                    else:
-                        to_install.append(n)
-                self._enqueue_progress(0.08 + idx_check / total_check * 0.02)
-            self._text_enqueue(f"[库列表还原] 需要卸载: {len(to_uninstall)}，需要安装/变更: {len(to_install)}")
+            if resume_job:
+                job_id = resume_job['id']
+                python_exe = resume_job['params'].get('python_exe') or python_exe
+                remaining = resume_job.get('remaining') or []
+                to_uninstall = [s.split(':', 1)[1] for s in remaining if s.startswith('uninstall:')]
+                to_install = [s.split(':', 1)[1] for s in remaining if s.startswith('install:')]
+                self._text_enqueue(f"[库列表还原] ⏯️ 继续中断的任务：剩余卸载 {len(to_uninstall)}，剩余安装 {len(to_install)}")
+            else:
+                to_uninstall, to_install = self._diff_env_list(packages, python_exe)
+                steps = [f"uninstall:{n}" for n in to_uninstall] + [f"install:{s}" for s in to_install]
+                job_id = self.tools.journal.start_job(
+                    'env_list_restore', steps,
+                    {'packages': list(packages), 'env_file': env_file, 'upgrade': upgrade, 'force_reinstall': force_reinstall,
+                     'index_url': index_url, 'python_exe': python_exe},
+                    title=f"按库列表还原 {os.path.basename(env_file)}"
+                )
+                if to_uninstall or to_install:
+                    # 暂存将被改动的包，便于通过“回滚安装”恢复
+                    self.tools.begin_install_transaction(
+                        python_exe, [], label=f"库列表还原 {os.path.basename(env_file)}",
+                        fallback_names=to_uninstall + to_install
+                    )
             self._enqueue_progress(0.1)
             if to_uninstall:
                 total_un = len(to_uninstall)
                 for i, name in enumerate(to_uninstall):
+                    job_checkpoint()
                     self._text_enqueue(f"[库列表还原] 卸载 {name} ({i+1}/{total_un})")
                     cmd = [python_exe, '-m', 'pip', 'uninstall', '-y', name]
                     try:
-                        subprocess.run(cmd, capture_output=True, text=True, timeout=600, creationflags=CREATE_NO_WINDOW)
+                        proc = spawn_process(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, creationflags=CREATE_NO_WINDOW)
+                        out, _ = proc.communicate(timeout=600)
+                        job_checkpoint()
+                        ok = proc.returncode == 0
+                        tail = '\n'.join((out or '').strip().splitlines()[-5:])
+                        self.tools.journal.record_step(job_id, f"uninstall:{name}", ok, '' if ok else tail)
+                        if not ok:
+                            self._text_enqueue(f"[库列表还原] 卸载失败: {name} (返回码 {proc.returncode})\n{tail}")
                     except Exception as e:
+                        self.tools.journal.record_step(job_id, f"uninstall:{name}", False, str(e))
                         self._text_enqueue(f"[库列表还原] 卸载出错: {name} - {e}")
                     self._enqueue_progress(0.1 + (i + 1) / max(total_un, 1) * 0.3)
-            if to_install:
-                base_cmd = [python_exe, '-m', 'pip', 'install']
+            base_cmd = [python_exe, '-m', 'pip', 'install']
             if force_reinstall:
                 base_cmd.append('--force-reinstall')
             if upgrade:
                 base_cmd.append('--upgrade')
-            if index_url:
-                base_cmd.extend(['--index-url', index_url])
-                base_url = index_url.split('//')[-1].split('/')[0]
-                base_cmd.extend(['--trusted-host', base_url])
-                base_cmd.extend(['--extra-index-url', 'https://pypi.org/simple'])
-                base_cmd.extend(['--trusted-host', 'pypi.org'])
-            failed_packages = []
+            # 由索引地址反查镜像名；安装失败时按镜像健康度自动切换（官方源兜底）
+            mirror_name = next((n for n, u in PYPI_MIRRORS.items() if index_url and u == index_url), '')
+            failed_packages = []  # 继续任务时上次失败的步骤已在 remaining 中重试，不再预先计为失败
             total_in = len(to_install)
             for i, spec in enumerate(to_install):
+                job_checkpoint()
                 self._text_enqueue(f"[库列表还原] 安装 {spec} ({i+1}/{total_in})")
-                cmd = base_cmd + [spec]
-                try:
-                    result = subprocess.run(cmd, capture_output=True, text=True, timeout=1200, creationflags=CREATE_NO_WINDOW)
-                    if result.returncode != 0:
-                        err_text = (result.stderr or '') + '\n' + (result.stdout or '')
-                        need_retry = ('No matching distribution found' in err_text) or ('Could not find a version that satisfies' in err_text)
-                        if need_retry:
-                            self._text_enqueue(f"[库列表还原] 备用源重试 {spec}")
-                            fallback_cmd = [python_exe, '-m', 'pip', 'install']
-                            if force_reinstall:
-                                fallback_cmd.append('--force-reinstall')
-                            if upgrade:
-                                fallback_cmd.append('--upgrade')
-                            fallback_cmd.append(spec)
-                            try:
-                                retry = subprocess.run(fallback_cmd, capture_output=True, text=True, timeout=1200, creationflags=CREATE_NO_WINDOW)
-                                if retry.returncode != 0:
-                                    failed_packages.append(spec)
-                                    msg = (retry.stderr or '').strip().split('\n')[-5:]
-                                    for line in msg:
-                                        if line.strip() and not line.startswith('  ') and 'WARNING' not in line:
-                                            self._text_enqueue(f"[库列表还原] {line.strip()}")
-                                else:
-                                    self._text_enqueue(f"[库列表还原] 备用源安装成功 {spec}")
-                            except subprocess.TimeoutExpired:
-                                failed_packages.append(spec)
-                                self._text_enqueue(f"[库列表还原] 备用源安装超时，跳过 {spec}")
-                            except Exception as e:
-                                failed_packages.append(spec)
-                                self._text_enqueue(f"[库列表还原] 备用源安装出错: {spec} - {e}")
-                        else:
-                            failed_packages.append(spec)
-                            if result.stderr:
-                                errs = result.stderr.strip().split('\n')[-5:]
-                                for line in errs:
-                                    if line.strip() and not line.startswith('  ') and 'WARNING' not in line:
-                                        self._text_enqueue(f"[库列表还原] {line.strip()}")
-                except subprocess.TimeoutExpired:
+                ok, reason, used = self.tools.run_pip_with_failover(base_cmd + [spec], mirror_name, timeout=1200, tag='[库列表还原]')
+                job_checkpoint()  # 取消时 pip 被终止，该步骤不记入日志，下次启动可继续
+                if not ok:
                     failed_packages.append(spec)
-                    self._text_enqueue(f"[库列表还原] 安装超时，跳过 {spec}")
-                except Exception as e:
-                    failed_packages.append(spec)
-                    self._text_enqueue(f"[库列表还原] 安装出错: {spec} - {e}")
+                    self._text_enqueue(f"[库列表还原] 安装失败 {spec}: {reason}")
+                elif used != mirror_name:
+                    self._text_enqueue(f"[库列表还原] 备用源安装成功 {spec}")
+                self.tools.journal.record_step(job_id, f"install:{spec}", ok)
                 self._enqueue_progress(0.4 + (i + 1) / max(total_in, 1) * 0.5)
+            self.tools.journal.finish_job(job_id)
             if failed_packages:
                 self._text_enqueue(f"[库列表还原] 安装失败 {len(failed_packages)} 个")
                 save_failed = self._show_dark_confirm("⚠️ 保存失败列表", "是否将安装失败的包列表保存到文件？\n\n保存失败包列表可以帮助您手动处理这些包。\n\n是否保存？")
@@ -1709,11 +2197,63 @@ class ComfyUIEnvironmentManager(ctk.CTk):
             self._text_enqueue(f"[库列表还原] 📄 源文件: {os.path.basename(env_file)}")
             self._text_enqueue("[库列表还原] 💡 建议重新启动程序以确保所有包正确加载")
         
+        except JobCancelled:
+            self._text_enqueue("[库列表还原] ⚠️ 任务已取消，未完成的步骤可在下次启动时继续")
+            raise
         except Exception as e:
             self._text_enqueue(f"[库列表还原] 还原过程出错: {str(e)}")
         finally:
             self._enqueue_progress_hide()
     
+    def _diff_env_list(self, packages, python_exe):
+        """对比库列表与当前环境，返回 (需卸载的包名, 需安装/变更的规格)"""
+        desired = {}
+        for s in packages:
+            t = (s or '').strip()
+            if not t:
+                continue
+            if '==' in t:
+                name, ver = t.split('==', 1)
+                desired[(name or '').strip().lower()] = (ver or '').strip().lstrip('v')
+            else:
+                parts = t.split()
+                if len(parts) >= 2:
+                    desired[(parts[0] or '').strip().lower()] = (parts[1] or '').strip().lstrip('v')
+                elif len(parts) == 1:
+                    desired[(parts[0] or '').strip().lower()] = ''
+        self._text_enqueue(f"[库列表还原] 列表包数量: {len(desired)}")
+        res = subprocess.run([python_exe, '-m', 'pip', 'list', '--format=json'], capture_output=True, text=True, timeout=300, creationflags=CREATE_NO_WINDOW)
+        installed_json = (res.stdout or '').strip() if res.returncode == 0 else '[]'
+        try:
+            installed_list = json.loads(installed_json)
+        except Exception:
+            installed_list = []
+        installed = {str(x.get('name', '')).strip().lower(): str(x.get('version', '')).strip() for x in installed_list if x.get('name')}
+        protected = {'pip', 'setuptools', 'wheel'}
+        to_uninstall = [n for n in installed.keys() if n not in desired and n not in protected]
+        to_install = []
+        matched = 0
+        total_check = max(len(desired), 1)
+        idx_check = 0
+        for n, v in desired.items():
+            idx_check += 1
+            cur = installed.get(n, '')
+            if v:
+                if cur == v:
+                    matched += 1
+                    self._text_enqueue(f"[库列表还原] 已匹配: {n}=={v}")
+                else:
+                    to_install.append(f"{n}=={v}")
+            else:
+                if n in installed:
+                    matched += 1
+                    self._text_enqueue(f"[库列表还原] 已存在: {n}=={cur}")
+                else:
+                    to_install.append(n)
+            self._enqueue_progress(0.08 + idx_check / total_check * 0.02)
+        self._text_enqueue(f"[库列表还原] 需要卸载: {len(to_uninstall)}，需要安装/变更: {len(to_install)}")
+        return to_uninstall, to_install
+
     def _save_failed_packages(self, failed_packages, source_file):
         """保存安装失败的包列表"""
         try:
@@ -1779,6 +2319,17 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                                         f"备份目录 {backup_dir} 中没有文件。\n请选择包含备份文件的目录。")
                 return
             
+            # 备份清单标记为未完成（备份过程中断）时需单独确认
+            allow_incomplete = False
+            manifest_data = self.tools.load_backup_manifest(backup_dir)
+            if manifest_data and not manifest_data.get('complete', True):
+                if not self._show_dark_confirm("⚠️ 备份不完整",
+                                               f"该备份在创建时被中断或出错，清单标记为未完成：\n\n{backup_dir}\n\n"
+                                               "从不完整的备份还原可能缺少文件，导致环境不可用。\n\n仍要继续吗？"):
+                    self._text_enqueue("[还原] 备份不完整，已取消还原")
+                    return
+                allow_incomplete = True
+
             # 三次确认机制
             self._text_enqueue(f"[还原] 准备从备份目录还原: {backup_dir}")
             
@@ -1806,92 +2357,64 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                 self._text_enqueue("[还原] 用户在最终确认时取消还原操作")
                 return
             
+            # 增量还原：可选删除备份之后新增的文件，得到与备份完全一致的环境
+            delete_extras = False
+            if self.restore_mode == 'delta':
+                delete_extras = self._show_dark_confirm("🧹 精确还原",
+                                                        "是否同时删除备份之后新增的文件和目录？\n\n"
+                                                        "选择“是”：还原后的环境与备份完全一致（推荐用于撤销错误的 pip 安装）\n"
+                                                        "选择“否”：只还原有差异的文件，保留新增文件")
+            
             # 禁用还原按钮，防止重复点击
             if hasattr(self, 'restore_button'):
                 self.restore_button.configure(state="disabled")
             
-            # 启动后台还原线程
-            restore_thread = Thread(target=self._restore_worker_thread, 
-                                  args=(backup_dir, python_dir), 
-                                  daemon=True)
-            restore_thread.start()
-            
-            # 启动UI更新定时器
-            self._start_restore_ui_update()
+            # 作为可暂停的后台任务运行，结束后在主线程恢复按钮状态
+            job = self.jobs.submit('restore', f"还原 {os.path.basename(backup_dir)}", self._restore_worker_thread,
+                                   backup_dir, python_dir, delete_extras, allow_incomplete, pausable=True,
+                                   reads=(os.path.dirname(os.path.abspath(backup_dir)),), writes=(python_exe,),
+                                   on_done=lambda j: self._enqueue_call(self._restore_restore_ui_state))
+            self._text_enqueue(f"[还原] 后台还原任务 #{job.id} 已启动")
             
         except Exception as e:
             self._text_enqueue(f"[还原] 启动还原失败: {e}")
             self._restore_restore_ui_state()
 
-    def _restore_worker_thread(self, backup_dir, python_dir):
+    def _restore_worker_thread(self, backup_dir, python_dir, delete_extras=False, allow_incomplete=False):
         """后台还原工作线程 - 使用Windows系统复制命令"""
         try:
-            self.restore_status = {
-                'backup_dir': backup_dir,
-                'python_dir': python_dir,
-                'completed': False,
-                'error': None
-            }
             self._text_enqueue("[还原] 🚀 启动OS极速还原")
             self._text_enqueue(f"[还原] 📁 源目录: {backup_dir}")
             self._text_enqueue(f"[还原] 🎯 目标目录: {python_dir}")
             start_time = time.time()
-            success = self._windows_os_copy(backup_dir, python_dir)
-            if success and not self._closing:
+            if self.restore_mode == 'delta':
+                success, copy_stats = self._delta_restore_directory(backup_dir, python_dir, delete_extras, allow_incomplete)
+            else:
+                success, copy_stats = self._copy_directory(backup_dir, python_dir, exclude=(BACKUP_MANIFEST,))
+            if success and not self._job_cancelled():
                 elapsed_time = time.time() - start_time
                 self._text_enqueue("[还原] ✅ 还原完成！")
                 self._text_enqueue(f"[还原] ⏱️ 耗时: {elapsed_time:.1f}秒")
                 try:
-                    total_size = self._get_directory_size(python_dir)
-                    self._text_enqueue(f"[还原] 📦 还原大小: {total_size / (1024**3):.2f} GB")
+                    total_size = copy_stats['bytes']
+                    self._text_enqueue(f"[还原] 📦 写入数据: {total_size / (1024**3):.2f} GB")
                 except Exception:
                     pass
                 self._text_enqueue("[还原] 💡 建议重新启动程序以确保环境配置生效")
-            elif self._closing:
+            elif self._job_cancelled():
                 self._text_enqueue("[还原] ⚠️ 还原操作被取消")
             else:
-                self._text_enqueue("[还原] ❌ 系统复制失败")
+                raise RuntimeError("系统复制失败")
         except Exception as e:
-            try:
-                self.restore_status['error'] = str(e)
-            except Exception:
-                pass
-            self._text_enqueue(f"[还原] 还原失败: {e}")
+            self._text_enqueue(f"[还原] ❌ 还原失败: {e}")
+            raise
         finally:
-            try:
-                self.restore_status['completed'] = True
-            except Exception:
-                pass
-
-    def _start_restore_ui_update(self):
-        """启动还原UI更新定时器"""
-        self.restore_ui_update_id = self.after(100, self._update_restore_ui)
-
-    def _update_restore_ui(self):
-        """更新还原UI状态"""
-        if hasattr(self, 'restore_status') and self.restore_status.get('completed'):
-            # 还原完成，恢复UI状态
-            self._restore_restore_ui_state()
             self._enqueue_progress_hide()
-            return
-        
-        # 继续更新
-        if hasattr(self, 'restore_ui_update_id'):
-            self.restore_ui_update_id = self.after(100, self._update_restore_ui)
 
     def _restore_restore_ui_state(self):
         """恢复还原UI状态"""
         if hasattr(self, 'restore_button'):
             self.restore_button.configure(state="normal")
-        
-        # 清理还原状态
-        if hasattr(self, 'restore_status'):
-            del self.restore_status
-        
-        if hasattr(self, 'restore_ui_update_id'):
-            if self.restore_ui_update_id:
-                self.after_cancel(self.restore_ui_update_id)
-            del self.restore_ui_update_id
 
     def find_plugins_with_library(self):
         """查找包含指定库名的插件（弹出模式选择对话框）"""
@@ -2102,9 +2625,9 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                                         "无法更新不存在的插件目录。\n请先确保该插件已正确安装。")
                 return
             
-            # 在后台线程中执行更新，避免UI阻塞
-            import threading
-            threading.Thread(target=self._update_plugin_async, args=(url, plugin_dir, repo_name), daemon=True).start()
+            # 作为后台任务执行更新，避免UI阻塞
+            self.jobs.submit('clone', f"更新插件 {repo_name}", self._update_plugin_async, url, plugin_dir, repo_name,
+                             writes=(plugin_dir,))
                 
         except Exception as e:
             self._text_enqueue(f"[更新] 更新插件失败: {e}")
@@ -2118,8 +2641,8 @@ class ComfyUIEnvironmentManager(ctk.CTk):
             
             # 执行git pull更新插件
             cmd = ["git", "pull"]
-            proc = subprocess.Popen(cmd, cwd=plugin_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, 
-                                  text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
+            proc = spawn_process(cmd, cwd=plugin_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, 
+                               text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
             
             # 实时读取输出
             while proc.poll() is None:
@@ -2566,8 +3089,8 @@ class ComfyUIEnvironmentManager(ctk.CTk):
     def on_mirror_change(self, _=None):
         # 切换镜像源时立即保存到配置
         self.selected_mirror = self.mirror_var.get()
-        mirror_url = PYPI_MIRRORS.get(self.selected_mirror, '')
-        self.update_result_text(f"已切换到镜像源: {self.selected_mirror}{' (' + mirror_url + ')' if mirror_url else ''}")
+        index_url = mirror_url(self.selected_mirror)
+        self.update_result_text(f"已切换到镜像源: {self.selected_mirror}{' (' + index_url + ')' if index_url else ''}")
         self.save_config()
 
     def select_python_environment(self):
@@ -2606,60 +3129,28 @@ class ComfyUIEnvironmentManager(ctk.CTk):
         t = Thread(target=self._perform_mirror_test, daemon=True)
         t.start()
 
-    def _test_url_connectivity(self, url: str, timeout: float = 5.0) -> float | None:
-        # 使用 HEAD 请求测试连通性与响应时间；忽略证书以提高兼容性
-        import urllib.request, ssl, time
-        start = time.time()
-        try:
-            ctx = ssl.create_default_context()
-            ctx.check_hostname = False
-            ctx.verify_mode = ssl.CERT_NONE
-            req = urllib.request.Request(url, method='HEAD')
-            with urllib.request.urlopen(req, context=ctx, timeout=timeout) as resp:
-                if resp.status < 400:
-                    return time.time() - start
-                return None
-        except Exception:
-            return None
+    def show_mirror_ranking(self):
+        """显示当前镜像健康度排名（来自后台测速与真实安装记录）"""
+        self.update_result_text(self.tools.format_mirror_ranking())
 
     def _perform_mirror_test(self):
         try:
-            # 仅测试国内源
-            mirrors = [(name, url) for name, url in PYPI_MIRRORS.items() if url]
+            # 仅测试国内源；所有镜像并发测速，每完成一个即输出结果
+            mirrors = {name: url for name, url in PYPI_MIRRORS.items() if url}
             total = len(mirrors)
-            results: list[tuple[str, float]] = []
-            for idx, (name, url) in enumerate(mirrors):
-                # 1) 先做HTTP HEAD连通性测试
-                cost = self._test_url_connectivity(url)
-                if cost is not None:
-                    results.append((name, cost))
-                    self.update_result_text(f"[镜像测速] {name}: {cost:.2f}s (HTTP)")
-                else:
-                    # 2) 回退到pip --dry-run 测试
-                    try:
-                        import time as _t
-                        start = _t.time()
-                        host = url.split('/')[2]
-                        cmd = [self.python_exe_path or 'python', '-m', 'pip', 'install', '--dry-run', 'pip', '--index-url', url, '--trusted-host', host]
-                        proc = __import__('subprocess').run(cmd, stdout=__import__('subprocess').PIPE, stderr=__import__('subprocess').STDOUT, text=True, errors='replace', timeout=20, creationflags=CREATE_NO_WINDOW)
-                        elapsed = _t.time() - start
-                        if proc.returncode == 0:
-                            results.append((name, elapsed))
-                            self.update_result_text(f"[镜像测速] {name}: {elapsed:.2f}s (pip)")
-                        else:
-                            out = (proc.stdout or '').strip().splitlines()
-                            self.update_result_text(f"[镜像测速] {name}: 失败 (pip返回码{proc.returncode}) {out[:1]}")
-                    except Exception as e:
-                        self.update_result_text(f"[镜像测速] {name}: 异常 {e}")
-                # 更新进度条
+            finished = [0]
+
+            def _on_result(res):
+                finished[0] += 1
+                self.update_result_text(f"[镜像测速] {self.tools.format_mirror_result(res)}")
                 try:
-                    self.after(0, lambda v=(idx + 1) / max(1, total): self.progress_bar.set(v))
+                    self.after(0, lambda v=finished[0] / max(1, total): self.progress_bar.set(v))
                 except Exception:
                     pass
 
+            results = [r for r in self.tools.benchmark_mirrors(mirrors, result_cb=_on_result) if r.get('ok')]
             if results:
-                results.sort(key=lambda x: x[1])
-                fastest_mirror = results[0][0]
+                fastest_mirror = results[0]['name']
                 self.update_result_text(f"\n已自动选择最快的镜像源: {fastest_mirror}")
                 self.after(0, lambda: (self.mirror_var.set(fastest_mirror), self.on_mirror_change()))
             else:
@@ -2769,6 +3260,10 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                 self._enqueue_text(f"[插件维护] 未安装依赖的文件: {len(missing_files)} 个")
             else:
                 self._enqueue_text("[插件维护] 所有依赖均已安装，无需处理。")
+            # 安装前预测插件之间的版本冲突（本地计算，毫秒级）
+            conflicts = self.tools.predict_plugin_conflicts(dir_path, self.python_exe_path)
+            if conflicts.get('conflicts') or conflicts.get('mismatched'):
+                self._enqueue_text(self.tools.format_plugin_conflicts(conflicts))
         except Exception as e:
             self._enqueue_text(f"[插件维护] 扫描失败: {e}")
 
@@ -2785,7 +3280,9 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                                     "CustomNodes目录无效或不存在，无法作为克隆目标。\n请先选择或浏览有效的CustomNodes目录。")
             return
         self._add_to_plugin_history(url)   # 立即追加历史
-        Thread(target=self._clone_plugin_async, args=(url, dest), daemon=True).start()
+        name = url.rstrip('/').split('/')[-1].replace('.git', '')
+        self.jobs.submit('clone', f"克隆 {name}", self._clone_plugin_async, url, dest,
+                         reads=(self.python_exe_path,), writes=(os.path.join(dest, name),))
 
     def _clone_plugin_async(self, url: str, dest_dir: str, max_retry: int = 1):
         import shutil, subprocess
@@ -3118,6 +3615,7 @@ class ComfyUIEnvironmentManager(ctk.CTk):
 
     def _text_enqueue(self, text: str):
         """子线程安全追加文本"""
+        self._job_message(text)
         self._ui_queue.put(('text', text))
 
     def _list_dependency_files(self, dir_path: str):
@@ -3238,7 +3736,7 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                 self._enqueue_progress(1.0)
                 self._enqueue_progress_hide()
 
-        Thread(target=_task).start()
+        self.jobs.submit('check', f"依赖检测 {os.path.basename(req_path)}", _task, reads=(self.python_exe_path,))
 
     def start_simulation(self):
         req_path = self.deps_list_var.get()
@@ -3323,7 +3821,7 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                 self._enqueue_progress(1.0)
                 self._enqueue_progress_hide()
 
-        Thread(target=_task).start()
+        self.jobs.submit('check', f"模拟安装 {os.path.basename(req_path)}", _task, reads=(self.python_exe_path,))
 
     def view_current_env(self):
         """查看当前Python环境已安装的包"""
@@ -3562,7 +4060,7 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                 self._enqueue_progress(1.0)
                 self._enqueue_progress_hide()
                 
-        Thread(target=_task).start()
+        self.jobs.submit('install', f"实际安装 {os.path.basename(req_path)}", _task, writes=(self.python_exe_path,))
 
     def compare_environment_files(self):
         """比较两个环境文件的差异"""
@@ -3629,7 +4127,17 @@ class ComfyUIEnvironmentManager(ctk.CTk):
         if not self.python_exe_path:
             self._show_dark_warning("⚠️ 输入验证", "未选择Python环境，请先选择一个有效的Python环境")
             return
-        Thread(target=lambda: self.update_result_text(self.tools.find_conflicts())).start()
+        def _task():
+            self.update_result_text(self.tools.find_conflicts())
+            # 同时对 custom_nodes 下各插件的依赖约束做冲突预测
+            nodes_dir = self.custom_nodes_var.get().strip()
+            if nodes_dir and os.path.isdir(nodes_dir):
+                try:
+                    self.update_result_text(self.tools.format_plugin_conflicts(
+                        self.tools.predict_plugin_conflicts(nodes_dir, self.python_exe_path)))
+                except Exception as e:
+                    self.update_result_text(f"[冲突预测] 分析失败: {e}")
+        Thread(target=_task).start()
 
     def start_environment_migration(self):
         """开始环境升级迁移 - 提供两种迁移方式"""
@@ -3934,98 +4442,27 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                                        "源环境和目标环境选择了相同的路径，迁移操作没有意义。\n请选择不同的源环境和目标环境。")
                 return
                 
-            # 确认迁移（使用暗色确认对话框）
-            confirm_result = self._show_dark_confirm(
-                "确认环境迁移",
-                f"您确定要将源环境 '{os.path.basename(source_env)}' 中的包迁移到目标环境 '{os.path.basename(target_env)}' 吗？\n\n"
-                "此操作将在目标环境中安装源环境中存在但目标环境中不存在的包。"
-            )
-            
-            if not confirm_result:
-                self._text_enqueue("[环境迁移] ⚠️ 用户取消了迁移操作")
-                return
-                
-            self._text_enqueue(f"[环境迁移] 📋 开始从 '{os.path.basename(source_env)}' 迁移到 '{os.path.basename(target_env)}' ...")
+            self._text_enqueue(f"[环境迁移] 📋 正在分析 '{os.path.basename(source_env)}' → '{os.path.basename(target_env)}' 的迁移计划...")
             
-            # 执行迁移任务
-            def _migration_task():
+            # 先在后台生成预演计划（读取 dist-info 依赖图），再回到主线程确认
+            def _plan_task():
                 try:
                     self._enqueue_progress(0.15)
-                    
-                    # 获取源环境包列表
-                    self._text_enqueue(f"[环境迁移] 🔍 正在获取源环境 '{os.path.basename(source_env)}' 的包列表...")
-                    source_packages = self._get_installed_packages(source_env)
-                    if not source_packages:
-                        self._text_enqueue("[环境迁移] ❌ 无法获取源环境中的包列表或源环境中没有已安装的包")
-                        return
-                    
-                    self._enqueue_progress(0.3)
-                    
-                    # 获取目标环境包列表
-                    self._text_enqueue(f"[环境迁移] 🔍 正在获取目标环境 '{os.path.basename(target_env)}' 的包列表...")
-                    target_packages = self._get_installed_packages(target_env)
-                    
+                    plan = self.tools.plan_environment_migration(source_env, target_env)
                     self._enqueue_progress(0.45)
-                    
-                    # 计算需要安装的包（源有、目标没有）
-                    packages_to_install = []
-                    for package_name, package_version in source_packages.items():
-                        if package_name.lower() not in [p.lower() for p in target_packages.keys()]:
-                            packages_to_install.append((package_name, package_version))
-                    
-                    total_packages = len(packages_to_install)
-                    self._text_enqueue(f"[环境迁移] 📊 找到 {total_packages} 个需要安装的包")
-                    
-                    if total_packages == 0:
-                        self._text_enqueue("[环境迁移] ✅ 目标环境已经包含源环境中的所有包，无需迁移")
+                    if not plan.get('install') and not plan.get('change'):
+                        self._text_enqueue("[环境迁移] ✅ 目标环境已经包含源环境中的所有包（版本一致），无需迁移")
                         self._enqueue_progress(1.0)
+                        self._enqueue_progress_hide()
                         return
-                    
-                    self._enqueue_progress(0.5)
-                    
-                    # 安装包到目标环境
-                    success_count = 0
-                    failed_packages = []
-                    
-                    for i, (package_name, package_version) in enumerate(packages_to_install):
-                        progress = 0.5 + (i + 1) / max(1, total_packages) * 0.45
-                        self._enqueue_progress(min(progress, 0.95))
-                        
-                        self._text_enqueue(f"[环境迁移] 📦 正在安装 {package_name}=={package_version} ... ({i+1}/{total_packages})")
-                        success, reason = self._install_package_to_env(target_env, package_name, package_version)
-                        if success:
-                            success_count += 1
-                            self._text_enqueue(f"[环境迁移] ✅ 安装成功: {package_name}=={package_version}")
-                        else:
-                            failed_packages.append((f"{package_name}=={package_version}", reason))
-                            self._text_enqueue(f"[环境迁移] ❌ 安装失败: {package_name}=={package_version} | {reason}")
-                    
-                    # 显示结果
-                    self._text_enqueue("="*60)
-                    self._text_enqueue("[环境迁移] 🎉 环境迁移完成！")
-                    self._text_enqueue(f"[环境迁移] ✅ 成功安装: {success_count} 个包")
-                    self._text_enqueue(f"[环境迁移] ❌ 安装失败: {len(failed_packages)} 个包")
-                    
-                    if failed_packages:
-                        self._text_enqueue("[环境迁移] 📋 失败的包列表(按原因归类):")
-                        groups = {}
-                        for pkg, reason in failed_packages:
-                            key = reason or 'unknown error'
-                            groups.setdefault(key, []).append(pkg)
-                        for reason, pkgs in groups.items():
-                            self._text_enqueue(f"  • {reason} ({len(pkgs)}):")
-                            for pkg in pkgs:
-                                self._text_enqueue(f"    - {pkg}")
-                        self.after(100, lambda: self._ask_save_failed_packages(failed_packages))
-                        
+                    self._text_enqueue(self.tools.format_migration_plan(plan))
+                    self.after(0, lambda: self._confirm_directory_migration(plan))
                 except Exception as e:
-                    self._text_enqueue(f"[环境迁移] ❌ 执行环境迁移时出错: {e}")
-                finally:
-                    self._enqueue_progress(1.0)
+                    self._text_enqueue(f"[环境迁移] ❌ 生成迁移计划时出错: {e}")
                     self._enqueue_progress_hide()
             
-            # 启动迁移任务
-            Thread(target=_migration_task).start()
+            self.jobs.submit('migration', f"迁移计划 {os.path.basename(source_env)} → {os.path.basename(target_env)}", _plan_task,
+                             reads=(source_env, target_env))
             
         except Exception as e:
             self._text_enqueue(f"[环境迁移] ❌ 环境目录迁移初始化失败: {e}")
@@ -4075,13 +4512,10 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                     before = len(packages)
                     packages = sorted(list(set(packages)))
                     self._text_enqueue(f"[环境迁移] 📦 快照解析得到 {len(packages)} 个包 (去重前 {before})")
-                    mirror_url = PYPI_MIRRORS.get(self.mirror_var.get(), '')
-                    def _run():
-                        try:
-                            self._perform_env_list_restore(packages, snapshot, False, True, mirror_url)
-                        except Exception as e:
-                            self._text_enqueue(f"[环境迁移] 运行出错: {e}")
-                    Thread(target=_run, daemon=True).start()
+                    index_url = mirror_url(self.mirror_var.get())
+                    self.jobs.submit('migration', f"快照迁移 {os.path.basename(snapshot)}",
+                                     self._perform_env_list_restore, packages, snapshot, False, True, index_url,
+                                     writes=(self.python_exe_path,))
                     bg_started = True
                 except Exception as e:
                     self._text_enqueue(f"[环境迁移] 快照解析失败: {e}")
@@ -4102,52 +4536,83 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                 self._enqueue_progress(1.0)
                 self._enqueue_progress_hide()
 
-    def _get_installed_packages(self, python_env):
-        """获取指定Python环境中已安装的包列表"""
-        try:
-            import json
-            import subprocess
-            
-            cmd = [python_env, '-m', 'pip', 'list', '--format=json']
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=60, creationflags=CREATE_NO_WINDOW)
-            if result.returncode == 0 and result.stdout:
-                packages = json.loads(result.stdout)
-                return {pkg['name']: pkg['version'] for pkg in packages}
-            else:
-                self._text_enqueue(f"[环境迁移] ❌ 获取包列表失败，返回代码: {result.returncode}")
-                return {}
-        except Exception as e:
-            self._text_enqueue(f"[环境迁移] ❌ 获取包列表时出错: {e}")
-            return {}
-    
-    def _install_package_to_env(self, python_env, package_name, package_version):
-        """在指定Python环境中安装包，返回(success, reason)"""
-        try:
-            import subprocess
-            cmd = [python_env, '-m', 'pip', 'install', f'{package_name}=={package_version}', '--no-deps']
-            mirror_url = PYPI_MIRRORS.get(self.mirror_var.get(), '')
-            if mirror_url:
-                cmd.extend(['--index-url', mirror_url])
-                host = mirror_url.split('/')[2]
-                cmd.extend(['--trusted-host', host])
-                cmd.extend(['--extra-index-url', 'https://pypi.org/simple'])
-                cmd.extend(['--trusted-host', 'pypi.org'])
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300, creationflags=CREATE_NO_WINDOW)
-            success = result.returncode == 0
-            if success:
-                return True, ''
-            err_text = ((result.stderr or '') + '\n' + (result.stdout or '')).strip()
-            lines = [l.strip() for l in err_text.split('\n') if l.strip() and not l.strip().startswith('WARNING')]
-            summary = ''
-            for l in reversed(lines[-6:]):
-                if 'No matching distribution found' in l or 'Could not find a version that satisfies' in l:
-                    summary = l
-                    break
-            if not summary:
-                summary = lines[-1] if lines else 'unknown error'
-            return False, summary
-        except Exception as e:
-            return False, str(e)
+    def _confirm_directory_migration(self, plan):
+        """展示预演计划后确认并执行目录迁移（主线程调用）"""
+        source_env = plan.get('source', '')
+        target_env = plan.get('target', '')
+        install = plan.get('install') or []
+        change = plan.get('change') or []
+        confirm_result = self._show_dark_confirm(
+            "确认环境迁移",
+            f"您确定要将源环境 '{os.path.basename(source_env)}' 中的包迁移到目标环境 '{os.path.basename(target_env)}' 吗？\n\n"
+            f"需安装: {len(install)} 个包，预计下载 ≤ {int(plan.get('total_size') or 0) / (1024**2):.1f} MB\n"
+            f"安装批次: {len(plan.get('batches') or [])} 批（按依赖顺序）\n\n"
+            "详细计划见右侧结果面板。"
+        )
+        if not confirm_result:
+            self._text_enqueue("[环境迁移] ⚠️ 用户取消了迁移操作")
+            self._enqueue_progress_hide()
+            return
+        include_changes = False
+        if change:
+            include_changes = self._show_dark_confirm(
+                "版本不同的包",
+                f"有 {len(change)} 个包在两个环境中版本不同。\n\n是否同时将它们调整为源环境的版本？\n（选择否则仅安装目标环境缺失的包）"
+            )
+        use_clone = False
+        if plan.get('same_python'):
+            use_clone = self._show_dark_confirm(
+                "克隆模式",
+                "两个环境的 Python 版本与平台一致，可使用克隆模式：\n"
+                "直接复制源环境中的包文件（优先写时复制/硬链接），无需联网下载。\n\n"
+                "是否使用克隆模式？（选择否则通过 pip 下载安装）"
+            )
+        
+        def _migration_task():
+            try:
+                self._enqueue_progress(0.5)
+                progress_cb = lambda v: self._enqueue_progress(min(0.5 + 0.45 * v, 0.95))
+                if use_clone:
+                    self._text_enqueue("[环境迁移] 🧬 使用克隆模式复制包文件...")
+                    result = self.tools.clone_packages(plan, include_changes=include_changes, progress_cb=progress_cb)
+                else:
+                    result = self.tools.execute_migration_plan(
+                        plan,
+                        self.mirror_var.get(),
+                        include_changes=include_changes,
+                        progress_cb=progress_cb
+                    )
+                ok = result.get('ok', [])
+                failed_packages = list(result.get('failed', [])) + list(result.get('skipped', []))
+                
+                # 显示结果
+                self._text_enqueue("="*60)
+                self._text_enqueue("[环境迁移] 🎉 环境迁移完成！")
+                self._text_enqueue(f"[环境迁移] ✅ 成功安装: {len(ok)} 个包")
+                self._text_enqueue(f"[环境迁移] ❌ 安装失败: {len(result.get('failed', []))} 个包")
+                if result.get('skipped'):
+                    self._text_enqueue(f"[环境迁移] ⏭️ 因依赖失败跳过: {len(result.get('skipped', []))} 个包")
+                
+                if failed_packages:
+                    self._text_enqueue("[环境迁移] 📋 失败的包列表(按原因归类):")
+                    groups = {}
+                    for pkg, reason in failed_packages:
+                        key = reason or 'unknown error'
+                        groups.setdefault(key, []).append(pkg)
+                    for reason, pkgs in groups.items():
+                        self._text_enqueue(f"  • {reason} ({len(pkgs)}):")
+                        for pkg in pkgs:
+                            self._text_enqueue(f"    - {pkg}")
+                    self.after(100, lambda: self._ask_save_failed_packages(failed_packages))
+                    
+            except Exception as e:
+                self._text_enqueue(f"[环境迁移] ❌ 执行环境迁移时出错: {e}")
+            finally:
+                self._enqueue_progress(1.0)
+                self._enqueue_progress_hide()
+        
+        self.jobs.submit('migration', f"环境迁移 {os.path.basename(source_env)} → {os.path.basename(target_env)}", _migration_task,
+                         reads=(source_env,), writes=(target_env,))
     
     def _ask_save_failed_packages(self, failed_packages):
         """询问是否保存失败包列表，按原因归类写入"""
@@ -4237,9 +4702,10 @@ class ComfyUIEnvironmentManager(ctk.CTk):
         # 更新下拉框选项
         self.version_cb.configure(values=display_versions)
         
-        # 如果有版本，默认选择第一个（最新版本）
+        # 默认选择最新的有兼容 wheel 的版本；都需编译时选择最新版本
         if display_versions:
-            self.version_var.set(display_versions[0])
+            wheel_versions = [v for v in display_versions if SDIST_ONLY_MARK not in v]
+            self.version_var.set(wheel_versions[0] if wheel_versions else display_versions[0])
         
         # 在状态栏显示版本数量信息
         self._text_enqueue(f"[库查找] 找到 {len(versions)} 个可用版本")
@@ -4268,7 +4734,15 @@ class ComfyUIEnvironmentManager(ctk.CTk):
             return
         # 添加到历史记录
         self._add_to_lib_history(lib_name)
-        Thread(target=lambda: self.update_result_text(self.tools.install_library(lib_name, self.version_var.get(), self.python_exe_path, self.mirror_var.get()))).start()
+        def _task():
+            try:
+                self._enqueue_progress_show(0.05)
+                self._enqueue_text(self.tools.install_library(lib_name, self.version_var.get(), self.python_exe_path, self.mirror_var.get(),
+                                                              progress_cb=self._enqueue_progress))
+            finally:
+                self._enqueue_progress(1.0)
+                self._enqueue_progress_hide()
+        self.jobs.submit('install', f"安装 {lib_name}", _task, writes=(self.python_exe_path,))
 
     def uninstall_library(self):
         lib_name = self.lib_name_var.get().strip()
@@ -4278,17 +4752,21 @@ class ComfyUIEnvironmentManager(ctk.CTk):
             return
         # 添加到历史记录
         self._add_to_lib_history(lib_name)
-        Thread(target=lambda: self.update_result_text(self.tools.uninstall_library(lib_name, self.python_exe_path))).start()
+        self.jobs.submit('install', f"卸载 {lib_name}", lambda: self._enqueue_text(self.tools.uninstall_library(lib_name, self.python_exe_path)),
+                         writes=(self.python_exe_path,))
 
     def install_whl_file(self):
         path = self._ask_open_filename_dark(title="选择whl文件", filetypes=[("Wheel", "*.whl"), ("所有文件", "*.*")])
         if path:
-            Thread(target=lambda: self.update_result_text(self.tools.install_whl(path, self.python_exe_path))).start()
+            self.jobs.submit('install', f"安装 {os.path.basename(path)}", lambda: self._enqueue_text(self.tools.install_whl(path, self.python_exe_path)),
+                             writes=(self.python_exe_path,))
 
     def install_source_code(self):
         path = self._ask_open_filename_dark(title="选择源码压缩包", filetypes=[("源码压缩包", "*.zip;*.tar.gz;*.tar"), ("所有文件", "*.*")])
         if path:
-            Thread(target=lambda: self.update_result_text(self.tools.install_from_source(path, self.python_exe_path, self.mirror_var.get()))).start()
+            self.jobs.submit('install', f"源码安装 {os.path.basename(path)}",
+                             lambda: self._enqueue_text(self.tools.install_from_source(path, self.python_exe_path, self.mirror_var.get())),
+                             writes=(self.python_exe_path,))
 
     def execute_command(self):
         cmd = self.cmd_var.get().strip()
@@ -4713,6 +5191,7 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                                         self._text_enqueue(f"[版本维护] ⚠️ 清理未跟踪文件失败: {clean_result.stderr}")
                                     
                                     # 执行checkout命令，使用--force参数
+                                    job_checkpoint()
                                     self._text_enqueue(f"[版本维护] 正在执行git checkout {r} --force")
                                     rr = run_git_cmd(['checkout', r, '--force'])
                                     
@@ -4781,6 +5260,7 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                                         # 安装依赖文件
                                         total_files = len(requirements_files)
                                         for i, req_file in enumerate(requirements_files, 1):
+                                            job_checkpoint()
                                             try:
                                                 status_var.set(f"📦 正在安装依赖 [{i}/{total_files}]: {os.path.basename(req_file)}")
                                                 self._text_enqueue(f"[版本维护] 安装依赖文件: {req_file}")
@@ -4789,8 +5269,8 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                                                 self._text_enqueue(f"[版本维护] 正在安装依赖: {os.path.basename(req_file)}")
                                                 cmd = [python_exe, '-m', 'pip', 'install', '-r', req_file]
                                                 
-                                                # 使用实时输出捕获，显示详细安装过程
-                                                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
+                                                # 使用实时输出捕获，显示详细安装过程；经 spawn_process 占用子进程名额并登记到任务，取消时终止
+                                                proc = spawn_process(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
                                                 
                                                 output_lines = []
                                                 while True:
@@ -4808,12 +5288,15 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                                                         self._text_enqueue(f"[依赖安装] {msg}")
                                                 
                                                 returncode = proc.poll()
+                                                job_checkpoint()  # 取消时 pip 已被终止，不再报告为安装失败
                                                 
                                                 if returncode == 0:
                                                     self._text_enqueue(f"[版本维护] ✅ 依赖安装成功: {os.path.basename(req_file)}")
                                                 else:
                                                     self._text_enqueue(f"[版本维护] ⚠️ 依赖安装失败: {os.path.basename(req_file)} - 返回码: {returncode}")
                                             
+                                            except JobCancelled:
+                                                raise
                                             except subprocess.TimeoutExpired:
                                                 self._text_enqueue(f"[版本维护] ⏰ 依赖安装超时: {os.path.basename(req_file)}")
                                             except Exception as e:
@@ -4824,6 +5307,10 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                                         status_var.set("✅ 版本切换完成，未找到ComfyUI依赖文件")
                                         self._text_enqueue("[版本维护] 未找到ComfyUI根目录的requirements.txt，跳过依赖安装")
                                         
+                                except JobCancelled:
+                                    status_var.set("⚠️ 版本切换已取消")
+                                    self._text_enqueue("[版本维护] ⚠️ 任务已取消")
+                                    raise
                                 except Exception as e:
                                     status_var.set(f"❌ 版本切换异常: {e}")
                                     self._text_enqueue(f"[版本维护] 版本切换异常: {e}")
@@ -4838,10 +5325,17 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                                             # 忽略已销毁的widget错误
                                             continue
                             
-                            # 在新线程中执行异步切换
-                            import threading
-                            switch_thread = threading.Thread(target=async_switch, daemon=True)
-                            switch_thread.start()
+                            # 作为后台任务执行：与同一环境的安装/还原排队，可在任务面板中取消
+                            def _enable_radios():
+                                for rb in radio_buttons:
+                                    try:
+                                        rb.configure(state='normal')
+                                    except tk.TclError:
+                                        continue
+                            # 排队期间被取消时 async_switch 不会运行，由 on_done 恢复单选框
+                            self.jobs.submit('install', f"切换 ComfyUI 版本 {r[:12]}", async_switch,
+                                             writes=(repo, self.python_exe_path),
+                                             on_done=lambda j: self._enqueue_call(_enable_radios))
                         
                         return on_select_radio
                     
@@ -5252,7 +5746,7 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                 cmd = list(args)
                 if skip_self:
                     cmd.append('--skip_self_update')
-                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
+                proc = spawn_process(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
                 while True:
                     try:
                         line = proc.stdout.readline()
@@ -5293,7 +5787,8 @@ class ComfyUIEnvironmentManager(ctk.CTk):
                     self._enqueue_progress(1.0)
                     self._enqueue_progress_hide()
 
-            Thread(target=_task, daemon=True).start()
+            self.jobs.submit('install', f"切换 ComfyUI {('稳定版' if mode == 'stable' else '开发版')}", _task,
+                             writes=(comfy_dir, py_embed))
         except Exception as e:
             self.update_result_text(f"[版本维护] 启动失败: {e}")
 
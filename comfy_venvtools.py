@@ -1,16 +1,35 @@
 # -*- coding: utf-8 -*-
 import os
 import re
+import json
 import time
+import shutil
+import tempfile
 import subprocess
 import sys
+import threading
+from email.parser import Parser
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 # 定义平台特定的subprocess创建标志，避免弹出控制台窗口
 if sys.platform == 'win32':
     CREATE_NO_WINDOW = subprocess.CREATE_NO_WINDOW
 else:
     CREATE_NO_WINDOW = 0
-from typing import Callable, List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Tuple
+
+# PEP 440/503/508 解析：优先使用独立安装的 packaging，缺失时回退到 pip 自带的副本
+try:
+    from packaging.requirements import Requirement, InvalidRequirement
+    from packaging.specifiers import SpecifierSet, InvalidSpecifier
+    from packaging.version import Version, InvalidVersion
+    from packaging.utils import canonicalize_name
+except ImportError:
+    from pip._vendor.packaging.requirements import Requirement, InvalidRequirement
+    from pip._vendor.packaging.specifiers import SpecifierSet, InvalidSpecifier
+    from pip._vendor.packaging.version import Version, InvalidVersion
+    from pip._vendor.packaging.utils import canonicalize_name
 
 # 国内常用的pip镜像源（供UI使用）
 PYPI_MIRRORS = {
@@ -22,6 +41,1466 @@ PYPI_MIRRORS = {
     '腾讯云': 'https://mirrors.cloud.tencent.com/pypi/simple/'
 }
 
+# 内置镜像（字典顺序即默认优先级）；config.json 的 "mirrors" 列表可新增、覆盖或禁用镜像，例如：
+#   "mirrors": [{"name": "局域网", "url": "http://10.0.0.5:3141/root/pypi/+simple/", "priority": 0,
+#                "trusted_host": "10.0.0.5", "extra_index_urls": ["https://mirrors.aliyun.com/pypi/simple/"]},
+#               {"name": "豆瓣", "enabled": false}]
+# 证书链不完整的自建镜像可加 "verify_ssl": false，工具自身的 HTTP 请求对其主机不校验证书（默认校验）。
+_BUILTIN_MIRRORS = dict(PYPI_MIRRORS)
+# 镜像完整定义：{名称: {name, url, trusted_host[列表], priority, extra_index_urls[列表], verify_ssl}}
+MIRROR_DEFS: Dict[str, Dict[str, object]] = {}
+# 显式配置为不校验证书的镜像主机（HttpClient 对这些主机使用不校验的 TLS 上下文）
+TLS_UNVERIFIED_HOSTS: set = set()
+
+
+def _url_host(url: str) -> str:
+    try:
+        return url.split('/')[2].split('@')[-1].split(':')[0]
+    except IndexError:
+        return ''
+
+
+def _as_list(value: object) -> List[str]:
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return [str(v) for v in value if v]  # type: ignore[union-attr]
+
+
+def register_mirror(name: str, url: str, trusted_host: object = None, priority: int = 50,
+                    extra_index_urls: List[str] | None = None, verify_ssl: bool = True) -> None:
+    """新增或覆盖一个镜像定义并刷新 PYPI_MIRRORS（原地更新，已导入的引用同样生效）。
+    trusted_host 缺省为主索引与附加索引的主机名；传空列表表示不加 --trusted-host。
+    verify_ssl=False 时工具自身访问该镜像（主索引与附加索引）不校验证书。"""
+    if not name or not url:
+        return
+    url = url if url.endswith('/') else url + '/'
+    extras = _as_list(extra_index_urls)
+    hosts = [_url_host(u) for u in [url] + extras] if trusted_host is None else _as_list(trusted_host)
+    MIRROR_DEFS[name] = {'name': name, 'url': url, 'trusted_host': [h for h in dict.fromkeys(hosts) if h],
+                         'priority': int(priority), 'extra_index_urls': extras, 'verify_ssl': bool(verify_ssl)}
+    if not verify_ssl:
+        TLS_UNVERIFIED_HOSTS.update(h for h in (_url_host(u) for u in [url] + extras) if h)
+    _refresh_mirror_table()
+
+
+def _refresh_mirror_table() -> None:
+    ordered = sorted(MIRROR_DEFS.values(), key=lambda d: int(d['priority']))  # type: ignore[arg-type]
+    PYPI_MIRRORS.clear()
+    PYPI_MIRRORS.update((str(d['name']), str(d['url'])) for d in ordered)
+
+
+def load_mirror_config(config_path: str | None = None) -> List[str]:
+    """从 config.json 的 "mirrors" 加载镜像定义（叠加在内置镜像之上），返回问题描述列表。"""
+    MIRROR_DEFS.clear()
+    TLS_UNVERIFIED_HOSTS.clear()
+    for i, (name, url) in enumerate(_BUILTIN_MIRRORS.items()):
+        MIRROR_DEFS[name] = {'name': name, 'url': url, 'trusted_host': [_url_host(url)],
+                             'priority': 100 + i, 'extra_index_urls': [], 'verify_ssl': True}
+    problems: List[str] = []
+    path = config_path or os.path.join(os.getcwd(), 'config.json')
+    entries: List[object] = []
+    try:
+        if os.path.isfile(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                entries = list(json.load(f).get('mirrors') or [])
+    except Exception as e:
+        problems.append(f"读取镜像配置失败: {e}")
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get('name'):
+            problems.append(f"忽略无效的镜像配置: {entry}")
+            continue
+        name = str(entry['name'])
+        if entry.get('enabled', True) is False:
+            MIRROR_DEFS.pop(name, None)
+            continue
+        base = MIRROR_DEFS.get(name, {})
+        url = str(entry.get('url') or base.get('url') or '')
+        if not url.startswith(('http://', 'https://', 'file:')):
+            problems.append(f"镜像 {name} 的地址无效: {url or '（空）'}")
+            continue
+        try:
+            priority = int(entry.get('priority', base.get('priority', 50)))  # type: ignore[arg-type]
+        except (TypeError, ValueError):
+            priority = 50
+        register_mirror(name, url, entry.get('trusted_host'), priority, entry.get('extra_index_urls'),
+                        entry.get('verify_ssl', True) is not False)
+    _refresh_mirror_table()
+    return problems
+
+
+def mirror_url(name: str | None) -> str:
+    """镜像名 → 主索引地址；未知或空名（官方源）返回空串。"""
+    return PYPI_MIRRORS.get(name or '', '')
+
+
+def mirror_pip_args(name: str | None, with_fallback: bool = False) -> List[str]:
+    """镜像名 → pip 索引参数（主索引、附加索引链与可信主机）；with_fallback 时追加官方源作为备用。"""
+    url = mirror_url(name)
+    if not url:
+        return []
+    d = MIRROR_DEFS.get(name or '') or {'extra_index_urls': [], 'trusted_host': [_url_host(url)]}
+    args = ['--index-url', url]
+    extras = list(d['extra_index_urls'])  # type: ignore[arg-type]
+    hosts = list(d['trusted_host'])  # type: ignore[arg-type]
+    if with_fallback and not any('pypi.org' in u for u in extras):
+        extras.append('https://pypi.org/simple')
+        hosts.append('pypi.org')
+    for u in extras:
+        args += ['--extra-index-url', u]
+    for h in dict.fromkeys(hosts):
+        args += ['--trusted-host', h]
+    return args
+
+
+load_mirror_config()
+
+# 在目标解释器中执行的探测脚本：返回 site-packages 路径与 PEP 508 标记环境
+_ENV_PROBE_SCRIPT = (
+    "import json, sys, sysconfig\n"
+    "paths = sysconfig.get_paths()\n"
+    "try:\n"
+    "    from pip._vendor.packaging.markers import default_environment\n"
+    "    markers = default_environment()\n"
+    "except Exception:\n"
+    "    markers = {}\n"
+    "print(json.dumps({'executable': sys.executable, 'purelib': paths.get('purelib'), "
+    "'platlib': paths.get('platlib'), 'scripts': paths.get('scripts'), "
+    "'version': '%d.%d' % sys.version_info[:2], 'markers': markers}))\n"
+)
+
+
+# 在目标解释器中执行：输出其支持的 wheel 标签（按优先级）
+_TAGS_PROBE_SCRIPT = (
+    "import json\n"
+    "from pip._vendor.packaging.tags import sys_tags\n"
+    "print(json.dumps([str(t) for t in sys_tags()]))\n"
+)
+
+# 版本下拉框中仅有源码包（需本地编译）的版本标注
+SDIST_ONLY_MARK = '（需编译）'
+
+# pip 输出中表明网络/镜像故障的特征（用于镜像健康度与自动切换）
+_NETWORK_ERROR_PATTERNS = (
+    'ConnectTimeoutError', 'ReadTimeoutError', 'NewConnectionError', 'Connection refused', 'Connection reset',
+    'Max retries exceeded', 'SSLError', 'ProxyError', 'timed out', 'Temporary failure in name resolution',
+    'getaddrinfo failed', 'RemoteDisconnected', 'IncompleteRead', 'HTTP error 5', 'DO NOT MATCH THE HASHES',
+)
+
+# 在目标解释器中执行：用 pip 自带的 distlib 按 entry_points 生成入口脚本
+_SCRIPT_MAKER_SCRIPT = (
+    "import json, sys\n"
+    "from pip._vendor.distlib.scripts import ScriptMaker\n"
+    "data = json.load(sys.stdin)\n"
+    "maker = ScriptMaker(None, data['scripts_dir'])\n"
+    "maker.clobber = True\n"
+    "maker.variants = {''}\n"
+    "maker.set_mode = True\n"
+    "maker.executable = sys.executable\n"
+    "made = []\n"
+    "for spec, gui in data['specs']:\n"
+    "    made += maker.make(spec, {'gui': gui})\n"
+    "print(json.dumps(made))\n"
+)
+
+# Linux 下 FICLONE ioctl 编号（btrfs/xfs 等支持写时复制的文件系统）
+_FICLONE = 0x40049409
+
+
+def _clone_file(src: str, dst: str, allow_hardlink: bool = True) -> Tuple[str, int]:
+    """复制单个文件：reflink → 硬链接 → 流式复制，返回 (使用的方式, 字节数)。
+    目标已存在时先删除，保证硬链接不会改写他处共享的文件内容。"""
+    size = os.path.getsize(src)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if sys.platform.startswith('linux'):
+        try:
+            import fcntl
+            with open(src, 'rb') as fs, open(dst, 'wb') as fd:
+                fcntl.ioctl(fd.fileno(), _FICLONE, fs.fileno())
+            shutil.copystat(src, dst)
+            return 'reflink', size
+        except (OSError, ImportError):
+            try:
+                os.remove(dst)
+            except OSError:
+                pass
+    if allow_hardlink:
+        try:
+            os.link(src, dst)
+            return 'hardlink', size
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    return 'copy', size
+
+
+BACKUP_MANIFEST = '.backup_manifest.json'  # 备份目录中的清单文件（还原时跳过）
+SNAPSHOT_PREFIX = 'comfyui_env_backup_'  # 环境备份/快照目录名前缀
+_COPY_CHUNK = 64 * 1024 * 1024  # 零拷贝调用每次最多处理的字节数（同时决定大文件的进度粒度）
+_COPY_BUFFER = 4 * 1024 * 1024  # 回退到用户态复制时的缓冲区大小
+
+
+ARCHIVE_SUFFIX = '.cvpack'  # 流式分块压缩的环境归档
+_ARCHIVE_MAGIC = b'CVPACK1\0'
+_ARCHIVE_END = b'CVPKEND\0'
+_ARCHIVE_CHUNK = 4 * 1024 * 1024  # 归档分块的原始大小：越小单包提取越省，越大压缩率越高
+
+
+def _archive_codec(codec: str, level: int | None = None) -> Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    """返回 (压缩, 解压) 函数。zlib/lzma 为标准库；zstd 需要可选依赖 zstandard。
+    三者在压缩大块数据时都会释放 GIL，可由线程池并行。"""
+    if codec == 'zlib':
+        import zlib
+        lv = 6 if level is None else level
+        return (lambda b: zlib.compress(b, lv)), zlib.decompress
+    if codec == 'lzma':
+        import lzma
+        lv = 6 if level is None else level
+        return (lambda b: lzma.compress(b, preset=lv)), lzma.decompress
+    if codec == 'zstd':
+        try:
+            import zstandard  # type: ignore[import-not-found]
+        except ImportError:
+            raise ValueError('zstd 压缩需要安装 zstandard 库')
+        lv = 3 if level is None else level
+        # ZstdCompressor/Decompressor 不是线程安全的，每次调用各自创建
+        return (lambda b: zstandard.ZstdCompressor(level=lv).compress(b)), \
+               (lambda b: zstandard.ZstdDecompressor().decompress(b))
+    raise ValueError(f'不支持的压缩方式: {codec}')
+
+
+def _fast_hash_algo() -> str:
+    """备份清单使用的快速哈希：安装了 xxhash 时用 xxh3_128，否则用标准库的 blake2b（128 位）。"""
+    try:
+        import xxhash  # type: ignore[import-not-found]  # noqa: F401
+        return 'xxh3_128'
+    except ImportError:
+        return 'blake2b'
+
+
+def _new_hasher(algo: str):
+    """按名称创建哈希对象；旧清单未记录算法时为 sha256。xxh3_128 缺少 xxhash 库时抛出 ValueError。"""
+    import hashlib
+    if algo == 'blake2b':
+        return hashlib.blake2b(digest_size=16)
+    if algo == 'xxh3_128':
+        try:
+            import xxhash  # type: ignore[import-not-found]
+        except ImportError:
+            raise ValueError('该清单使用 xxh3_128 哈希，需要安装 xxhash 库')
+        return xxhash.xxh3_128()
+    return hashlib.new(algo)
+
+
+class IoThrottle:
+    """备份/复制的 I/O 节流：字节速率与文件速率各用一个令牌桶（允许 1 秒突发，超额时让调用线程休眠），
+    low_priority=True 时复制线程把自身 I/O 优先级降为后台（Linux ioprio idle、Windows THREAD_MODE_BACKGROUND），
+    让 ComfyUI 正在进行的模型加载优先。各参数为 0/None 表示不限制。线程安全，可在多个复制线程间共享。"""
+
+    def __init__(self, bytes_per_sec: float | None = None, files_per_sec: float | None = None, low_priority: bool = False):
+        self.bytes_per_sec = float(bytes_per_sec or 0)
+        self.files_per_sec = float(files_per_sec or 0)
+        self.low_priority = bool(low_priority)
+        self.waited = 0.0  # 因限速累计休眠的秒数（各线程之和）
+        self._lock = threading.Lock()
+        now = time.monotonic()
+        self._buckets = {'bytes': [self.bytes_per_sec, now], 'files': [self.files_per_sec, now]}
+
+    @property
+    def chunk(self) -> int:
+        """限速时零拷贝调用的单次字节数：约 1/8 秒的配额，保证速率平滑。"""
+        if not self.bytes_per_sec:
+            return _COPY_CHUNK
+        return int(min(_COPY_CHUNK, max(256 * 1024, self.bytes_per_sec / 8)))
+
+    def _consume(self, kind: str, rate: float, n: float) -> None:
+        if rate <= 0 or n <= 0:
+            return
+        with self._lock:
+            bucket = self._buckets[kind]
+            now = time.monotonic()
+            bucket[0] = min(rate, bucket[0] + (now - bucket[1]) * rate) - n
+            bucket[1] = now
+            wait = -bucket[0] / rate if bucket[0] < 0 else 0.0
+            self.waited += wait
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_bytes(self, n: int) -> None:
+        self._consume('bytes', self.bytes_per_sec, n)
+
+    def on_file(self) -> None:
+        self._consume('files', self.files_per_sec, 1)
+
+    def enter_thread(self) -> None:
+        """作为线程池 initializer 调用：降低当前线程的 I/O 优先级（失败时静默忽略）。"""
+        if self.low_priority:
+            _lower_thread_io_priority()
+
+    @property
+    def active(self) -> bool:
+        return bool(self.bytes_per_sec or self.files_per_sec or self.low_priority)
+
+
+def _lower_thread_io_priority() -> bool:
+    """把当前线程的 I/O 优先级降为后台。Windows 用 SetThreadPriority(THREAD_MODE_BACKGROUND_BEGIN)，
+    同时降低 CPU/内存/磁盘优先级；Linux 用 ioprio_set(IOPRIO_CLASS_IDLE) 作用于当前线程（CFQ/BFQ 调度器生效）。"""
+    try:
+        import ctypes
+        if sys.platform == 'win32':
+            kernel32 = ctypes.windll.kernel32  # type: ignore[attr-defined]
+            return bool(kernel32.SetThreadPriority(kernel32.GetCurrentThread(), 0x00010000))
+        if sys.platform.startswith('linux'):
+            import platform
+            nr = {'x86_64': 251, 'aarch64': 30, 'i686': 289, 'i386': 289, 'armv7l': 314}.get(platform.machine())
+            if nr is None:
+                return False
+            libc = ctypes.CDLL(None, use_errno=True)
+            # IOPRIO_WHO_PROCESS=1，who=0 表示调用线程；IOPRIO_CLASS_IDLE=3
+            return libc.syscall(nr, 1, 0, 3 << 13) == 0
+    except Exception:
+        pass
+    return False
+
+
+def _copy_file_data(src: str, dst: str, on_bytes: Callable[[int], None] | None = None, hasher=None,
+                    max_chunk: int = _COPY_CHUNK) -> int:
+    """复制单个文件的数据并保留元数据（mtime、权限位），返回字节数。
+    Linux 优先 copy_file_range（同文件系统可在内核内完成甚至 reflink），其次 sendfile；
+    其他平台使用大缓冲区读写。on_bytes 随复制进度回调增量字节数。
+    传入 hasher 时数据走用户态缓冲区，在复制的同时更新哈希（只读一遍源文件）。
+    max_chunk 限制每次零拷贝调用与缓冲区的大小（限速时用小块让速率平滑）。"""
+    written = 0
+    with open(src, 'rb') as fs:
+        with open(dst, 'wb') as fd:
+            size = os.fstat(fs.fileno()).st_size
+            done = False
+            for fn_name in (() if hasher is not None else ('copy_file_range', 'sendfile')):
+                fn = getattr(os, fn_name, None)
+                if fn is None or not sys.platform.startswith('linux'):
+                    continue
+                try:
+                    while written < size:
+                        if fn_name == 'copy_file_range':
+                            n = fn(fs.fileno(), fd.fileno(), min(max_chunk, size - written))
+                        else:
+                            n = fn(fd.fileno(), fs.fileno(), written, min(max_chunk, size - written))
+                        if n <= 0:
+                            break
+                        written += n
+                        if on_bytes:
+                            on_bytes(n)
+                    done = True
+                    break
+                except OSError:
+                    if written:
+                        raise  # 已写入部分数据时不能换方式从头再来
+                    continue
+            if not done or written < size:
+                fs.seek(written)
+                fd.seek(written)
+                while True:
+                    buf = fs.read(min(_COPY_BUFFER, max_chunk))
+                    if not buf:
+                        break
+                    fd.write(buf)
+                    if hasher is not None:
+                        hasher.update(buf)
+                    written += len(buf)
+                    if on_bytes:
+                        on_bytes(len(buf))
+    shutil.copystat(src, dst)
+    return written
+
+
+class JobCancelled(Exception):
+    """后台任务被用户取消（由 Job.checkpoint 抛出）。"""
+
+
+class JobToken(threading.Event):
+    """任务的取消/暂停令牌，可直接作为复制、归档、校验等接口的 cancel 参数：
+    set() 表示取消；暂停期间 is_set() 会阻塞调用线程直到恢复或取消，热循环里原有的取消检查因此同时成为暂停点。"""
+
+    def __init__(self):
+        super().__init__()
+        self._running = threading.Event()
+        self._running.set()
+
+    def is_set(self) -> bool:  # type: ignore[override]
+        while not self._running.is_set() and not super().is_set():
+            self._running.wait(0.2)
+        return super().is_set()
+
+    def pause(self) -> None:
+        self._running.clear()
+
+    def resume(self) -> None:
+        self._running.set()
+
+    @property
+    def paused(self) -> bool:
+        return not self._running.is_set()
+
+
+_job_local = threading.local()
+
+
+def current_job() -> Optional['Job']:
+    """返回当前线程所属的后台任务（不在任务线程中时为 None）。"""
+    return getattr(_job_local, 'job', None)
+
+
+def _job_thread_initializer(throttle: Optional['IoThrottle'] = None) -> Callable[[], None]:
+    """线程池 initializer：把提交线程所属的任务绑定到工作线程，使 current_job()、进度/日志回调与子进程登记
+    在工作线程中同样生效；传入 throttle 时同时进入限速（低 I/O 优先级）。须在提交线程中调用。"""
+    job = current_job()
+
+    def _init() -> None:
+        _job_local.job = job
+        if throttle is not None:
+            throttle.enter_thread()
+    return _init
+
+
+def _track_process(proc: subprocess.Popen) -> None:
+    """把子进程登记到当前任务，任务取消时一并终止。"""
+    job = current_job()
+    if job is not None:
+        job.attach_process(proc)
+
+
+def _terminate_process(proc: subprocess.Popen) -> None:
+    """终止子进程及其子进程树（Windows 用 taskkill /T，其他平台 terminate 后超时再 kill）。"""
+    if proc.poll() is not None:
+        return
+    try:
+        if sys.platform == 'win32':
+            subprocess.run(['taskkill', '/F', '/T', '/PID', str(proc.pid)], capture_output=True, creationflags=CREATE_NO_WINDOW)
+        else:
+            proc.terminate()
+            try:
+                proc.wait(timeout=3)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    except Exception:
+        pass
+
+
+def job_checkpoint() -> None:
+    """在多步骤操作的循环中调用：当前线程属于后台任务时，暂停则等待、已取消则抛出 JobCancelled。"""
+    job = current_job()
+    if job is not None:
+        job.checkpoint()
+
+
+# 全局子进程并发上限：pip/git/robocopy 等进程总数不超过该值，多余的请求排队等待空闲名额
+_proc_slots = threading.Condition()
+_proc_state = {'limit': max(2, min(8, (os.cpu_count() or 4) // 2)), 'running': 0}
+
+
+def set_subprocess_limit(limit: int) -> int:
+    """设置全局子进程并发上限（≤0 时按 CPU 核数自动取 2~8），返回生效值。"""
+    if not limit or limit <= 0:
+        limit = max(2, min(8, (os.cpu_count() or 4) // 2))
+    with _proc_slots:
+        _proc_state['limit'] = int(limit)
+        _proc_slots.notify_all()
+    return int(limit)
+
+
+def spawn_process(cmd, **kwargs) -> subprocess.Popen:
+    """启动子进程（参数同 subprocess.Popen）：先占用一个全局子进程名额，进程退出后自动归还；
+    进程登记到当前任务。等待名额期间任务被取消时抛出 JobCancelled。"""
+    job = current_job()
+    with _proc_slots:
+        while _proc_state['running'] >= _proc_state['limit']:
+            if job is not None:
+                if job.cancelled:  # 不能在持锁时调用会因暂停而阻塞的 checkpoint
+                    raise JobCancelled(f"任务已取消: {job.title}")
+                job.set_message(f"等待空闲子进程名额（上限 {_proc_state['limit']}）")
+            _proc_slots.wait(0.2)
+        _proc_state['running'] += 1
+
+    def _release() -> None:
+        with _proc_slots:
+            _proc_state['running'] -= 1
+            _proc_slots.notify()
+
+    try:
+        proc = subprocess.Popen(cmd, **kwargs)
+    except Exception:
+        _release()
+        raise
+    threading.Thread(target=lambda: (proc.wait(), _release()), daemon=True).start()
+    _track_process(proc)
+    return proc
+
+
+def _run_captured(cmd: List[str], timeout: float) -> Tuple[Optional[int], str]:
+    """运行命令并合并捕获 stdout/stderr，返回 (返回码, 输出)；超时返回 (None, 已有输出)。
+    子进程占用全局名额并登记到当前任务，任务取消时被终止。"""
+    proc = spawn_process(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
+    try:
+        out, _ = proc.communicate(timeout=timeout)
+        return proc.returncode, out or ''
+    except subprocess.TimeoutExpired:
+        _terminate_process(proc)
+        out, _ = proc.communicate()
+        return None, out or ''
+
+
+class Job:
+    """由 JobManager 管理的一个后台操作。
+    state: pending → running ⇄ paused → finished / failed / cancelled；progress 0~1；message 为最近一条日志。
+    可暂停的任务（复制/归档/校验等）在热循环中通过 token 暂停；调用 pip/git 等子进程的任务只支持取消。"""
+
+    def __init__(self, job_id: int, kind: str, title: str, pausable: bool = False,
+                 reads: Tuple[str, ...] = (), writes: Tuple[str, ...] = ()):
+        self.id = job_id
+        self.kind = kind
+        self.title = title
+        self.pausable = pausable
+        self.reads = {env_key(p) for p in reads if p}
+        self.writes = {env_key(p) for p in writes if p}
+        self.waiting_for: Optional['Job'] = None
+        self.state = 'pending'
+        self.progress = 0.0
+        self.message = ''
+        self.error: str | None = None
+        self.result: object = None
+        self.created = time.time()
+        self.started: float | None = None
+        self.finished: float | None = None
+        self.token = JobToken()
+        self._procs: List[subprocess.Popen] = []
+        self._lock = threading.Lock()
+        self._manager: Optional['JobManager'] = None
+
+    @property
+    def duration(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def cancelled(self) -> bool:
+        return super(JobToken, self.token).is_set()
+
+    @property
+    def active(self) -> bool:
+        return self.state in ('pending', 'running', 'paused', 'cancelling')
+
+    def _changed(self) -> None:
+        if self._manager is not None:
+            self._manager._notify(self)
+
+    def set_progress(self, value: float) -> None:
+        self.progress = max(0.0, min(1.0, float(value)))
+
+    def set_message(self, text: str) -> None:
+        self.message = text
+
+    def checkpoint(self) -> None:
+        """在循环中调用：暂停时阻塞，已取消时抛出 JobCancelled。"""
+        if self.token.is_set():
+            raise JobCancelled(f"任务已取消: {self.title}")
+
+    def cancel(self) -> None:
+        """取消任务：置位令牌，并在后台线程终止其子进程（taskkill/等待退出可能耗时数秒，不能阻塞 UI 线程）。"""
+        if not self.active:
+            return
+        self.token.set()
+        self.token.resume()
+        with self._lock:
+            procs = [p for p in self._procs if p.poll() is None]
+        if procs:
+            threading.Thread(target=lambda: [_terminate_process(p) for p in procs], daemon=True,
+                             name=f'job-{self.id}-terminate').start()
+        if self.state != 'pending':
+            self.state = 'cancelling'
+        self._changed()
+
+    def pause(self) -> bool:
+        if not self.pausable or self.state != 'running':
+            return False
+        self.token.pause()
+        self.state = 'paused'
+        self._changed()
+        return True
+
+    def resume(self) -> bool:
+        if self.state != 'paused':
+            return False
+        self.token.resume()
+        self.state = 'running'
+        self._changed()
+        return True
+
+    def attach_process(self, proc: subprocess.Popen) -> None:
+        with self._lock:
+            self._procs = [p for p in self._procs if p.poll() is None] + [proc]
+        if self.cancelled:
+            _terminate_process(proc)
+
+    def conflicts_with(self, other: 'Job') -> bool:
+        """两个任务涉及同一环境且至少一方会修改它时不能同时运行。"""
+        return bool(self.writes & (other.reads | other.writes) or other.writes & self.reads)
+
+
+def env_key(path: str) -> str:
+    """环境调度用的键：解释器路径归一为环境根目录（去掉 Scripts/bin），其他路径取规范化绝对路径。"""
+    path = os.path.normcase(os.path.abspath(path))
+    if os.path.splitext(os.path.basename(path))[0].lower().startswith('python') and not os.path.isdir(path):
+        path = os.path.dirname(path)
+        if os.path.basename(path) in ('scripts', 'Scripts', 'bin'):
+            path = os.path.dirname(path)
+    return path
+
+
+class JobManager:
+    """统一管理所有后台操作：每个操作一个 Job（编号、状态、进度、耗时、取消/暂停令牌、子进程），
+    在守护线程中运行并把 Job 绑定到该线程（current_job()），结束后保留最近 keep_finished 个供任务面板查看。
+    按环境调度：submit 的 reads/writes 声明任务读取/修改的环境（解释器路径或目录），
+    修改同一环境的任务互斥、与读取该环境的任务也互斥，只读任务之间并发；等待按提交顺序先到先得，
+    后提交的只读任务不会插到排队中的修改任务之前。子进程总数另由 set_subprocess_limit 的全局上限约束。
+    on_change(job) 在任务状态变化时回调（从任务线程调用，UI 需自行切回主线程）。"""
+
+    def __init__(self, on_change: Callable[['Job'], None] | None = None, keep_finished: int = 50):
+        self.on_change = on_change
+        self.keep_finished = keep_finished
+        self._jobs: List[Job] = []
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._sched = threading.Condition()
+        self._waiting: List[Job] = []
+        self._holding: List[Job] = []
+
+    def _notify(self, job: Job) -> None:
+        if self.on_change:
+            try:
+                self.on_change(job)
+            except Exception:
+                pass
+
+    def _blocker(self, job: Job) -> Optional[Job]:
+        """返回使 job 暂不能开始的任务：正在运行的冲突任务，或排在它前面的冲突任务。"""
+        for other in self._holding:
+            if job.conflicts_with(other):
+                return other
+        for other in self._waiting:
+            if other is job:
+                break
+            if job.conflicts_with(other):
+                return other
+        return None
+
+    def _acquire(self, job: Job) -> bool:
+        """等待 job 涉及的环境空闲；等待期间被取消返回 False。"""
+        with self._sched:
+            while True:
+                if job.cancelled:
+                    self._waiting.remove(job)
+                    self._sched.notify_all()
+                    return False
+                blocker = self._blocker(job)
+                if blocker is None:
+                    break
+                if blocker is not job.waiting_for:
+                    job.waiting_for = blocker
+                    job.message = f"等待任务 #{blocker.id}（{blocker.title}）结束"
+                    self._notify(job)
+                self._sched.wait(0.2)
+            job.waiting_for = None
+            self._waiting.remove(job)
+            self._holding.append(job)
+            return True
+
+    def _release(self, job: Job) -> None:
+        with self._sched:
+            if job in self._holding:
+                self._holding.remove(job)
+            self._sched.notify_all()
+
+    def submit(self, kind: str, title: str, fn: Callable[..., object], *args, pausable: bool = False,
+               on_done: Callable[[Job], None] | None = None, reads: Tuple[str, ...] = (), writes: Tuple[str, ...] = (),
+               **kwargs) -> Job:
+        """在后台线程运行 fn(*args, **kwargs) 并返回 Job；on_done(job) 在结束（含失败/取消）后于任务线程回调。
+        reads/writes 为任务读取/修改的环境，与已运行或先提交的冲突任务排队执行。"""
+        with self._lock:
+            job = Job(self._next_id, kind, title, pausable, reads, writes)
+            self._next_id += 1
+            job._manager = self
+            self._jobs.append(job)
+            finished = [j for j in self._jobs if not j.active]
+            for old in finished[:max(0, len(finished) - self.keep_finished)]:
+                self._jobs.remove(old)
+        with self._sched:
+            self._waiting.append(job)  # 入队顺序即提交顺序，保证先到先得
+
+        def _run() -> None:
+            _job_local.job = job
+            if not self._acquire(job):
+                job.state = 'cancelled'
+                job.started = time.time()
+            else:
+                job.started = time.time()
+                job.state = 'running'
+                job.message = ''
+                self._notify(job)
+                try:
+                    job.result = fn(*args, **kwargs)
+                    job.state = 'cancelled' if job.cancelled else 'finished'
+                    if job.state == 'finished':
+                        job.progress = 1.0
+                except JobCancelled:
+                    job.state = 'cancelled'
+                except Exception as e:
+                    job.state = 'cancelled' if job.cancelled else 'failed'
+                    job.error = str(e)
+                finally:
+                    self._release(job)
+            job.finished = time.time()
+            _job_local.job = None
+            self._notify(job)
+            if on_done is not None:
+                try:
+                    on_done(job)
+                except Exception:
+                    pass
+
+        threading.Thread(target=_run, name=f'job-{job.id}-{kind}', daemon=True).start()
+        return job
+
+    def jobs(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs)
+
+    def get(self, job_id: int) -> Optional[Job]:
+        return next((j for j in self.jobs() if j.id == job_id), None)
+
+    def active(self, kind: str | None = None) -> List[Job]:
+        return [j for j in self.jobs() if j.active and (kind is None or j.kind == kind)]
+
+    def cancel_all(self) -> None:
+        for job in self.active():
+            job.cancel()
+
+    def clear_finished(self) -> None:
+        with self._lock:
+            self._jobs = [j for j in self._jobs if j.active]
+
+
+class JobJournal:
+    """长任务日志：以追加写入的 JSON 行记录每个计划步骤及其结果。
+    文件与 config.json 同目录；程序异常退出后可据此从第一个未完成步骤继续。
+    事件格式：
+    - {"event": "start", "job": id, "kind": ..., "title": ..., "params": {...}, "steps": [...]}
+    - {"event": "step", "job": id, "step": ..., "ok": true/false, "detail": ...}
+    - {"event": "done", "job": id, "status": "finished" | "discarded"}
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path or os.path.join(os.getcwd(), 'jobs_journal.jsonl')
+        self._lock = threading.Lock()
+
+    def _append(self, record: Dict[str, object]) -> None:
+        record['ts'] = time.time()
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+                f.flush()
+                try:
+                    os.fsync(f.fileno())
+                except OSError:
+                    pass
+
+    def start_job(self, kind: str, steps: List[str], params: Dict[str, object] | None = None, title: str = '') -> str:
+        """登记一个新任务及其全部计划步骤，返回任务ID。"""
+        job_id = f"{kind}-{int(time.time() * 1000)}"
+        self._append({'event': 'start', 'job': job_id, 'kind': kind, 'title': title or kind, 'params': params or {}, 'steps': list(steps)})
+        return job_id
+
+    def record_step(self, job_id: str | None, step: str, ok: bool, detail: str = '') -> None:
+        """记录单个步骤的结果（步骤完成后立即写入）。"""
+        if not job_id:
+            return
+        try:
+            self._append({'event': 'step', 'job': job_id, 'step': step, 'ok': bool(ok), 'detail': (detail or '')[:300]})
+        except Exception:
+            pass
+
+    def finish_job(self, job_id: str | None, status: str = 'finished') -> None:
+        """标记任务结束；已结束的任务不会再提示继续。"""
+        if not job_id:
+            return
+        try:
+            self._append({'event': 'done', 'job': job_id, 'status': status})
+        except Exception:
+            pass
+
+    def _load(self) -> Dict[str, Dict[str, object]]:
+        jobs: Dict[str, Dict[str, object]] = {}
+        if not os.path.exists(self.path):
+            return jobs
+        with self._lock:
+            with open(self.path, 'r', encoding='utf-8', errors='replace') as f:
+                lines = f.readlines()
+        for line in lines:
+            try:
+                rec = json.loads(line)
+            except Exception:
+                continue  # 崩溃时可能留下半行，忽略
+            jid = rec.get('job')
+            ev = rec.get('event')
+            if ev == 'start':
+                jobs[jid] = {'id': jid, 'kind': rec.get('kind'), 'title': rec.get('title'), 'params': rec.get('params') or {},
+                             'steps': rec.get('steps') or [], 'results': {}, 'started': rec.get('ts'), 'status': 'running'}
+            elif jid in jobs and ev == 'step':
+                jobs[jid]['results'][rec.get('step')] = (bool(rec.get('ok')), rec.get('detail') or '')  # type: ignore[index]
+            elif jid in jobs and ev == 'done':
+                jobs[jid]['status'] = rec.get('status') or 'finished'
+        return jobs
+
+    def pending_jobs(self) -> List[Dict[str, object]]:
+        """返回未结束的任务，附带剩余步骤与已失败步骤。
+        步骤以最后一次记录的结果为准：尚无结果或最后一次失败的步骤都算剩余，继续任务时会重试。"""
+        out: List[Dict[str, object]] = []
+        try:
+            jobs = self._load()
+        except Exception:
+            return out
+        for job in jobs.values():
+            if job['status'] != 'running':
+                continue
+            results: Dict[str, Tuple[bool, str]] = job['results']  # type: ignore[assignment]
+            job['remaining'] = [s for s in job['steps'] if not results.get(s, (False, ''))[0]]  # type: ignore[union-attr]
+            job['failed'] = [s for s, (ok, _) in results.items() if not ok]
+            out.append(job)
+        return out
+
+    def compact(self) -> None:
+        """重写日志文件，仅保留未结束的任务记录。"""
+        try:
+            if not os.path.exists(self.path):
+                return
+            keep = {j['id'] for j in self.pending_jobs()}
+            with self._lock:
+                with open(self.path, 'r', encoding='utf-8', errors='replace') as f:
+                    lines = f.readlines()
+                kept = []
+                for line in lines:
+                    try:
+                        if json.loads(line).get('job') in keep:
+                            kept.append(line if line.endswith('\n') else line + '\n')
+                    except Exception:
+                        continue
+                tmp = self.path + '.tmp'
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    f.writelines(kept)
+                os.replace(tmp, self.path)
+        except Exception:
+            pass
+
+
+class InstallTransaction:
+    """安装事务：记录一次安装将触及的已安装包的旧版本，并以硬链接暂存其文件。
+    安装失败或结果不理想时，可卸载新版本并把暂存文件放回原处，数秒内完成回滚。"""
+
+    def __init__(self, path: str, python_exe: str, label: str = ''):
+        self.path = path
+        self.python_exe = python_exe
+        self.label = label
+        self.created = time.time()
+        # {key: {'name':..., 'version':..., 'files': [[原路径, 暂存文件名], ...]}}
+        self.previous: Dict[str, Dict[str, object]] = {}
+        # 安装前不存在、由本次安装新增的包（规范名）
+        self.added: List[str] = []
+
+    @property
+    def files_dir(self) -> str:
+        return os.path.join(self.path, 'files')
+
+    def save(self) -> None:
+        data = {'python_exe': self.python_exe, 'label': self.label, 'created': self.created,
+                'previous': self.previous, 'added': self.added}
+        with open(os.path.join(self.path, 'txn.json'), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> 'InstallTransaction':
+        with open(os.path.join(path, 'txn.json'), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        txn = cls(path, data.get('python_exe') or '', data.get('label') or '')
+        txn.created = float(data.get('created') or 0)
+        txn.previous = data.get('previous') or {}
+        txn.added = list(data.get('added') or [])
+        return txn
+
+    def discard(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class MirrorHealthTracker:
+    """镜像健康度：按镜像维护“预估耗时”与错误率的指数滑动平均。
+    每次测速与真实安装都会记录一次样本；得分越小越好，安装时据此决定失败后的切换顺序。
+    镜像名为空字符串表示 pip 默认索引（官方源）。"""
+
+    def __init__(self, alpha: float = 0.3, default_latency: float = 3.0):
+        self.alpha = alpha
+        self.default_latency = default_latency
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, latency: float | None = None, ok: bool = True, error: str = '') -> None:
+        """记录一个样本：latency 为秒（可为空，仅更新错误率），ok 表示本次访问是否成功。"""
+        with self._lock:
+            st = self._stats.setdefault(name, {'latency': 0.0, 'error_rate': 0.0, 'samples': 0, 'failures': 0, 'last_failure': 0.0})
+            a = self.alpha
+            if latency is not None and ok:
+                st['latency'] = latency if not st['latency'] else (1 - a) * st['latency'] + a * latency
+            st['error_rate'] = (1 - a) * st['error_rate'] + a * (0.0 if ok else 1.0)
+            st['samples'] += 1
+            if not ok:
+                st['failures'] += 1
+                st['last_failure'] = time.time()
+                st['last_error'] = error[:200]  # type: ignore[assignment]
+
+    def score(self, name: str) -> float:
+        """综合得分（秒）：预估耗时 ×(1 + 4×错误率)，最近 2 分钟内失败过的再加罚时。"""
+        with self._lock:
+            st = self._stats.get(name)
+            if not st:
+                return self.default_latency
+            s = (st['latency'] or self.default_latency) * (1 + 4 * st['error_rate'])
+            if time.time() - st['last_failure'] < 120:
+                s += 10.0
+            return s
+
+    def ranking(self, names: List[str]) -> List[Dict[str, object]]:
+        """返回给定镜像按得分排序的明细。"""
+        out: List[Dict[str, object]] = []
+        for n in names:
+            with self._lock:
+                st = dict(self._stats.get(n) or {})
+            out.append({'name': n, 'score': self.score(n), 'latency': st.get('latency') or None,
+                        'error_rate': st.get('error_rate', 0.0), 'samples': int(st.get('samples', 0)),
+                        'last_error': st.get('last_error', '')})
+        out.sort(key=lambda r: float(r['score']))  # type: ignore[arg-type]
+        return out
+
+    def failover_order(self, preferred: str | None, names: List[str], limit: int | None = None) -> List[str]:
+        """切换顺序：首选镜像在前，其余按得分排序，官方源（''）始终保留作为最后一次尝试；
+        未选镜像时先用官方源，再按得分尝试镜像。limit 为总尝试次数上限，只截断镜像候选（至少保留首选镜像），不会截掉官方源。"""
+        mirrors = ([preferred] if preferred else []) + [r['name'] for r in self.ranking([n for n in names if n and n != preferred])]
+        if limit is not None:
+            mirrors = mirrors[:max(1 if preferred else 0, limit - 1)]
+        return mirrors + [''] if preferred else [''] + mirrors  # type: ignore[return-value]
+
+
+class HttpResponse:
+    """HttpClient 的响应。非流式时 body 已读完；流式时用 read() 分段读取，读完后调用 release() 归还连接。"""
+
+    def __init__(self, client: 'HttpClient', key: Tuple[str, str, bool], conn: object, resp: object, url: str,
+                 connect_time: float, ttfb: float):
+        self._client = client
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+        self.status: int = resp.status  # type: ignore[attr-defined]
+        self.headers: Dict[str, str] = {k.lower(): v for k, v in resp.getheaders()}  # type: ignore[attr-defined]
+        self.url = url
+        self.connect_time = connect_time
+        self.ttfb = ttfb
+        self.body = b''
+
+    def read(self, amt: int | None = None) -> bytes:
+        return self._resp.read(amt)  # type: ignore[attr-defined]
+
+    def release(self) -> None:
+        """响应已读完且服务器未要求关闭时归还连接，否则关闭（未读完的连接无法复用）。"""
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if self._resp.isclosed() and self.headers.get('connection', '').lower() != 'close':  # type: ignore[attr-defined]
+            self._client._release(self._key, conn)
+        else:
+            try:
+                conn.close()  # type: ignore[attr-defined]
+            except Exception:
+                pass
+
+
+class HttpClient:
+    """工具内所有 HTTP 请求共用的客户端：
+    - 按 (scheme, host) 复用 HTTP/1.1 keep-alive 连接（线程安全的空闲连接池）
+    - 共享 TLS 上下文，避免每次请求重新创建；默认校验证书，仅对显式配置 verify_ssl=false 的镜像主机
+      或调用方传入 verify=False 的请求（镜像测速探测）不校验，两类连接分池存放、互不复用
+    - 可配置超时；连接错误与 502/503/504 按指数退避重试（仅幂等方法）"""
+
+    RETRY_STATUS = (502, 503, 504)
+    USER_AGENT = 'comfyui-envtools'
+
+    def __init__(self, timeout: float = 10.0, retries: int = 2, backoff: float = 0.5,
+                 max_idle_per_host: int = 8, verify_ssl: bool = True):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_idle_per_host = max_idle_per_host
+        self.verify_ssl = verify_ssl
+        self._ssl_ctx: Dict[bool, object] = {}
+        self._idle: Dict[Tuple[str, str, bool], List[object]] = {}
+        self._lock = threading.Lock()
+
+    # ---- 对外接口 ----
+    def request(self, method: str, url: str, headers: Dict[str, str] | None = None, body: bytes | None = None,
+                timeout: float | None = None, stream: bool = False, fresh: bool = False,
+                max_redirects: int = 3, retries: int | None = None, verify: bool | None = None) -> HttpResponse:
+        """发起请求并跟随重定向。stream=False 时读完响应体（自动解 gzip）并归还连接；
+        fresh=True 时首个请求强制新建连接，用于测量建连耗时。
+        verify 为空时按客户端设置与镜像配置决定是否校验证书，False 仅供测速探测等不依赖响应内容可信的请求使用。"""
+        import http.client, urllib.parse
+        idempotent = method.upper() in ('GET', 'HEAD', 'OPTIONS')
+        tries = (self.retries if retries is None else retries) + 1 if idempotent else 1
+        last_exc: Exception | None = None
+        for attempt in range(tries):
+            if attempt:
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+            try:
+                target = url
+                for _ in range(max_redirects + 1):
+                    resp = self._send(method, target, headers or {}, body, timeout, fresh and target == url, verify)
+                    if resp.status in (301, 302, 303, 307, 308) and resp.headers.get('location'):
+                        resp.read()
+                        resp.release()
+                        target = urllib.parse.urljoin(target, resp.headers['location'])
+                        continue
+                    break
+                else:
+                    raise RuntimeError('重定向次数过多')
+                if resp.status in self.RETRY_STATUS and attempt + 1 < tries:
+                    resp.read()
+                    resp.release()
+                    continue
+                if not stream:
+                    data = resp.read()
+                    resp.release()
+                    if resp.headers.get('content-encoding', '').lower() == 'gzip':
+                        import gzip
+                        data = gzip.decompress(data)
+                    resp.body = data
+                return resp
+            except (http.client.HTTPException, ConnectionError, OSError) as e:
+                last_exc = e
+        raise last_exc if last_exc else RuntimeError('请求失败')
+
+    def get(self, url: str, headers: Dict[str, str] | None = None, **kwargs: object) -> HttpResponse:
+        return self.request('GET', url, headers, **kwargs)  # type: ignore[arg-type]
+
+    def head(self, url: str, headers: Dict[str, str] | None = None, **kwargs: object) -> HttpResponse:
+        return self.request('HEAD', url, headers, **kwargs)  # type: ignore[arg-type]
+
+    def get_json(self, url: str, headers: Dict[str, str] | None = None, timeout: float | None = None) -> object:
+        """GET 并解析 JSON（供插件更新检查等 Web API 使用），HTTP 错误抛出 RuntimeError。"""
+        resp = self.get(url, dict({'Accept': 'application/json', 'Accept-Encoding': 'gzip'}, **(headers or {})), timeout=timeout)
+        if resp.status >= 400:
+            raise RuntimeError(f"HTTP {resp.status}")
+        return json.loads(resp.body.decode('utf-8', errors='replace'))
+
+    def close(self) -> None:
+        with self._lock:
+            conns = [c for lst in self._idle.values() for c in lst]
+            self._idle.clear()
+        for c in conns:
+            try:
+                c.close()  # type: ignore[attr-defined]
+            except Exception:
+                pass
+
+    # ---- 连接池 ----
+    def _send(self, method: str, url: str, headers: Dict[str, str], body: bytes | None,
+              timeout: float | None, fresh: bool, verify: bool | None = None) -> HttpResponse:
+        import http.client, urllib.parse
+        parts = urllib.parse.urlsplit(url)
+        if verify is None:
+            verify = self.verify_ssl and (parts.hostname or '') not in TLS_UNVERIFIED_HOSTS
+        key = (parts.scheme, parts.netloc, bool(verify))
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        send_headers = dict({'User-Agent': self.USER_AGENT}, **headers)
+        while True:
+            conn, reused = (None, False) if fresh else self._acquire(key)
+            connect_t = 0.0
+            if conn is None:
+                conn = self._new_connection(key, timeout)
+                t0 = time.perf_counter()
+                conn.connect()  # type: ignore[attr-defined]
+                connect_t = time.perf_counter() - t0
+            elif timeout is not None:
+                conn.timeout = timeout  # type: ignore[attr-defined]
+                if getattr(conn, 'sock', None) is not None:
+                    conn.sock.settimeout(timeout)  # type: ignore[attr-defined]
+            try:
+                t1 = time.perf_counter()
+                conn.request(method, path, body=body, headers=send_headers)  # type: ignore[attr-defined]
+                resp = conn.getresponse()  # type: ignore[attr-defined]
+                return HttpResponse(self, key, conn, resp, url, connect_t, time.perf_counter() - t1)
+            except (http.client.HTTPException, ConnectionError, OSError):
+                try:
+                    conn.close()  # type: ignore[attr-defined]
+                except Exception:
+                    pass
+                if not reused:
+                    raise
+                # 复用的空闲连接可能已被服务器关闭：不计入重试次数，直接换新连接
+
+    def _new_connection(self, key: Tuple[str, str, bool], timeout: float | None) -> object:
+        import http.client
+        t = self.timeout if timeout is None else timeout
+        if key[0] == 'https':
+            return http.client.HTTPSConnection(key[1], timeout=t, context=self._context(key[2]))
+        return http.client.HTTPConnection(key[1], timeout=t)
+
+    def _context(self, verify: bool = True) -> object:
+        with self._lock:
+            ctx = self._ssl_ctx.get(verify)
+            if ctx is None:
+                import ssl
+                ctx = ssl.create_default_context()
+                if not verify:
+                    # 与 pip 的 --trusted-host 用法一致：证书链不全的镜像仍可访问
+                    ctx.check_hostname = False
+                    ctx.verify_mode = ssl.CERT_NONE
+                self._ssl_ctx[verify] = ctx
+        return ctx
+
+    def _acquire(self, key: Tuple[str, str, bool]) -> Tuple[object, bool]:
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return None, False
+
+    def _release(self, key: Tuple[str, str, bool], conn: object) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        try:
+            conn.close()  # type: ignore[attr-defined]
+        except Exception:
+            pass
+
+
+class SimpleIndexClient:
+    """PEP 691（JSON）/ PEP 503（HTML）简单索引客户端。
+    - HTTP 请求经共享的 HttpClient（keep-alive 连接池、重试）
+    - 项目页解析结果缓存在磁盘，过期后用 ETag / Last-Modified 条件请求重新验证
+    - 返回按 PEP 440 排序的完整版本列表及每个版本的 wheel 标签"""
+
+    ACCEPT = 'application/vnd.pypi.simple.v1+json, application/vnd.pypi.simple.v1+html;q=0.2, text/html;q=0.01'
+
+    def __init__(self, cache_dir: str | None = None, timeout: float = 10.0, max_age: float = 600.0,
+                 http: HttpClient | None = None):
+        self.cache_dir = cache_dir or os.path.join(os.getcwd(), 'index_cache')
+        self.timeout = timeout
+        self.max_age = max_age
+        self.http = http or HttpClient(timeout=timeout)
+        self._memory: Dict[str, Dict[str, object]] = {}
+
+    # ---- 对外接口 ----
+    def get_project(self, index_url: str, name: str, max_age: float | None = None) -> Dict[str, object]:
+        """获取项目信息：{name, url, versions(新→旧), files, wheel_tags{版本: [标签]}, yanked[版本], from_cache}。"""
+        import urllib.parse
+        base = (index_url or 'https://pypi.org/simple/').rstrip('/') + '/'
+        url = urllib.parse.urljoin(base, canonicalize_name(name) + '/')
+        ttl = self.max_age if max_age is None else max_age
+        cached = self._cache_load(url)
+        if cached is not None and time.time() - float(cached.get('fetched') or 0) < ttl:
+            return dict(cached['project'], from_cache=True)  # type: ignore[arg-type]
+        headers = {'Accept': self.ACCEPT, 'Accept-Encoding': 'gzip'}
+        if cached is not None:
+            if cached.get('etag'):
+                headers['If-None-Match'] = str(cached['etag'])
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = str(cached['last_modified'])
+        resp = self.http.get(url, headers, timeout=self.timeout)
+        status, resp_headers, body, final_url = resp.status, resp.headers, resp.body, resp.url
+        if status == 304 and cached is not None:
+            cached['fetched'] = time.time()
+            self._cache_store(url, cached)
+            return dict(cached['project'], from_cache=True)  # type: ignore[arg-type]
+        if status == 404:
+            raise LookupError(f"索引中不存在 {name}")
+        if status >= 400:
+            raise RuntimeError(f"HTTP {status}")
+        ctype = resp_headers.get('content-type', '')
+        text = body.decode('utf-8', errors='replace')
+        files = self._parse_json(text, final_url) if 'json' in ctype else self._parse_html(text, final_url)
+        project = self._summarize(name, final_url, files)
+        self._cache_store(url, {'fetched': time.time(), 'etag': resp_headers.get('etag', ''),
+                                'last_modified': resp_headers.get('last-modified', ''), 'project': project})
+        return dict(project, from_cache=False)
+
+    def versions(self, index_url: str, name: str) -> List[str]:
+        return list(self.get_project(index_url, name)['versions'])  # type: ignore[arg-type]
+
+    # ---- 解析 ----
+    def _parse_json(self, text: str, page_url: str) -> List[Dict[str, object]]:
+        import urllib.parse
+        data = json.loads(text)
+        files = []
+        for f in data.get('files') or []:
+            files.append({'filename': f.get('filename') or '', 'url': urllib.parse.urljoin(page_url, f.get('url') or ''),
+                          'requires_python': f.get('requires-python') or '', 'yanked': bool(f.get('yanked'))})
+        return files
+
+    def _parse_html(self, text: str, page_url: str) -> List[Dict[str, object]]:
+        import html, urllib.parse
+        files = []
+        for attrs, label in re.findall(r'<a\s+([^>]*)>(.*?)</a>', text, flags=re.I | re.S):
+            href = re.search(r'href\s*=\s*["\']([^"\']*)["\']', attrs, flags=re.I)
+            if not href:
+                continue
+            rp = re.search(r'data-requires-python\s*=\s*["\']([^"\']*)["\']', attrs, flags=re.I)
+            url = urllib.parse.urljoin(page_url, html.unescape(href.group(1)))
+            filename = html.unescape(label.strip()) or os.path.basename(urllib.parse.urlsplit(url).path)
+            files.append({'filename': filename, 'url': url, 'requires_python': html.unescape(rp.group(1)) if rp else '',
+                          'yanked': 'data-yanked' in attrs.lower()})
+        return files
+
+    def _summarize(self, name: str, url: str, files: List[Dict[str, object]]) -> Dict[str, object]:
+        """由文件列表得出版本集合（PEP 440 排序）与每个版本的 wheel 标签。"""
+        by_version: Dict[str, Dict[str, object]] = {}
+        for f in files:
+            ver, tags = self._parse_filename(str(f['filename']))
+            if ver is None:
+                continue
+            entry = by_version.setdefault(ver, {'tags': set(), 'sdist': False, 'yanked': True})
+            if tags:
+                entry['tags'].update(tags)  # type: ignore[union-attr]
+            else:
+                entry['sdist'] = True
+            if not f.get('yanked'):
+                entry['yanked'] = False
+        ordered = sorted(by_version, key=lambda v: Version(v), reverse=True)
+        return {
+            'name': name,
+            'url': url,
+            'versions': [v for v in ordered if not by_version[v]['yanked']],
+            'yanked': [v for v in ordered if by_version[v]['yanked']],
+            'wheel_tags': {v: sorted(by_version[v]['tags']) for v in ordered},  # type: ignore[arg-type]
+            'has_sdist': [v for v in ordered if by_version[v]['sdist']],
+            'files': files,
+        }
+
+    @staticmethod
+    def _parse_filename(filename: str) -> Tuple[Optional[str], List[str]]:
+        """从分发文件名解析 (规范化版本, wheel 标签列表)；sdist 的标签列表为空。"""
+        ver = ''
+        tags: List[str] = []
+        if filename.endswith('.whl'):
+            parts = filename[:-4].split('-')
+            if len(parts) not in (5, 6):
+                return None, []
+            ver = parts[1]
+            for py in parts[-3].split('.'):
+                for abi in parts[-2].split('.'):
+                    for plat in parts[-1].split('.'):
+                        tags.append(f"{py}-{abi}-{plat}")
+        else:
+            for ext in ('.tar.gz', '.zip', '.tar.bz2', '.tgz'):
+                if filename.endswith(ext):
+                    stem = filename[:-len(ext)]
+                    if '-' not in stem:
+                        return None, []
+                    ver = stem.rsplit('-', 1)[1]
+                    break
+            else:
+                return None, []
+        try:
+            return str(Version(ver)), tags
+        except InvalidVersion:
+            return None, []
+
+    # ---- 磁盘缓存 ----
+    def _cache_path(self, url: str) -> str:
+        import hashlib
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _cache_load(self, url: str) -> Optional[Dict[str, object]]:
+        if url in self._memory:
+            return self._memory[url]
+        try:
+            with open(self._cache_path(url), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._memory[url] = data
+            return data
+        except Exception:
+            return None
+
+    def _cache_store(self, url: str, data: Dict[str, object]) -> None:
+        self._memory[url] = data
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = self._cache_path(url) + f'.{threading.get_ident()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self._cache_path(url))
+        except Exception:
+            pass
+
+
+class LocalSimpleIndexServer:
+    """本地最小简单索引服务（devpi 式替身），用于离线测速、故障切换与版本查询测试：
+    把 root_dir 下平铺的 wheel / sdist 按 PEP 503（HTML）与 PEP 691（JSON）发布在 /simple/，
+    文件在 /files/ 下提供（支持 Range），项目页带 ETag 以便测试条件请求缓存。
+    latency 模拟网络延迟（秒），fail=True 时所有请求返回 503 以模拟镜像故障。
+        with LocalSimpleIndexServer('wheels') as srv:
+            register_mirror('本地索引', srv.url)"""
+
+    def __init__(self, root_dir: str, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0):
+        self.root_dir = os.path.abspath(root_dir)
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.fail = False
+        self.requests = 0
+        self._server: object = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/simple/"
+
+    def start(self) -> str:
+        """在后台线程启动服务，返回简单索引地址。"""
+        from http.server import ThreadingHTTPServer
+        self._server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self.port = self._server.server_address[1]  # type: ignore[attr-defined]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)  # type: ignore[attr-defined]
+        self._thread.start()
+        return self.url
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()  # type: ignore[attr-defined]
+            self._server.server_close()  # type: ignore[attr-defined]
+            self._server = None
+
+    def __enter__(self) -> 'LocalSimpleIndexServer':
+        self.start()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.stop()
+
+    def projects(self) -> Dict[str, List[str]]:
+        """{规范化项目名: [文件名]}，每次请求时重新扫描目录，便于测试中途增删文件。"""
+        result: Dict[str, List[str]] = {}
+        try:
+            names = sorted(os.listdir(self.root_dir))
+        except OSError:
+            return result
+        for fn in names:
+            ver, _ = SimpleIndexClient._parse_filename(fn)
+            if ver is None:
+                continue
+            if fn.endswith('.whl'):
+                project = fn.split('-')[0]
+            else:
+                project = re.sub(r'\.(tar\.gz|zip|tar\.bz2|tgz)$', '', fn).rsplit('-', 1)[0]
+            result.setdefault(canonicalize_name(project), []).append(fn)
+        return result
+
+    def _make_handler(self) -> type:
+        import hashlib, html
+        from http.server import BaseHTTPRequestHandler
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive，与真实镜像行为一致
+
+            def log_message(self, *args: object) -> None:
+                pass
+
+            def _send(self, status: int, body: bytes, ctype: str | None = 'text/html', extra: Dict[str, str] | None = None) -> None:
+                self.send_response(status)
+                if ctype:  # 304 不能带 Content-Type，否则客户端会用它覆盖缓存页的类型
+                    self.send_header('Content-Type', ctype)
+                self.send_header('Content-Length', str(len(body)))
+                for k, v in (extra or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def do_HEAD(self) -> None:
+                self.do_GET()
+
+            def do_GET(self) -> None:
+                server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                if server.fail:
+                    return self._send(503, b'unavailable', 'text/plain')
+                path = self.path.split('?', 1)[0]
+                if path.startswith('/files/'):
+                    return self._file(os.path.basename(path[len('/files/'):]))
+                if not path.startswith('/simple/'):
+                    return self._send(404, b'not found', 'text/plain')
+                want_json = 'application/vnd.pypi.simple.v1+json' in (self.headers.get('Accept') or '')
+                projects = server.projects()
+                name = path[len('/simple/'):].strip('/')
+                if not name:
+                    if want_json:
+                        body = json.dumps({'meta': {'api-version': '1.0'}, 'projects': [{'name': n} for n in projects]}).encode()
+                    else:
+                        body = ''.join(f'<a href="{n}/">{n}</a>\n' for n in projects).encode()
+                    return self._page(body, want_json)
+                files = projects.get(canonicalize_name(name))
+                if files is None:
+                    return self._send(404, b'not found', 'text/plain')
+                entries = []
+                for fn in files:
+                    with open(os.path.join(server.root_dir, fn), 'rb') as f:
+                        digest = hashlib.sha256(f.read()).hexdigest()
+                    entries.append((fn, f"/files/{fn}", digest))
+                if want_json:
+                    body = json.dumps({'meta': {'api-version': '1.0'}, 'name': canonicalize_name(name),
+                                       'files': [{'filename': fn, 'url': u, 'hashes': {'sha256': d}} for fn, u, d in entries]}).encode()
+                else:
+                    body = ('<!DOCTYPE html><html><body>\n' + ''.join(
+                        f'<a href="{html.escape(u)}#sha256={d}">{html.escape(fn)}</a><br/>\n' for fn, u, d in entries)
+                        + '</body></html>').encode()
+                return self._page(body, want_json)
+
+            def _page(self, body: bytes, want_json: bool) -> None:
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    return self._send(304, b'', None, {'ETag': etag, 'Vary': 'Accept'})
+                ctype = 'application/vnd.pypi.simple.v1+json' if want_json else 'text/html'
+                return self._send(200, body, ctype, {'ETag': etag, 'Vary': 'Accept'})
+
+            def _file(self, fn: str) -> None:
+                full = os.path.join(server.root_dir, fn)
+                if not fn or not os.path.isfile(full):
+                    return self._send(404, b'not found', 'text/plain')
+                with open(full, 'rb') as f:
+                    data = f.read()
+                m = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range') or '')
+                if m:
+                    start = int(m.group(1))
+                    end = min(int(m.group(2)) if m.group(2) else len(data) - 1, len(data) - 1)
+                    return self._send(206, data[start:end + 1], 'application/octet-stream',
+                                      {'Content-Range': f'bytes {start}-{end}/{len(data)}'})
+                return self._send(200, data, 'application/octet-stream')
+
+        return _Handler
+
 
 class ComfyVenvTools:
     """
@@ -38,31 +1517,43 @@ class ComfyVenvTools:
         self._installed_packages_cache: Optional[set[str]] = None
         self._cache_timestamp: float = 0.0
         self._cache_timeout: float = 30.0  # 缓存30秒
+        # 解释器信息与 dist-info 清单缓存（按解释器路径）
+        self._env_info_cache: Dict[str, Dict[str, object]] = {}
+        self._dist_cache: Dict[str, Tuple[tuple, Dict[str, Dict[str, object]]]] = {}
+        # pip --dry-run --report 的解析结果缓存（内存 + dryrun_cache/），键含环境指纹，环境变化后自然失效
+        self._plan_cache: Dict[str, Dict[str, object]] = {}
+        self._req_parse_cache: Dict[str, Optional[Requirement]] = {}
+        self._meta_cache: Dict[str, Tuple[int, Dict[str, object]]] = {}
+        # 进程内依赖检查的增量状态：{解释器: {versions, results, reverse}}
+        self._conflict_state: Dict[str, Dict[str, object]] = {}
+        self.plan_cache_ttl = 3600.0
+        # 各解释器中 pip 的版本（决定可用的 pip 参数）
+        self._pip_version_cache: Dict[str, Tuple[int, ...]] = {}
+        # 镜像健康度（测速与真实安装共同更新）及后台测速线程
+        self.mirror_health = MirrorHealthTracker()
+        self._mirror_monitor: Optional[threading.Thread] = None
+        self._mirror_monitor_stop = threading.Event()
+        # 简单索引客户端（版本查询，带磁盘缓存）与各解释器支持的 wheel 标签
+        self.http = HttpClient()
+        self.index_client = SimpleIndexClient(http=self.http)
+        self._tags_cache: Dict[str, frozenset] = {}
+        # 长任务日志（中断后可继续）
+        self.journal = JobJournal()
 
     # ---------------------- 镜像与环境 ----------------------
     def test_mirror_speed(self, python_exe: str, mirror_name: str) -> str:
         """测试单个镜像源响应速度。
-        优先尝试HTTP连通性，其次使用 pip --dry-run 进行安装模拟以测延迟。
+        优先进行HTTP测速（连接/首字节/吞吐），失败时使用 pip --dry-run 进行安装模拟以测延迟。
         """
         self._last_python_exe = python_exe or self._last_python_exe
         self._last_mirror_name = mirror_name or self._last_mirror_name
-        url = PYPI_MIRRORS.get(mirror_name, '')
+        url = mirror_url(mirror_name)
         start = time.time()
-        # 1) HTTP连通性测试（HEAD）
+        # 1) HTTP 测速：连接、首字节与吞吐
         if url:
-            try:
-                import urllib.request, ssl
-                ctx = ssl.create_default_context()
-                ctx.check_hostname = False
-                ctx.verify_mode = ssl.CERT_NONE
-                req = urllib.request.Request(url, method='HEAD')
-                with urllib.request.urlopen(req, context=ctx, timeout=5) as resp:
-                    if resp.status < 400:
-                        elapsed = time.time() - start
-                        return f"镜像 {mirror_name} 连通性良好，响应时间 {elapsed:.2f}s"
-            except Exception:
-                # 回退到pip测试
-                pass
+            res = self.benchmark_mirrors({mirror_name: url})[0]
+            if res.get('ok'):
+                return f"镜像 {self.format_mirror_result(res)}"
         # 2) pip --dry-run 测试
         try:
             py = python_exe or 'python'
@@ -82,6 +1573,152 @@ class ComfyVenvTools:
         except Exception as e:
             return f"镜像 {mirror_name} 测试异常: {e}"
 
+    def benchmark_mirrors(self, mirrors: Dict[str, str] | None = None, probe_package: str = 'pip', sample_bytes: int = 1024 * 1024,
+                          timeout: float = 8.0, result_cb: Callable[[Dict[str, object]], None] | None = None) -> List[Dict[str, object]]:
+        """并发测试各镜像：连接耗时、简单索引页首字节时间（TTFB）、wheel 分段下载吞吐。
+        mirrors 缺省为 PYPI_MIRRORS，可传入本地 http:// 地址做替身测试。
+        综合得分 = 连接 + TTFB + 参考大小 / 吞吐（秒，越小越好），即拉取一个典型包的预估耗时。
+        result_cb 在每个镜像完成时回调，返回按得分排序的结果列表。"""
+        targets = [(n, u) for n, u in (mirrors if mirrors is not None else PYPI_MIRRORS).items() if u]
+        results: List[Dict[str, object]] = []
+        if not targets:
+            return results
+        from concurrent.futures import as_completed
+        with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+            futures = [pool.submit(self._probe_mirror, n, u, probe_package, sample_bytes, timeout) for n, u in targets]
+            for fut in as_completed(futures):
+                res = fut.result()
+                results.append(res)
+                self.mirror_health.record(str(res['name']), float(res['score']) if res.get('ok') else None, bool(res.get('ok')), str(res.get('error') or ''))  # type: ignore[arg-type]
+                if result_cb:
+                    try:
+                        result_cb(res)
+                    except Exception:
+                        pass
+        results.sort(key=lambda r: float(r['score']))  # type: ignore[arg-type]
+        return results
+
+    def format_mirror_result(self, res: Dict[str, object]) -> str:
+        """单个镜像测速结果的一行描述。"""
+        if not res.get('ok'):
+            return f"{res['name']}: 失败 {res.get('error') or ''}"
+        thr = res.get('throughput')
+        thr_s = f"{float(thr) / (1024**2):.2f} MB/s" if thr else '吞吐未知'  # type: ignore[arg-type]
+        return (f"{res['name']}: 连接 {float(res['connect']) * 1000:.0f}ms，首字节 {float(res['ttfb']) * 1000:.0f}ms，"  # type: ignore[arg-type]
+                f"{thr_s}，得分 {float(res['score']):.2f}s")  # type: ignore[arg-type]
+
+    def _probe_mirror(self, name: str, url: str, probe_package: str, sample_bytes: int, timeout: float) -> Dict[str, object]:
+        """测试单个镜像；任何一步失败都记录原因并给出无穷大得分。
+        首个请求强制新建连接以测量建连耗时，之后的请求复用该连接。
+        与原先的 HEAD 连通性测试一样不校验证书（只测速度，不使用响应内容），探测连接不会被正常请求复用。"""
+        import urllib.parse
+        res: Dict[str, object] = {'name': name, 'url': url, 'ok': False, 'connect': None, 'ttfb': None,
+                                  'throughput': None, 'score': float('inf'), 'error': ''}
+        try:
+            page_url = urllib.parse.urljoin(url if url.endswith('/') else url + '/', f"{probe_package}/")
+            page = self.http.get(page_url, {'Accept': 'text/html'}, timeout=timeout, fresh=True, retries=0, verify=False)
+            if page.status >= 400:
+                raise RuntimeError(f"HTTP {page.status}")
+            connect, ttfb = page.connect_time, page.ttfb
+            res['connect'], res['ttfb'] = connect, ttfb
+            wheels = re.findall(r'href=["\']([^"\']+?\.whl)(?:#[^"\']*)?["\']', page.body.decode('utf-8', errors='replace'))
+            if wheels:
+                wheel_url = urllib.parse.urljoin(page.url, wheels[-1])
+                resp = self.http.get(wheel_url, {'Range': f'bytes=0-{sample_bytes - 1}'}, timeout=timeout, stream=True, retries=0, verify=False)
+                try:
+                    if resp.status < 400:
+                        got = 0
+                        start = time.perf_counter()
+                        while got < sample_bytes:
+                            chunk = resp.read(min(65536, sample_bytes - got))
+                            if not chunk:
+                                break
+                            got += len(chunk)
+                        elapsed = max(time.perf_counter() - start, 1e-6)
+                        if got:
+                            res['throughput'] = got / elapsed
+                finally:
+                    resp.release()
+            thr = float(res['throughput'] or 0)
+            # 参考大小 5MB；取不到吞吐时按 0.2MB/s 的保守值计分
+            res['score'] = connect + ttfb + (5 * 1024 * 1024) / (thr if thr > 0 else 0.2 * 1024 * 1024)
+            res['ok'] = True
+        except Exception as e:
+            res['error'] = str(e) or e.__class__.__name__
+        return res
+
+    # ---------------------- 镜像健康度与自动切换 ----------------------
+    def start_mirror_monitor(self, interval: float = 600.0) -> None:
+        """后台定期对所有镜像做轻量测速，持续更新健康度。"""
+        if self._mirror_monitor is not None and self._mirror_monitor.is_alive():
+            return
+        self._mirror_monitor_stop.clear()
+
+        def _loop() -> None:
+            delay = 5.0  # 启动后尽快测一轮，之后按间隔
+            while not self._mirror_monitor_stop.wait(delay):
+                try:
+                    self.benchmark_mirrors(sample_bytes=256 * 1024, timeout=6.0)
+                except Exception:
+                    pass
+                delay = interval
+
+        self._mirror_monitor = threading.Thread(target=_loop, daemon=True)
+        self._mirror_monitor.start()
+
+    def stop_mirror_monitor(self) -> None:
+        self._mirror_monitor_stop.set()
+
+    def format_mirror_ranking(self) -> str:
+        """镜像健康度排名文本（含官方源）。"""
+        lines = ["[镜像排名] 按综合得分（预估耗时×错误率惩罚，越小越好）:"]
+        for i, r in enumerate(self.mirror_health.ranking(list(PYPI_MIRRORS) + ['']), 1):
+            name = r['name'] or '官方源(PyPI)'
+            lat = f"{float(r['latency']):.2f}s" if r['latency'] else '未测'  # type: ignore[arg-type]
+            line = f"  {i}. {name}: 得分 {float(r['score']):.2f}，预估耗时 {lat}，错误率 {float(r['error_rate']) * 100:.0f}%，样本 {r['samples']}"  # type: ignore[arg-type]
+            if r.get('last_error'):
+                line += f"，最近错误: {r['last_error']}"
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def _is_network_error(self, output: str) -> bool:
+        """判断 pip 失败是否由网络/镜像引起（而非包本身的问题）。"""
+        return any(p in (output or '') for p in _NETWORK_ERROR_PATTERNS)
+
+    def run_pip_with_failover(self, cmd: List[str], mirror_name: str | None, timeout: int = 1200, tag: str = '',
+                              max_attempts: int = 3) -> Tuple[bool, str, str]:
+        """执行 pip 命令（不含索引参数），网络错误或镜像缺包时按健康度切换到下一个镜像。
+        返回 (是否成功, 失败原因摘要, 最后使用的镜像名)。"""
+        order = self.mirror_health.failover_order(mirror_name, list(PYPI_MIRRORS), limit=max(1, max_attempts))
+        reason = ''
+        used = mirror_name or ''
+        for i, m in enumerate(order):
+            job_checkpoint()  # 任务已取消时不再换镜像重试
+            used = m
+            started = time.monotonic()
+            try:
+                code, out = _run_captured(cmd + self._mirror_pip_args(m), timeout)
+                ok = code == 0
+                if code is None:
+                    out = 'timed out'
+            except Exception as e:
+                return False, str(e), used
+            network = not ok and self._is_network_error(out)
+            # 成功安装的耗时计入镜像的预估耗时；失败（含非网络原因的失败）只更新错误率
+            self.mirror_health.record(m, time.monotonic() - started if ok else None, ok or not network,
+                                      self._summarize_pip_error(out) if network else '')
+            if ok:
+                return True, '', used
+            reason = '超时' if out == 'timed out' else self._summarize_pip_error(out)
+            missing = 'No matching distribution found' in out or 'Could not find a version that satisfies' in out
+            if not (network or missing) or i == len(order) - 1:
+                break
+            try:
+                self.log(f"{tag} 镜像 {m or '官方源'} 失败（{reason}），切换到 {order[i + 1] or '官方源'} 重试")
+            except Exception:
+                pass
+        return False, reason, used
+
     def set_python_env(self, python_exe: str) -> str:
         """设置后端当前Python环境以便后续操作复用。"""
         # 如果环境发生变化，清除缓存
@@ -215,30 +1852,29 @@ class ComfyVenvTools:
             progress_cb(0.1)
         
         py = python_exe or self._last_python_exe or 'python'
-        mirror_url = PYPI_MIRRORS.get(self._last_mirror_name or '', '')
-        cmd: List[str] = [py, '-m', 'pip', 'install', '--dry-run', '-r', requirements_path]
-        if mirror_url:
-            host = mirror_url.split('/')[2]
-            cmd += ['--index-url', mirror_url, '--trusted-host', host]
+        cmd: List[str] = [py, '-m', 'pip', 'install', '--dry-run', '-r', requirements_path] + mirror_pip_args(self._last_mirror_name)
         
         try:
             if progress_cb:
                 progress_cb(0.2)
             
-            # 先解析依赖文件，获取包数量用于进度估算
-            packages = self._parse_dependencies(requirements_path)
-            total_packages = len(packages)
-            
-            if progress_cb:
-                progress_cb(0.3)
-            
-            proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace', timeout=180, creationflags=CREATE_NO_WINDOW)
-            out = (proc.stdout or '').strip()
-            
+            # 优先使用 --report 的结构化计划（包数量与下载大小）
+            preview = self.preview_install(py, ['-r', requirements_path], self._last_mirror_name)
             if progress_cb:
                 progress_cb(0.8)
+            if preview.get('ok'):
+                if not preview.get('items'):
+                    return "[模拟安装] ✓ 预检通过！所有依赖已满足，无需安装新包"
+                return f"[模拟安装] ✓ 预检通过！{self.format_install_preview(preview)}"
+            if preview.get('supported'):
+                returncode, out = 1, str(preview.get('output') or '').strip()
+            else:
+                # 较旧的 pip 不支持 --report，退回解析普通 --dry-run 输出
+                proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace', timeout=180, creationflags=CREATE_NO_WINDOW)
+                returncode, out = proc.returncode, (proc.stdout or '').strip()
+            total_packages = len(self._parse_dependencies(requirements_path))
             
-            if proc.returncode == 0:
+            if returncode == 0:
                 # 分析输出，提供更友好的结果
                 lines = out.split('\n')
                 install_lines = [line for line in lines if 'Collecting' in line or 'Downloading' in line or 'Installing' in line]
@@ -269,27 +1905,36 @@ class ComfyVenvTools:
                 elif "Permission denied" in out:
                     return f"[模拟安装] ✗ 失败：权限不足\n请检查Python环境权限\n\n{out[:400]}"
                 else:
-                    return f"[模拟安装] ✗ 失败（返回码{proc.returncode}）\n建议检查依赖冲突或编译环境\n\n{out[:800]}"
+                    return f"[模拟安装] ✗ 失败（返回码{returncode}）\n建议检查依赖冲突或编译环境\n\n{out[:800]}"
                     
         except subprocess.TimeoutExpired:
             return "[模拟安装] ⏰ 超时！依赖项可能过多或网络较慢，建议分批安装"
         except Exception as e:
             return f"[模拟安装] ❌ 执行异常: {e}\n请检查Python环境和网络连接"
 
-    def simulate_install_missing(self, specs: List[str], python_exe: str, mirror_name: str | None = None) -> str:
+    def simulate_install_missing(self, specs: List[str], python_exe: str, mirror_name: str | None = None,
+                                 progress_cb: Callable[[float], None] | None = None) -> str:
         """仅对传入的未安装依赖执行 --dry-run 安装。
         specs: 直接传入的依赖规格列表（例如 'numpy==1.26.4' 或 'numpy'）。
+        解析结果会被缓存，随后的实际安装复用它固定版本。
         """
         specs = list(specs or [])
         if not specs:
             return '[模拟安装] 未发现可模拟安装的依赖项（列表为空）'
         py = python_exe or self._last_python_exe or 'python'
         mname = mirror_name or self._last_mirror_name or ''
-        mirror_url = PYPI_MIRRORS.get(mname, '')
-        cmd: List[str] = [py, '-m', 'pip', 'install', '--dry-run'] + specs
-        if mirror_url:
-            host = mirror_url.split('/')[2]
-            cmd += ['-i', mirror_url, '--trusted-host', host]
+        cmd: List[str] = [py, '-m', 'pip', 'install', '--dry-run'] + specs + mirror_pip_args(mname)
+        if progress_cb:
+            progress_cb(0.1)
+        preview = self.preview_install(py, specs, mname)
+        if progress_cb:
+            progress_cb(0.9)
+        if preview.get('ok'):
+            if not preview.get('items'):
+                return '[模拟安装] 仅针对未安装依赖：所有依赖已满足，无需安装新包'
+            return f"[模拟安装] 仅针对未安装依赖成功！{self.format_install_preview(preview)}"
+        if preview.get('supported'):
+            return f"[模拟安装] 失败\n\n{str(preview.get('output') or '').strip()[:1800]}"
         try:
             proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace', timeout=180, creationflags=CREATE_NO_WINDOW)
             out = (proc.stdout or '').strip()
@@ -331,68 +1976,33 @@ class ComfyVenvTools:
         self._last_python_exe = python_exe or self._last_python_exe
         self._last_mirror_name = mirror_name or self._last_mirror_name
         py = python_exe or 'python'
-        mirror_url = PYPI_MIRRORS.get(mirror_name or '', '')
         
-        # 先解析依赖文件，获取包信息
-        packages = self._parse_dependencies(requirements_path)
-        total_packages = len(packages)
+        # 索引参数由 _run_pip_streaming 按镜像健康度追加（失败时自动切换镜像）
+        cmd: List[str] = [py, '-m', 'pip', 'install', '-r', requirements_path]
         
+        # 通过 --report 预演得到安装计划与下载总量，用于按字节推进进度
+        preview = self.preview_install(py, ['-r', requirements_path], mirror_name)
+        if preview.get('ok'):
+            self.log(f"[实际安装] {self.format_install_preview(preview, limit=10)}")
+            # 用预演（或之前模拟安装缓存）的解析结果生成约束文件，固定版本避免重复求解
+            constraints = self.write_plan_constraints(preview.get('report'))  # type: ignore[arg-type]
+            if constraints:
+                cmd += ['-c', constraints]
+                self.log(f"[实际安装] 复用预演解析结果，约束文件: {constraints}")
         if progress_cb:
             progress_cb(0.2)
         
-        cmd: List[str] = [py, '-m', 'pip', 'install', '-r', requirements_path]
-        if mirror_url:
-            host = mirror_url.split('/')[2]
-            cmd += ['-i', mirror_url, '--trusted-host', host]
-        
+        txn = self.begin_install_transaction(py, ['-r', requirements_path], mirror_name, label=f"实际安装 {os.path.basename(plugin_dir or requirements_path)}",
+                                             fallback_names=self._parse_requirements_txt(requirements_path), preview=preview)
         try:
-            if progress_cb:
-                progress_cb(0.3)
-            
-            # 使用实时输出捕获，提供更好的进度反馈
-            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
-            
-            output_lines = []
-            collected_packages = []
-            downloaded_packages = []
-            installed_packages = []
-            
-            while True:
-                try:
-                    line = proc.stdout.readline()
-                except UnicodeDecodeError:
-                    # 如果遇到编码错误，尝试跳过这一行
-                    continue
-                if not line and proc.poll() is not None:
-                    break
-                if line:
-                    msg = line.strip()
-                    output_lines.append(msg)
-                    try:
-                        if msg:
-                            self.log(f"[实际安装] {msg}")
-                    except Exception:
-                        pass
-                    # 解析进度信息
-                    if 'Collecting' in msg:
-                        pkg = msg.split('Collecting')[1].split()[0]
-                        collected_packages.append(pkg)
-                        if progress_cb and total_packages > 0:
-                            progress = 0.3 + 0.4 * len(collected_packages) / total_packages
-                            progress_cb(min(progress, 0.7))
-                    elif 'Downloading' in msg:
-                        pkg = msg.split('Downloading')[1].split('-')[0]
-                        downloaded_packages.append(pkg)
-                        if progress_cb:
-                            progress = 0.7 + 0.2 * len(downloaded_packages) / total_packages
-                            progress_cb(min(progress, 0.9))
-                    elif 'Successfully installed' in msg:
-                        success_part = msg.split('Successfully installed')[1].strip()
-                        installed_packages.extend([pkg.strip() for pkg in success_part.split()])
-                        if progress_cb:
-                            progress_cb(0.95)
+            if progress_cb:
+                progress_cb(0.3)
             
-            returncode = proc.poll()
+            returncode, output_lines = self._run_pip_streaming(cmd, '[实际安装]', preview, progress_cb, lo=0.3, hi=0.95, mirror_name=mirror_name or '')
+            installed_packages: List[str] = []
+            for msg in output_lines:
+                if msg.startswith('Successfully installed'):
+                    installed_packages.extend(pkg.strip() for pkg in msg.split('Successfully installed', 1)[1].split())
             full_output = '\n'.join(output_lines)
             
             if progress_cb:
@@ -413,11 +2023,13 @@ class ComfyVenvTools:
                         downloaded_count = len([line for line in output_lines if 'Downloaded' in line])
                         if cached_count > 0 or downloaded_count > 0:
                             summary += f"\n[实际安装] 缓存使用：{cached_count}个，新下载：{downloaded_count}个"
+                    summary += self._conflict_note(py, '[实际安装]')
                     
                     return summary + f"\n\n[详细输出]\n{full_output[-800:]}"
                 else:
                     return f"[实际安装] ✅ 安装完成！所有依赖已满足，无需新安装\n\n{full_output[-400:]}"
             else:
+                full_output += self._rollback_failed_install(txn, '[实际安装]')
                 # 分析错误类型，提供更具体的建议
                 if "No matching distribution found" in full_output:
                     return f"[实际安装] ❌ 失败：找不到匹配的包版本\n建议：检查包名拼写或尝试其他版本\n\n{full_output[-600:]}"
@@ -435,58 +2047,51 @@ class ComfyVenvTools:
         except Exception as e:
             return f"[实际安装] ❌ 执行异常: {e}\n建议：检查Python环境路径和网络连接"
 
-    def actual_install_missing(self, specs: List[str], python_exe: str, mirror_name: str, progress_cb: Callable[[float], None] | None = None) -> str:
-        """仅安装传入的未安装依赖规格，逐项输出并推进进度。"""
+    def actual_install_missing(self, specs: List[str], python_exe: str, mirror_name: str, progress_cb: Callable[[float], None] | None = None,
+                               job_id: str | None = None) -> str:
+        """仅安装传入的未安装依赖规格，逐项输出并推进进度。
+        每项结果写入任务日志；传入 job_id 时表示继续一个中断的任务。"""
         specs = list(specs or [])
         if not specs:
             return "[实际安装] 未发现未安装的依赖项"
         py = python_exe or self._last_python_exe or 'python'
         self._last_python_exe = py
         self._last_mirror_name = mirror_name or self._last_mirror_name
-        url = PYPI_MIRRORS.get(mirror_name or '', '')
+        if not job_id:
+            job_id = self.journal.start_job('install_missing', specs, {'python_exe': py, 'mirror_name': mirror_name or ''}, title=f'安装 {len(specs)} 个未安装依赖')
         total = len(specs)
         success_count = 0
         failed: List[str] = []
+        # 若刚模拟过同一批依赖，按其解析结果固定版本
+        constraints = self.write_plan_constraints(self.cached_install_plan(py, specs, mirror_name))
+        if constraints:
+            self.log(f"[实际安装] 复用模拟安装的解析结果，约束文件: {constraints}")
         for i, spec in enumerate(specs):
+            job_checkpoint()  # 取消后未完成的步骤保留在任务日志中，可稍后继续
             try:
                 self.log(f"[实际安装] 安装 {spec} ({i+1}/{total})")
             except Exception:
                 pass
-            cmd: List[str] = [py, '-m', 'pip', 'install', spec, '--no-deps']
-            if url:
-                host = url.split('/')[2]
-                cmd += ['--index-url', url, '--trusted-host', host, '--extra-index-url', 'https://pypi.org/simple', '--trusted-host', 'pypi.org']
-            try:
-                r = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace', timeout=600, creationflags=CREATE_NO_WINDOW)
-                out = (r.stdout or '').strip()
-                if r.returncode == 0:
-                    success_count += 1
-                    try:
-                        self.log(f"[实际安装] ✅ 成功 {spec}")
-                    except Exception:
-                        pass
-                else:
-                    failed.append(spec)
-                    # 输出最后几行错误摘要
-                    tail = '\n'.join(out.splitlines()[-6:])
-                    try:
-                        self.log(tail)
-                    except Exception:
-                        pass
-                if progress_cb:
-                    progress_cb(min(0.99, 0.1 + 0.8 * (i + 1) / max(1, total)))
-            except subprocess.TimeoutExpired:
-                failed.append(spec)
+            cmd: List[str] = [py, '-m', 'pip', 'install', spec, '--no-deps'] + (['-c', constraints] if constraints else [])
+            # 网络错误或镜像缺包时按健康度自动切换镜像（官方源兜底）
+            ok, reason, _ = self.run_pip_with_failover(cmd, mirror_name or '', timeout=600, tag='[实际安装]')
+            if ok:
+                success_count += 1
+                self.journal.record_step(job_id, spec, True)
                 try:
-                    self.log(f"[实际安装] ⏰ 超时 {spec}")
+                    self.log(f"[实际安装] ✅ 成功 {spec}")
                 except Exception:
                     pass
-            except Exception as e:
+            else:
                 failed.append(spec)
+                self.journal.record_step(job_id, spec, False, reason)
                 try:
-                    self.log(f"[实际安装] ❌ 出错 {spec} - {e}")
+                    self.log(f"[实际安装] ❌ 失败 {spec} - {reason}")
                 except Exception:
                     pass
+            if progress_cb:
+                progress_cb(min(0.99, 0.1 + 0.8 * (i + 1) / max(1, total)))
+        self.journal.finish_job(job_id)
         summary = f"[实际安装] 完成：成功 {success_count} / 失败 {len(failed)}"
         if failed:
             summary += "\n失败列表:\n" + "\n".join(failed[:100])
@@ -527,10 +2132,116 @@ class ComfyVenvTools:
             return f"[环境导出] 失败: {e}"
 
     def find_conflicts(self) -> str:
-        """运行 pip check 输出冲突信息。"""
+        """检查已安装包之间的依赖冲突（进程内读取 dist-info 依赖图，失败时回退到 pip check）。"""
         py = self._last_python_exe or 'python'
         try:
             self.log("[冲突检查] 正在检查依赖冲突...")
+            result = self.check_installed_conflicts(py)
+            if not result.get('checked'):
+                raise RuntimeError('未读取到已安装包')
+            return self.format_installed_conflicts(result)
+        except Exception as e:
+            self.log(f"[冲突检查] 进程内检查失败（{e}），改用 pip check")
+        return self._find_conflicts_pip_check(py)
+
+    def check_installed_conflicts(self, python_exe: str) -> Dict[str, object]:
+        """进程内等价于 pip check：遍历 dist-info 中每个包的 Requires-Dist，
+        按目标解释器的 PEP 508 标记（extra 为空）过滤后，用 PEP 440 检查已安装版本是否满足。
+        同一解释器的后续检查是增量的：只重新评估版本变化/新增/删除的包的依赖边，
+        以及依赖这些包的包。
+        返回 {conflicts:[{name, requirement, installed, required_by, required_by_version, kind}],
+              checked, rechecked, incremental, elapsed}；kind 为 missing（未安装）或 version（版本不符）。"""
+        start = time.time()
+        py = python_exe or self._last_python_exe or 'python'
+        dists = self._read_installed_distributions(py)
+        markers = dict(self._get_env_info(py).get('markers') or {}, extra='')  # type: ignore[arg-type]
+        current = {k: f"{d['version']}@{d['path']}" for k, d in dists.items()}
+        state = self._conflict_state.get(py)
+        incremental = state is not None
+        if state is None:
+            state = {'versions': {}, 'results': {}, 'reverse': {}}
+        versions: Dict[str, str] = state['versions']  # type: ignore[assignment]
+        results: Dict[str, List[Dict[str, object]]] = state['results']  # type: ignore[assignment]
+        reverse: Dict[str, set] = state['reverse']  # type: ignore[assignment]
+        changed = {k for k in set(versions) | set(current) if versions.get(k) != current.get(k)}
+        dirty = {k for k in changed if k in current}
+        for k in changed:
+            dirty.update(r for r in reverse.get(k, ()) if r in current)
+        for k in changed - set(current):
+            results.pop(k, None)
+        for key in dirty:
+            dist = dists[key]
+            found: List[Dict[str, object]] = []
+            for raw in dist['requires']:  # type: ignore[union-attr]
+                req = self._parse_requirement(str(raw))
+                if req is None:
+                    continue
+                if req.marker is not None:
+                    try:
+                        if not req.marker.evaluate(markers):
+                            continue
+                    except Exception:
+                        pass
+                dep = canonicalize_name(req.name)
+                reverse.setdefault(dep, set()).add(key)
+                target = dists.get(dep)
+                if target is None:
+                    found.append({'name': req.name, 'requirement': str(req.specifier), 'installed': None,
+                                  'required_by': dist['name'], 'required_by_version': dist['version'], 'kind': 'missing'})
+                    continue
+                try:
+                    ok = req.specifier.contains(str(target['version']), prereleases=True)
+                except Exception:
+                    ok = True
+                if not ok:
+                    found.append({'name': target['name'], 'requirement': str(req.specifier), 'installed': target['version'],
+                                  'required_by': dist['name'], 'required_by_version': dist['version'], 'kind': 'version'})
+            results[key] = found
+        state['versions'] = current
+        self._conflict_state[py] = state
+        conflicts = [c for k in sorted(results) for c in results[k]]
+        return {'conflicts': conflicts, 'checked': len(current), 'rechecked': len(dirty),
+                'incremental': incremental, 'elapsed': time.time() - start}
+
+    def format_installed_conflicts(self, result: Dict[str, object]) -> str:
+        """把进程内依赖检查的结果按被依赖包分组输出。"""
+        conflicts: List[Dict[str, object]] = result.get('conflicts') or []  # type: ignore[assignment]
+        mode = f"增量，重新评估 {result.get('rechecked')} 个" if result.get('incremental') else '全量'
+        stats = f"（检查 {result.get('checked')} 个包，{mode}，耗时 {float(result.get('elapsed') or 0) * 1000:.0f}ms）"  # type: ignore[arg-type]
+        if not conflicts:
+            return f"[冲突检查] ✅ 未发现依赖冲突{stats}\n\n所有安装的包依赖关系正常，没有冲突问题。"
+        grouped: Dict[str, List[Dict[str, object]]] = {}
+        for c in conflicts:
+            grouped.setdefault(str(c['name']), []).append(c)
+        out = [f"[冲突检查] ❌ 发现 {len(conflicts)} 处依赖冲突{stats}", "", "📋 冲突详情："]
+        for i, (name, items) in enumerate(sorted(grouped.items(), key=lambda x: x[0].lower()), 1):
+            installed = items[0]['installed']
+            out.append(f"  {i}. {name}（{'未安装' if installed is None else '已安装 ' + str(installed)}）")
+            for c in items:
+                out.append(f"       ← {c['required_by']} {c['required_by_version']} 需要 {name}{c['requirement'] or ''}")
+        out += ["", "💡 解决建议：",
+                "  1. 根据冲突信息，如果不可调和，可以尝试卸载不重要的冲突的包",
+                "  2. 使用精确查找库名称，升级、降级冲突包的版本号达到两者间的一个平衡点"]
+        return '\n'.join(out)[:4000]
+
+    def _conflict_note(self, python_exe: str, tag: str) -> str:
+        """安装完成后的增量依赖检查；有冲突时返回一段提示，否则返回空串。"""
+        try:
+            result = self.check_installed_conflicts(python_exe)
+        except Exception:
+            return ''
+        conflicts: List[Dict[str, object]] = result.get('conflicts') or []  # type: ignore[assignment]
+        if not conflicts:
+            return ''
+        lines = [f"\n{tag} ⚠️ 安装后存在 {len(conflicts)} 处依赖冲突："]
+        for c in conflicts[:10]:
+            have = '未安装' if c['installed'] is None else f"已安装 {c['installed']}"
+            lines.append(f"  - {c['required_by']} 需要 {c['name']}{c['requirement'] or ''}，{have}")
+        return '\n'.join(lines)
+
+    def _find_conflicts_pip_check(self, py: str) -> str:
+        """运行 pip check 输出冲突信息。"""
+        try:
             proc = subprocess.run([py, '-m', 'pip', 'check'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors='replace', timeout=60, creationflags=CREATE_NO_WINDOW)
             out = (proc.stdout or proc.stderr or '').strip()
             
@@ -577,20 +2288,87 @@ class ComfyVenvTools:
     def find_conflicting_libraries(self) -> str:
         return self.find_conflicts()
 
-    def migrate_environment(self) -> str:
-        """列出过期包，提供升级建议（不直接升级）。"""
+    def migrate_environment(self, progress_cb: Callable[[float], None] | None = None) -> str:
+        """列出过期包，提供升级建议（不直接升级）。并发查询索引，逐个输出结果。"""
         py = self._last_python_exe or 'python'
         try:
-            proc = subprocess.run([py, '-m', 'pip', 'list', '--outdated'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors='replace', timeout=60, creationflags=CREATE_NO_WINDOW)
-            out = (proc.stdout or '').strip()
-            if not out:
-                return "[迁移] 未检测到可升级的包"
-            return "[迁移] 以下包可升级（使用右侧命令或安装按钮进行升级）：\n\n" + out[:2500]
-        except subprocess.TimeoutExpired:
-            return "[迁移] 检测超时"
+            self.log("[迁移] 正在并发检查可升级的包...")
+            start = time.time()
+            found: List[Dict[str, object]] = []
+
+            def _on_result(res: Dict[str, object]) -> None:
+                if res.get('latest'):
+                    found.append(res)
+                    try:
+                        self.log(f"[迁移] {res['name']} {res['current']} → {res['latest']}")
+                    except Exception:
+                        pass
+
+            report = self.outdated_report(py, self._last_mirror_name, result_cb=_on_result, progress_cb=progress_cb)
+            outdated = [r for r in report if r.get('latest')]
+            errors = [r for r in report if r.get('error')]
+            if not outdated:
+                msg = "[迁移] 未检测到可升级的包"
+            else:
+                width = max(len(str(r['name'])) for r in outdated)
+                lines = [f"{str(r['name']).ljust(width)}  {r['current']} → {r['latest']}{SDIST_ONLY_MARK if r.get('kind') == 'sdist' else ''}" for r in outdated]
+                msg = "[迁移] 以下包可升级（使用右侧命令或安装按钮进行升级）：\n\n" + '\n'.join(lines)
+            msg += f"\n\n共检查 {len(report)} 个包，可升级 {len(outdated)} 个，耗时 {time.time() - start:.1f}s"
+            if errors:
+                msg += f"\n查询失败 {len(errors)} 个: " + ', '.join(str(r['name']) for r in errors[:20])
+            return msg
         except Exception as e:
             return f"[迁移] 执行异常: {e}"
 
+    def outdated_report(self, python_exe: str, mirror_name: str | None = None, max_workers: int = 16,
+                        result_cb: Callable[[Dict[str, object]], None] | None = None,
+                        progress_cb: Callable[[float], None] | None = None) -> List[Dict[str, object]]:
+        """并发查询所有已安装包的最新可用版本（复用简单索引客户端的连接池与缓存），本地按 PEP 440 比较。
+        最新版本只考虑目标解释器可安装的版本（有兼容 wheel 或源码包），当前为正式版时忽略预发布版。
+        每个包完成时回调 result_cb，返回 [{name, current, latest|None, kind, error}]（按包名排序）。"""
+        from concurrent.futures import as_completed
+        index_url = mirror_url(mirror_name) or 'https://pypi.org/simple/'
+        installed = self._read_installed_distributions(python_exe)
+        self.get_supported_tags(python_exe)  # 预先探测，避免各线程重复启动子进程
+        total = max(1, len(installed))
+
+        def _check(dist: Dict[str, object]) -> Dict[str, object]:
+            res: Dict[str, object] = {'name': dist['name'], 'current': dist['version'], 'latest': None, 'kind': '', 'error': ''}
+            try:
+                current = Version(str(dist['version']))
+                project = self.index_client.get_project(index_url, str(dist['name']))
+                status = self.classify_versions(project, python_exe)
+                for v in project['versions']:  # type: ignore[union-attr]
+                    ver = Version(v)
+                    if ver.is_prerelease and not current.is_prerelease:
+                        continue
+                    if status and status.get(v, 'none') == 'none':
+                        continue
+                    if ver > current:
+                        res['latest'], res['kind'] = v, status.get(v, 'wheel')
+                    break
+            except LookupError:
+                pass  # 私有/本地包在索引中不存在
+            except Exception as e:
+                res['error'] = str(e) or e.__class__.__name__
+            return res
+
+        results: List[Dict[str, object]] = []
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(_check, d) for d in installed.values()]
+            for fut in as_completed(futures):
+                res = fut.result()
+                results.append(res)
+                if result_cb:
+                    try:
+                        result_cb(res)
+                    except Exception:
+                        pass
+                if progress_cb:
+                    progress_cb(len(results) / total)
+        results.sort(key=lambda r: str(r['name']).lower())
+        return results
+
     def plan_migration_from_snapshot(self, snapshot_path: str, python_exe: str | None = None) -> str:
         """根据快照文件生成迁移计划：列出需安装/变更的包。
         快照文件通常为 pip freeze 输出（name==version 或其他规格）。"""
@@ -667,19 +2445,16 @@ class ComfyVenvTools:
             return "[迁移] 快照文件无效"
         py = python_exe or self._last_python_exe or 'python'
         args = [py, '-m', 'pip', 'install', '-r', snapshot_path]
-        if mirror_name:
-            url = PYPI_MIRRORS.get(mirror_name)
-            if url:
-                args.extend(['-i', url])
+        args += mirror_pip_args(mirror_name)
         try:
-            proc = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors='replace', timeout=600, creationflags=CREATE_NO_WINDOW)
-            out = (proc.stdout or proc.stderr or '').strip()
-            if proc.returncode == 0:
+            code, out = _run_captured(args, 600)
+            out = out.strip()
+            if code is None:
+                return "[迁移] 安装超时"
+            if code == 0:
                 return "[迁移] 已根据快照安装/同步依赖。\n\n" + out[:2500]
             else:
-                return f"[迁移] 安装返回码{proc.returncode}\n\n{out[:2500]}"
-        except subprocess.TimeoutExpired:
-            return "[迁移] 安装超时"
+                return f"[迁移] 安装返回码{code}\n\n{out[:2500]}"
         except Exception as e:
             return f"[迁移] 安装失败: {e}"
 
@@ -737,6 +2512,729 @@ class ComfyVenvTools:
             lines.append(f"  - {name}: A={va}  B={vb}")
         return '\n'.join(lines)
 
+    # ---------------------- 环境目录迁移（依赖图规划） ----------------------
+    def plan_environment_migration(self, source_exe: str, target_exe: str) -> Dict[str, object]:
+        """根据两个环境的 dist-info 清单生成迁移计划（不做任何安装）。
+        - 以规范化包名（PEP 503）求集合差，版本一致的包视为已满足
+        - 依据源环境 Requires-Dist 构建待安装包之间的依赖图，按拓扑顺序分批
+        - 以源环境 RECORD 中的文件体积估算下载量（上限）
+        返回计划字典，供 format_migration_plan / execute_migration_plan 使用。"""
+        source = self._read_installed_distributions(source_exe)
+        target = self._read_installed_distributions(target_exe)
+        target_info = self._get_env_info(target_exe)
+        source_info = self._get_env_info(source_exe)
+        markers = dict(target_info.get('markers') or {})
+
+        missing_keys = set(source) - set(target)
+        common_keys = set(source) & set(target)
+        changed_keys = {k for k in common_keys if source[k]['version'] != target[k]['version']}
+        satisfied = sorted(source[k]['name'] for k in common_keys - changed_keys)
+        planned = missing_keys | changed_keys
+
+        # 依赖边：dep -> 依赖它的包，仅保留计划集合内部的边
+        deps: Dict[str, List[str]] = {k: [] for k in planned}
+        for key in planned:
+            for raw in source[key]['requires']:
+                req = self._parse_requirement(raw)
+                if req is None:
+                    continue
+                if req.marker is not None:
+                    try:
+                        if not req.marker.evaluate(dict(markers, extra='')):
+                            continue
+                    except Exception:
+                        pass
+                dep = canonicalize_name(req.name)
+                if dep in planned and dep != key and dep not in deps[key]:
+                    deps[key].append(dep)
+
+        batches, cycles = self._topological_batches(deps)
+
+        def _item(key: str) -> Dict[str, object]:
+            d = source[key]
+            item: Dict[str, object] = {
+                'key': key,
+                'name': d['name'],
+                'version': d['version'],
+                'size': self._dist_installed_size(str(d['path'])),
+            }
+            if key in target:
+                item['current'] = target[key]['version']
+            return item
+
+        items = {k: _item(k) for k in planned}
+        return {
+            'source': source_exe,
+            'target': target_exe,
+            'same_python': (source_info.get('version') == target_info.get('version')),
+            'install': [items[k] for k in sorted(missing_keys)],
+            'change': [items[k] for k in sorted(changed_keys)],
+            'satisfied': satisfied,
+            'items': items,
+            'deps': deps,
+            'batches': batches,
+            'cycles': cycles,
+            'total_size': sum(int(items[k]['size']) for k in missing_keys),
+            'change_size': sum(int(items[k]['size']) for k in changed_keys),
+        }
+
+    def format_migration_plan(self, plan: Dict[str, object]) -> str:
+        """将迁移计划格式化为可读文本（预演，不安装）。"""
+        install = plan.get('install') or []
+        change = plan.get('change') or []
+        satisfied = plan.get('satisfied') or []
+        batches = plan.get('batches') or []
+        mb = 1024 * 1024
+        lines: List[str] = []
+        lines.append("[迁移计划] ===== 预演（不会修改任何环境） =====")
+        lines.append(f"[迁移计划] 源环境: {plan.get('source')}")
+        lines.append(f"[迁移计划] 目标环境: {plan.get('target')}")
+        if not plan.get('same_python'):
+            lines.append("[迁移计划] ⚠️ 两个环境的 Python 版本不同，部分二进制包可能需要其他版本")
+        lines.append(f"已满足(版本一致): {len(satisfied)} 项")
+        lines.append(f"需安装(目标缺失): {len(install)} 项，预计下载 ≤ {int(plan.get('total_size') or 0) / mb:.1f} MB")
+        for it in install[:200]:
+            lines.append(f"  - {it['name']}=={it['version']}  ({int(it['size']) / mb:.1f} MB)")
+        lines.append(f"版本不同: {len(change)} 项，预计下载 ≤ {int(plan.get('change_size') or 0) / mb:.1f} MB")
+        for it in change[:200]:
+            lines.append(f"  - {it['name']}: 目标={it.get('current')}  源={it['version']}")
+        lines.append(f"安装批次: {len(batches)} 批（按依赖拓扑顺序，同批可并行下载）")
+        items = plan.get('items') or {}
+        for idx, batch in enumerate(batches[:50]):
+            names = [items[k]['name'] for k in batch if k in items]
+            preview = ', '.join(names[:8]) + (f" 等{len(names)}个" if len(names) > 8 else '')
+            lines.append(f"  第{idx + 1}批: {preview}")
+        cycles = plan.get('cycles') or []
+        if cycles:
+            lines.append(f"循环依赖: {len(cycles)} 项，已并入最后一批一起安装")
+        return "\n".join(lines)
+
+    def execute_migration_plan(self, plan: Dict[str, object], mirror_name: str | None = None,
+                               include_changes: bool = False, max_workers: int = 4,
+                               progress_cb: Callable[[float], None] | None = None) -> Dict[str, object]:
+        """按批次执行迁移计划：同批内并行下载 wheel，再一次性 --no-deps 安装；
+        某个包失败后，依赖它的后续包直接跳过，避免连锁失败。
+        返回 {ok: List[str], failed: List[(spec, reason)], skipped: List[(spec, reason)]}"""
+        target_exe = str(plan.get('target') or '')
+        items: Dict[str, Dict[str, object]] = plan.get('items') or {}  # type: ignore[assignment]
+        deps: Dict[str, List[str]] = plan.get('deps') or {}  # type: ignore[assignment]
+        wanted = {it['key'] for it in (plan.get('install') or [])}
+        if include_changes:
+            wanted |= {it['key'] for it in (plan.get('change') or [])}
+        ok: List[str] = []
+        failed: List[Tuple[str, str]] = []
+        skipped: List[Tuple[str, str]] = []
+        bad: set = set()
+        total = max(1, len(wanted))
+        done = 0
+        mirror = mirror_name or self._last_mirror_name or ''
+        workdir = tempfile.mkdtemp(prefix='comfy_migrate_')
+        try:
+            for idx, batch in enumerate(plan.get('batches') or []):
+                job_checkpoint()
+                keys = [k for k in batch if k in wanted]
+                runnable: List[str] = []
+                for k in keys:
+                    blockers = [d for d in deps.get(k, []) if d in bad]
+                    if blockers:
+                        bad.add(k)
+                        spec = f"{items[k]['name']}=={items[k]['version']}"
+                        reason = f"依赖安装失败: {', '.join(items[b]['name'] for b in blockers)}"
+                        skipped.append((spec, reason))
+                        self.log(f"[环境迁移] ⏭️ 跳过 {spec} | {reason}")
+                        done += 1
+                    else:
+                        runnable.append(k)
+                if not runnable:
+                    continue
+                self.log(f"[环境迁移] 📦 第{idx + 1}批：{len(runnable)} 个包，并行下载中...")
+                batch_dir = os.path.join(workdir, f'batch_{idx}')
+                os.makedirs(batch_dir, exist_ok=True)
+
+                def _download(key: str) -> Tuple[str, bool, str]:
+                    spec = f"{items[key]['name']}=={items[key]['version']}"
+                    cmd = [target_exe, '-m', 'pip', 'download', spec, '--no-deps', '-d', batch_dir]
+                    success, reason, _ = self.run_pip_with_failover(cmd, mirror, timeout=600, tag='[环境迁移]')
+                    return key, success, reason
+
+                downloaded: List[str] = []
+                with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(runnable))), initializer=_job_thread_initializer()) as pool:
+                    for key, success, reason in pool.map(_download, runnable):
+                        if success:
+                            downloaded.append(key)
+                        else:
+                            bad.add(key)
+                            spec = f"{items[key]['name']}=={items[key]['version']}"
+                            failed.append((spec, reason))
+                            self.log(f"[环境迁移] ❌ 下载失败: {spec} | {reason}")
+                            done += 1
+                            if progress_cb:
+                                progress_cb(min(1.0, done / total))
+                if not downloaded:
+                    continue
+
+                specs = [f"{items[k]['name']}=={items[k]['version']}" for k in downloaded]
+                base = [target_exe, '-m', 'pip', 'install', '--no-deps', '--no-index', '--find-links', batch_dir]
+                r = self._run_pip_quiet(base + specs)
+                if r[0]:
+                    for k, spec in zip(downloaded, specs):
+                        ok.append(spec)
+                        self.log(f"[环境迁移] ✅ 安装成功: {spec}")
+                else:
+                    # 整批失败时逐个重试，定位具体失败的包
+                    for k, spec in zip(downloaded, specs):
+                        success, reason = self._run_pip_quiet(base + [spec])
+                        if success:
+                            ok.append(spec)
+                            self.log(f"[环境迁移] ✅ 安装成功: {spec}")
+                        else:
+                            bad.add(k)
+                            failed.append((spec, reason))
+                            self.log(f"[环境迁移] ❌ 安装失败: {spec} | {reason}")
+                done += len(downloaded)
+                if progress_cb:
+                    progress_cb(min(1.0, done / total))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+            # 目标环境已变化，清除已安装包缓存
+            self._installed_packages_cache = None
+        return {'ok': ok, 'failed': failed, 'skipped': skipped}
+
+    def clone_packages(self, plan: Dict[str, object], include_changes: bool = False, allow_hardlink: bool = True,
+                       max_workers: int = 8, progress_cb: Callable[[float], None] | None = None) -> Dict[str, object]:
+        """克隆模式：直接把源环境中包的 RECORD 文件集复制到目标环境，不重新下载安装。
+        - 仅适用于 Python 主次版本与平台一致的两个环境
+        - 优先使用 reflink（写时复制），其次硬链接，最后回退为流式复制
+        - console/gui 入口脚本按目标解释器重新生成，其他脚本改写 shebang
+        - 每个包先完整复制到目标 site-packages 下的临时暂存目录，成功后才卸载目标中的旧版本并移入原位；
+          复制失败时删除暂存目录，目标环境保持原样。RECORD 中已不存在的文件（如被清理的 .pyc）直接跳过
+        返回与 execute_migration_plan 相同结构的结果字典。"""
+        source_exe = str(plan.get('source') or '')
+        target_exe = str(plan.get('target') or '')
+        items: Dict[str, Dict[str, object]] = plan.get('items') or {}  # type: ignore[assignment]
+        ok: List[str] = []
+        failed: List[Tuple[str, str]] = []
+        src_info = self._get_env_info(source_exe)
+        dst_info = self._get_env_info(target_exe)
+        if not self._envs_clone_compatible(src_info, dst_info):
+            reason = '两个环境的 Python 版本或平台不一致，无法克隆'
+            keys = [it['key'] for it in (plan.get('install') or [])]
+            return {'ok': [], 'failed': [(f"{items[k]['name']}=={items[k]['version']}", reason) for k in keys], 'skipped': []}
+
+        wanted = [it['key'] for it in (plan.get('install') or [])]
+        changes: set = set()
+        if include_changes:
+            change_keys = [it['key'] for it in (plan.get('change') or [])]
+            changes = set(change_keys)
+            wanted += [k for k in change_keys if k not in wanted]
+
+        source = self._read_installed_distributions(source_exe)
+        src_site = [str(d) for d in (src_info.get('site_dirs') or [])]
+        dst_site = [str(d) for d in (dst_info.get('site_dirs') or [])]
+        src_scripts = os.path.normcase(os.path.normpath(str(src_info.get('scripts') or '')))
+        dst_scripts = str(dst_info.get('scripts') or '')
+        dst_python = str(dst_info.get('executable') or target_exe)
+        stats = {'reflink': 0, 'hardlink': 0, 'copy': 0, 'bytes': 0}
+        total = max(1, len(wanted))
+        entry_specs: List[Tuple[str, bool]] = []
+
+        for idx, key in enumerate(wanted):
+            job_checkpoint()
+            dist = source.get(key)
+            spec = f"{items[key]['name']}=={items[key]['version']}"
+            if dist is None:
+                failed.append((spec, '源环境中未找到该包的元数据'))
+                continue
+            dist_path = str(dist['path'])
+            base_src = os.path.dirname(dist_path)
+            # 目标 site-packages 与源保持同一角色（purelib / platlib）
+            base_dst = dst_site[src_site.index(base_src)] if base_src in src_site and len(dst_site) > src_site.index(base_src) else (dst_site[0] if dst_site else '')
+            if not base_dst:
+                failed.append((spec, '目标环境 site-packages 不可用'))
+                continue
+            stage = ''
+            moved: List[str] = []
+            try:
+                lines = self._entry_point_lines(dist_path)
+                script_names = {spec_line.split('=', 1)[0].strip() for spec_line, _ in lines}
+                pairs: List[Tuple[str, str]] = []
+                rewrites: List[Tuple[str, str]] = []
+                stale = 0
+                for rel in self._record_paths(dist_path):
+                    src = os.path.normpath(os.path.join(base_src, rel))
+                    dst = os.path.normpath(os.path.join(base_dst, rel))
+                    if not os.path.isfile(src):
+                        stale += 1  # RECORD 登记但已被删除的文件（如清理掉的 __pycache__）
+                        continue
+                    if os.path.normcase(os.path.dirname(src)) == src_scripts:
+                        stem = os.path.basename(src)
+                        for suffix in ('.exe', '-script.pyw', '-script.py'):
+                            if stem.lower().endswith(suffix):
+                                stem = stem[:-len(suffix)]
+                                break
+                        if stem in script_names:
+                            continue  # 入口脚本稍后按目标解释器重新生成
+                        dst = os.path.join(dst_scripts, os.path.basename(src))
+                        rewrites.append((src, dst))
+                        continue
+                    pairs.append((src, dst))
+                # 先复制到同一文件系统的暂存目录，全部成功后再动目标环境
+                stage = tempfile.mkdtemp(prefix='.comfy_clone_', dir=base_dst)
+                staged = [(src, os.path.join(stage, os.path.relpath(dst, base_dst)), dst) for src, dst in pairs]
+                with ThreadPoolExecutor(max_workers=max_workers, initializer=_job_thread_initializer()) as pool:
+                    for mode, size in pool.map(lambda p: _clone_file(p[0], p[1], allow_hardlink), staged):
+                        stats[mode] = stats.get(mode, 0) + 1
+                        stats['bytes'] += size
+                if key in changes:
+                    # 新版本已就绪，再卸载目标环境中的旧版本，避免新旧文件混杂
+                    success, reason = self._run_pip_quiet([target_exe, '-m', 'pip', 'uninstall', '-y', str(items[key]['name'])], timeout=600)
+                    if not success:
+                        raise RuntimeError(f"卸载旧版本失败: {reason}")
+                for _, tmp, dst in staged:
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    os.replace(tmp, dst)
+                    moved.append(dst)
+                for src, dst in rewrites:
+                    self._copy_script_for_interpreter(src, dst, dst_python)
+                    moved.append(dst)
+                entry_specs.extend(lines)
+                ok.append(spec)
+                self.log(f"[克隆迁移] ✅ {spec}（{len(pairs)} 个文件" + (f"，跳过 RECORD 中已不存在的 {stale} 个" if stale else "") + "）")
+            except Exception as e:
+                for path in moved:  # 移入一半时撤回已放入目标环境的文件
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                failed.append((spec, str(e)))
+                self.log(f"[克隆迁移] ❌ {spec} | {e}")
+            finally:
+                if stage:
+                    shutil.rmtree(stage, ignore_errors=True)
+            if progress_cb:
+                progress_cb(min(0.95, (idx + 1) / total))
+
+        if entry_specs and dst_scripts:
+            made = self._make_entry_point_scripts(target_exe, dst_scripts, entry_specs)
+            self.log(f"[克隆迁移] 已为目标解释器生成 {made} 个入口脚本")
+        self.log(f"[克隆迁移] 文件: reflink {stats['reflink']} / 硬链接 {stats['hardlink']} / 复制 {stats['copy']}，共 {stats['bytes'] / (1024**2):.1f} MB")
+        self._installed_packages_cache = None
+        if progress_cb:
+            progress_cb(1.0)
+        return {'ok': ok, 'failed': failed, 'skipped': [], 'stats': stats}
+
+    def _envs_clone_compatible(self, src_info: Dict[str, object], dst_info: Dict[str, object]) -> bool:
+        """克隆要求两个环境的 Python 主次版本、实现与平台完全一致。"""
+        if not src_info.get('version') or src_info.get('version') != dst_info.get('version'):
+            return False
+        sm = src_info.get('markers') or {}
+        dm = dst_info.get('markers') or {}
+        for k in ('implementation_name', 'sys_platform', 'platform_machine'):
+            if sm.get(k) != dm.get(k):  # type: ignore[union-attr]
+                return False
+        return True
+
+    def _record_paths(self, dist_path: str) -> List[str]:
+        """读取 RECORD 中登记的相对路径（相对于 site-packages）。"""
+        import csv
+        paths: List[str] = []
+        with open(os.path.join(dist_path, 'RECORD'), 'r', encoding='utf-8', errors='replace', newline='') as f:
+            for row in csv.reader(f):
+                if row and row[0]:
+                    paths.append(row[0])
+        return paths
+
+    def _entry_point_lines(self, dist_path: str) -> List[Tuple[str, bool]]:
+        """返回 entry_points.txt 中的脚本规格 ('name = module:func', 是否GUI)。"""
+        import configparser
+        out: List[Tuple[str, bool]] = []
+        path = os.path.join(dist_path, 'entry_points.txt')
+        if not os.path.isfile(path):
+            return out
+        cp = configparser.ConfigParser(delimiters=('=',))
+        cp.optionxform = str  # type: ignore[assignment]
+        try:
+            cp.read(path, encoding='utf-8')
+        except configparser.Error:
+            return out
+        for section, gui in (('console_scripts', False), ('gui_scripts', True)):
+            if cp.has_section(section):
+                for name, value in cp.items(section):
+                    out.append((f"{name} = {value.strip()}", gui))
+        return out
+
+    def _copy_script_for_interpreter(self, src: str, dst: str, python_path: str) -> None:
+        """复制普通脚本；若首行是指向 Python 的 shebang，则改写为目标解释器。"""
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        with open(src, 'rb') as f:
+            data = f.read()
+        if data.startswith(b'#!') and b'python' in data.split(b'\n', 1)[0].lower():
+            rest = data.split(b'\n', 1)[1] if b'\n' in data else b''
+            data = b'#!' + python_path.encode('utf-8') + b'\n' + rest
+            with open(dst, 'wb') as f:
+                f.write(data)
+            shutil.copymode(src, dst)
+        else:
+            shutil.copy2(src, dst)
+
+    def _make_entry_point_scripts(self, target_exe: str, scripts_dir: str, specs: List[Tuple[str, bool]]) -> int:
+        """在目标解释器中用 pip 自带的 distlib 生成入口脚本（Windows 下生成 .exe 启动器）。"""
+        payload = json.dumps({'scripts_dir': scripts_dir, 'specs': specs})
+        try:
+            proc = subprocess.run([target_exe, '-c', _SCRIPT_MAKER_SCRIPT], input=payload, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors='replace', timeout=120, creationflags=CREATE_NO_WINDOW)
+            if proc.returncode == 0 and proc.stdout.strip():
+                return len(json.loads(proc.stdout.strip().splitlines()[-1]))
+            self.log(f"[克隆迁移] 生成入口脚本失败: {(proc.stderr or '').strip()[-300:]}")
+        except Exception as e:
+            self.log(f"[克隆迁移] 生成入口脚本异常: {e}")
+        return 0
+
+    # ---------------------- 安装预览与进度 ----------------------
+    def preview_install(self, python_exe: str, pip_args: List[str], mirror_name: str | None = None) -> Dict[str, object]:
+        """基于 pip --dry-run --report 生成安装预览（不解析日志文本）。
+        返回 {ok, supported, output, report, items:[{name, version, url, size}], total_size, unknown_size}；
+        size 取自下载地址的 Content-Length（本地文件取文件大小），取不到时为 0。"""
+        py = python_exe or self._last_python_exe or 'python'
+        report, output = self._pip_dry_run_report(py, pip_args, mirror_name)
+        preview: Dict[str, object] = {'ok': report is not None, 'supported': 'no such option' not in output,
+                                      'output': output, 'report': report, 'items': [], 'total_size': 0, 'unknown_size': 0}
+        if report is None:
+            return preview
+        items: List[Dict[str, object]] = []
+        for entry in report.get('install') or []:
+            meta = entry.get('metadata') or {}
+            url = str((entry.get('download_info') or {}).get('url') or '')
+            items.append({'name': meta.get('name') or '', 'version': meta.get('version') or '', 'url': url, 'size': 0})
+        sizes = self._remote_sizes([str(it['url']) for it in items])
+        for it in items:
+            it['size'] = sizes.get(str(it['url']), 0)
+        preview['items'] = items
+        preview['total_size'] = sum(int(it['size']) for it in items)
+        preview['unknown_size'] = sum(1 for it in items if not it['size'])
+        return preview
+
+    def format_install_preview(self, preview: Dict[str, object], limit: int = 30) -> str:
+        """把安装预览格式化为“将安装 N 个包，约 X MB”及明细。"""
+        items: List[Dict[str, object]] = preview.get('items') or []  # type: ignore[assignment]
+        total = int(preview.get('total_size') or 0)
+        head = f"将安装 {len(items)} 个包，约 {total / (1024**2):.1f} MB"
+        if preview.get('unknown_size'):
+            head += f"（{preview['unknown_size']} 个包大小未知）"
+        lines = [head]
+        for it in sorted(items, key=lambda x: -int(x['size'] or 0))[:limit]:
+            size = f"{int(it['size']) / (1024**2):.1f} MB" if it['size'] else '大小未知'
+            lines.append(f"  - {it['name']}=={it['version']}  {size}")
+        if len(items) > limit:
+            lines.append(f"  ... 另有 {len(items) - limit} 个包")
+        return '\n'.join(lines)
+
+    def _remote_sizes(self, urls: List[str], timeout: float = 5.0) -> Dict[str, int]:
+        """并发获取下载文件大小：HTTP 取 HEAD 的 Content-Length，file:// 取本地文件大小。"""
+        import urllib.request, urllib.parse
+
+        def _size(url: str) -> int:
+            try:
+                if url.startswith('file:'):
+                    return os.path.getsize(urllib.request.url2pathname(urllib.parse.urlparse(url).path))
+                resp = self.http.head(url, timeout=timeout, retries=1)
+                return int(resp.headers.get('content-length') or 0) if resp.status < 400 else 0
+            except Exception:
+                return 0
+
+        uniq = [u for u in dict.fromkeys(urls) if u]
+        if not uniq:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(8, len(uniq))) as pool:
+            return dict(zip(uniq, pool.map(_size, uniq)))
+
+    def _pip_version(self, python_exe: str) -> Tuple[int, ...]:
+        """目标解释器中 pip 的版本号（缓存）。"""
+        if python_exe in self._pip_version_cache:
+            return self._pip_version_cache[python_exe]
+        ver: Tuple[int, ...] = (0,)
+        try:
+            r = subprocess.run([python_exe, '-m', 'pip', '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace', timeout=30, creationflags=CREATE_NO_WINDOW)
+            m = re.search(r'pip (\d+)\.(\d+)', r.stdout or '')
+            if m:
+                ver = (int(m.group(1)), int(m.group(2)))
+        except Exception:
+            pass
+        self._pip_version_cache[python_exe] = ver
+        return ver
+
+    def _run_pip_streaming(self, cmd: List[str], tag: str, preview: Dict[str, object] | None = None,
+                           progress_cb: Callable[[float], None] | None = None, lo: float = 0.3, hi: float = 0.9,
+                           mirror_name: str | None = None) -> Tuple[int, List[str]]:
+        """运行 pip 安装（见 _run_pip_streaming_once）。
+        传入 mirror_name 时 cmd 不应包含索引参数：按镜像健康度依次尝试，网络错误或镜像缺包时切换到下一个镜像。"""
+        if mirror_name is None:
+            return self._run_pip_streaming_once(cmd, tag, preview, progress_cb, lo, hi)
+        order = self.mirror_health.failover_order(mirror_name, list(PYPI_MIRRORS), limit=3)
+        all_lines: List[str] = []
+        returncode = 1
+        for i, m in enumerate(order):
+            started = time.monotonic()
+            returncode, lines = self._run_pip_streaming_once(cmd + self._mirror_pip_args(m), tag, preview, progress_cb, lo, hi)
+            all_lines += lines
+            out = '\n'.join(lines)
+            network = returncode != 0 and self._is_network_error(out)
+            self.mirror_health.record(m, time.monotonic() - started if returncode == 0 else None, returncode == 0 or not network,
+                                      self._summarize_pip_error(out) if network else '')
+            missing = 'No matching distribution found' in out
+            if returncode == 0 or not (network or missing) or i == len(order) - 1:
+                break
+            try:
+                self.log(f"{tag} 镜像 {m or '官方源'} 失败，切换到 {order[i + 1] or '官方源'} 重试")
+            except Exception:
+                pass
+        return returncode, all_lines
+
+    def _run_pip_streaming_once(self, cmd: List[str], tag: str, preview: Dict[str, object] | None = None,
+                                progress_cb: Callable[[float], None] | None = None, lo: float = 0.3, hi: float = 0.9) -> Tuple[int, List[str]]:
+        """运行 pip 安装并按下载字节推进进度。
+        pip ≥ 24.1 时追加 --progress-bar raw，读取 “Progress X of Y” 行得到当前文件的字节进度；
+        已完成/命中缓存的文件按预览中的大小计入，较旧 pip 退化为按文件粒度推进。"""
+        sizes: Dict[str, int] = {}
+        for it in (preview or {}).get('items') or []:  # type: ignore[union-attr]
+            fname = os.path.basename(str(it.get('url') or '').split('#', 1)[0])
+            if fname:
+                sizes[fname] = int(it.get('size') or 0)
+        total_bytes = sum(sizes.values())
+        total_files = max(1, len(sizes))
+        cmd = list(cmd)
+        raw = self._pip_version(cmd[0]) >= (24, 1)
+        if raw:
+            cmd += ['--progress-bar', 'raw']
+        done_bytes = 0
+        done_files = 0
+        current_total = 0
+        current_bytes = 0
+        pending = ''  # 旧版 pip：正在下载、尚未计入的文件
+        credited: set = set()
+        last_report = 0.0
+
+        def _report(force: bool = False) -> None:
+            nonlocal last_report
+            if not progress_cb:
+                return
+            now = time.time()
+            if not force and now - last_report < 0.2:
+                return
+            last_report = now
+            if total_bytes > 0:
+                frac = (done_bytes + current_bytes) / total_bytes
+            else:
+                frac = done_files / total_files
+            progress_cb(lo + (hi - lo) * min(1.0, frac))
+
+        def _credit(fname: str, with_bytes: bool = True) -> None:
+            nonlocal done_bytes, done_files
+            if not fname or fname in credited:
+                return
+            credited.add(fname)
+            done_files += 1
+            if with_bytes:
+                done_bytes += sizes.get(fname, 0)
+
+        output_lines: List[str] = []
+        proc = spawn_process(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
+        for line in proc.stdout:  # type: ignore[union-attr]
+            msg = line.strip()
+            if not msg:
+                continue
+            m = re.match(r'^Progress (\d+) of (\d+)$', msg)
+            if m:
+                current_bytes, current_total = int(m.group(1)), int(m.group(2))
+                if current_total and current_bytes >= current_total:
+                    done_bytes += current_total
+                    current_bytes = current_total = 0
+                _report()
+                continue
+            output_lines.append(msg)
+            try:
+                self.log(f"{tag} {msg}")
+            except Exception:
+                pass
+            if msg.startswith('Downloading '):
+                fname = os.path.basename(msg.split()[1].split('#', 1)[0])
+                if raw:
+                    _credit(fname, with_bytes=False)  # 字节由 Progress 行累计
+                else:
+                    _credit(pending)
+                    pending = fname
+                _report(force=True)
+            elif msg.startswith('Using cached '):
+                _credit(pending)
+                pending = ''
+                _credit(os.path.basename(msg.split()[2].split('#', 1)[0]))
+                _report(force=True)
+            elif msg.startswith('Installing collected packages'):
+                done_bytes, done_files, current_bytes = total_bytes, total_files, 0
+                _report(force=True)
+        proc.wait()
+        if progress_cb:
+            progress_cb(hi)
+        return proc.returncode, output_lines
+
+    # ---------------------- 安装事务（回滚） ----------------------
+    def begin_install_transaction(self, python_exe: str, pip_args: List[str], mirror_name: str | None = None,
+                                  label: str = '', fallback_names: List[str] | None = None,
+                                  preview: Dict[str, object] | None = None) -> Optional[InstallTransaction]:
+        """在安装前创建事务：通过 pip --dry-run --report 得到本次将触及的包，
+        记录其当前版本并硬链接暂存其 RECORD 文件。
+        pip_args 为空或 pip 过旧（不支持 --report）时改为按 fallback_names 暂存；
+        预演本身解析失败（安装注定失败）则不创建事务。传入 preview 时复用其预演结果。"""
+        py = python_exe or self._last_python_exe or 'python'
+        touched: Dict[str, str] = {}
+        names = list(fallback_names or [])
+        if pip_args:
+            if preview is not None:
+                report, output = preview.get('report'), str(preview.get('output') or '')  # type: ignore[assignment]
+            else:
+                report, output = self._pip_dry_run_report(py, pip_args, mirror_name)
+            if report is not None:
+                for item in report.get('install') or []:
+                    meta = item.get('metadata') or {}
+                    if meta.get('name'):
+                        touched[canonicalize_name(meta['name'])] = str(meta.get('version') or '')
+                names = []
+            elif 'no such option' in output:
+                self.log("[安装事务] 当前 pip 不支持 --report，改为按包名暂存")
+            else:
+                names = []
+                self.log(f"[安装事务] 预演未通过，不创建事务: {self._summarize_pip_error(output)}")
+        for n in names:
+            req = self._parse_requirement(str(n))
+            if req is None:
+                continue  # 跳过 git+、-r 等非包名条目
+            touched.setdefault(canonicalize_name(req.name), '')
+        if not touched:
+            return None
+
+        root = os.path.join(os.getcwd(), 'install_txn')
+        txn: Optional[InstallTransaction] = None
+        try:
+            self._dist_cache.pop(py, None)
+            installed = self._read_installed_distributions(py)
+            os.makedirs(root, exist_ok=True)
+            # 目录名以时间开头保证按名排序即按时间排序；mkdtemp 的随机后缀避免同一秒内并发安装撞名
+            path = tempfile.mkdtemp(prefix=time.strftime('%Y%m%d_%H%M%S') + f'_{os.getpid()}_', dir=root)
+            txn = InstallTransaction(path, py, label)
+            os.makedirs(txn.files_dir, exist_ok=True)
+            counter = 0
+            for key in sorted(touched):
+                dist = installed.get(key)
+                if dist is None:
+                    txn.added.append(key)
+                    continue
+                dist_path = str(dist['path'])
+                base = os.path.dirname(dist_path)
+                files: List[List[str]] = []
+                try:
+                    rels = self._record_paths(dist_path)
+                except OSError:
+                    rels = []  # egg-info 等没有 RECORD 的包无法暂存，回滚时仅按版本重装
+                for rel in rels:
+                    src = os.path.normpath(os.path.join(base, rel))
+                    if not os.path.isfile(src):
+                        continue
+                    stash = f"{counter:07d}"
+                    counter += 1
+                    try:
+                        _clone_file(src, os.path.join(txn.files_dir, stash))
+                        files.append([src, stash])
+                    except OSError:
+                        continue
+                txn.previous[key] = {'name': dist['name'], 'version': dist['version'], 'files': files}
+            txn.save()
+            self._prune_install_transactions(root, keep=3)
+            self.log(f"[安装事务] 已记录 {len(txn.previous)} 个将被改动的包（{counter} 个文件），新增 {len(txn.added)} 个")
+        except Exception as e:
+            # 事务只是回滚保障，创建失败（磁盘满、权限不足等）不应阻止安装本身
+            if txn is not None:
+                txn.discard()
+            self.log(f"[安装事务] 创建事务失败，本次安装将不可回滚: {e}")
+            return None
+        return txn
+
+    def list_install_transactions(self) -> List[InstallTransaction]:
+        """列出可回滚的安装事务（最新在前）。"""
+        root = os.path.join(os.getcwd(), 'install_txn')
+        out: List[InstallTransaction] = []
+        try:
+            for name in sorted(os.listdir(root), reverse=True):
+                path = os.path.join(root, name)
+                if os.path.isfile(os.path.join(path, 'txn.json')):
+                    try:
+                        out.append(InstallTransaction.load(path))
+                    except Exception:
+                        continue
+        except OSError:
+            pass
+        return out
+
+    def rollback_install_transaction(self, txn: InstallTransaction) -> str:
+        """回滚安装事务：卸载新增/变更的包，并把暂存的旧版本文件放回原处。"""
+        py = txn.python_exe
+        self._dist_cache.pop(py, None)
+        current = self._read_installed_distributions(py)
+        remove: List[str] = [str(current[k]['name']) for k in txn.added if k in current]
+        restore: List[str] = []
+        for key, info in txn.previous.items():
+            cur = current.get(key)
+            if cur is not None and cur['version'] == info.get('version'):
+                continue  # 版本未变，无需回滚
+            if cur is not None:
+                remove.append(str(cur['name']))
+            restore.append(key)
+        if remove:
+            self.log(f"[安装回滚] 卸载: {', '.join(remove[:10])}{' 等' if len(remove) > 10 else ''}")
+            ok, reason = self._run_pip_quiet([py, '-m', 'pip', 'uninstall', '-y'] + remove, timeout=600)
+            if not ok:
+                self.log(f"[安装回滚] 卸载出现问题: {reason}")
+        restored_files = 0
+        failed: List[str] = []
+        for key in restore:
+            info = txn.previous[key]
+            try:
+                for orig, stash in info.get('files') or []:  # type: ignore[union-attr]
+                    _clone_file(os.path.join(txn.files_dir, stash), orig)
+                    restored_files += 1
+                if not info.get('files'):
+                    ok, reason = self._run_pip_quiet([py, '-m', 'pip', 'install', '--no-deps', f"{info['name']}=={info['version']}"] + self._mirror_pip_args(self._last_mirror_name, True))
+                    if not ok:
+                        raise RuntimeError(reason)
+            except Exception as e:
+                failed.append(f"{info.get('name')}=={info.get('version')}: {e}")
+        self._installed_packages_cache = None
+        self._dist_cache.pop(py, None)
+        lines = [f"[安装回滚] 已卸载 {len(remove)} 个包，恢复 {len(restore) - len(failed)} 个包的旧版本（{restored_files} 个文件）"]
+        if failed:
+            lines.append("[安装回滚] ❌ 以下包未能恢复:")
+            lines += [f"  - {f}" for f in failed]
+        else:
+            txn.discard()
+        return '\n'.join(lines)
+
+    def _rollback_failed_install(self, txn: Optional[InstallTransaction], tag: str) -> str:
+        """安装失败时自动回滚，返回追加到输出末尾的说明。"""
+        if txn is None:
+            return ''
+        try:
+            self.log(f"{tag} 安装失败，正在回滚到安装前状态...")
+            return '\n' + self.rollback_install_transaction(txn)
+        except Exception as e:
+            return f"\n[安装回滚] ❌ 自动回滚失败: {e}"
+
+    def _prune_install_transactions(self, root: str, keep: int = 3) -> None:
+        """只保留最近 keep 个事务，避免旧版本文件长期占用空间。"""
+        try:
+            names = sorted(n for n in os.listdir(root) if os.path.isdir(os.path.join(root, n)))
+            for name in names[:-keep]:
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        except OSError:
+            pass
+
     # ---------------------- 第三方库管理 ----------------------
     def search_library_exact(self, name: str) -> str:
         """检查是否已安装并获取可用版本列表。"""
@@ -744,7 +3242,92 @@ class ComfyVenvTools:
             return "请输入库名"
         py = self._last_python_exe or 'python'
         msgs: List[str] = []
-        # 已安装版本
+        # 已安装版本：直接读取 dist-info（按目录修改时间缓存），失败时回退 pip show
+        try:
+            dist = self._read_installed_distributions(py).get(canonicalize_name(name))
+            msgs.append(f"当前环境已安装：{name}=={dist['version']}" if dist else f"当前环境未安装：{name}")
+        except Exception:
+            msgs.extend(self._pip_show_version(py, name))
+        # 版本列表：优先直接请求简单索引（PEP 691 JSON / PEP 503 HTML，带磁盘缓存）
+        index_url = mirror_url(self._last_mirror_name) or 'https://pypi.org/simple/'
+        try:
+            start = time.time()
+            project = self.index_client.get_project(index_url, name)
+            versions = list(project['versions'])  # type: ignore[arg-type]
+            if versions:
+                elapsed = (time.time() - start) * 1000
+                # 按目标解释器的 wheel 标签过滤：无兼容 wheel 且无源码包的版本隐藏，仅有源码包的标注需编译
+                status = self.classify_versions(project, py)
+                shown = [v + (SDIST_ONLY_MARK if status.get(v) == 'sdist' else '') for v in versions if status.get(v, 'wheel') != 'none']
+                hidden = [v for v in versions if status.get(v) == 'none']
+                msgs.append("可用版本：" + ', '.join(shown))
+                msgs.append(f"共 {len(versions)} 个版本，当前环境可用 {len(shown)} 个（{'缓存' if project.get('from_cache') else '索引'} {elapsed:.0f}ms）")
+                if hidden:
+                    msgs.append(f"已隐藏 {len(hidden)} 个无兼容 wheel 的版本：" + ', '.join(hidden[:20]) + (' 等' if len(hidden) > 20 else ''))
+                return '\n'.join(msgs)
+        except LookupError as e:
+            msgs.append(f"版本信息：{e}")
+            return '\n'.join(msgs)
+        except Exception as e:
+            self.log(f"[库查找] 索引直连失败，改用 pip 查询: {e}")
+        return '\n'.join(msgs + self._pip_index_versions(py, name))
+
+    def get_supported_tags(self, python_exe: str) -> frozenset:
+        """目标解释器支持的 wheel 标签集合（每个解释器只探测一次）。"""
+        if python_exe in self._tags_cache:
+            return self._tags_cache[python_exe]
+        tags: frozenset = frozenset()
+        try:
+            r = subprocess.run([python_exe, '-c', _TAGS_PROBE_SCRIPT], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors='replace', timeout=60, creationflags=CREATE_NO_WINDOW)
+            if r.returncode == 0 and r.stdout.strip():
+                tags = frozenset(json.loads(r.stdout.strip().splitlines()[-1]))
+        except Exception:
+            pass
+        if tags:
+            self._tags_cache[python_exe] = tags
+        return tags
+
+    def classify_versions(self, project: Dict[str, object], python_exe: str) -> Dict[str, str]:
+        """判断每个版本在目标解释器上的可安装性：
+        'wheel' 有兼容 wheel；'sdist' 仅能从源码编译；'none' 两者皆无。
+        同时检查文件的 Requires-Python。无法获取标签时返回空字典（不做过滤）。"""
+        supported = self.get_supported_tags(python_exe)
+        if not supported:
+            return {}
+        py_full = ''
+        try:
+            py_full = str((self._get_env_info(python_exe).get('markers') or {}).get('python_full_version') or '')  # type: ignore[union-attr]
+        except Exception:
+            pass
+        rank = {'none': 0, 'sdist': 1, 'wheel': 2}
+        status: Dict[str, str] = {}
+        for f in project.get('files') or []:  # type: ignore[union-attr]
+            if f.get('yanked'):
+                continue
+            ver, tags = SimpleIndexClient._parse_filename(str(f.get('filename') or ''))
+            if ver is None:
+                continue
+            kind = 'none'
+            if self._requires_python_ok(str(f.get('requires_python') or ''), py_full):
+                if not tags:
+                    kind = 'sdist'
+                elif supported.intersection(tags):
+                    kind = 'wheel'
+            if rank[kind] >= rank[status.get(ver, 'none')]:
+                status[ver] = kind
+        return status
+
+    def _requires_python_ok(self, spec: str, py_full: str) -> bool:
+        if not spec or not py_full:
+            return True
+        try:
+            return SpecifierSet(spec).contains(py_full, prereleases=True)
+        except (InvalidSpecifier, InvalidVersion):
+            return True
+
+    def _pip_show_version(self, py: str, name: str) -> List[str]:
+        """通过 pip show 检测安装状态（dist-info 读取失败时使用）。"""
+        msgs: List[str] = []
         try:
             r = subprocess.run([py, '-m', 'pip', 'show', name], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
             if r.returncode == 0 and r.stdout:
@@ -756,15 +3339,15 @@ class ComfyVenvTools:
                 msgs.append(f"当前环境未安装：{name}")
         except Exception:
             msgs.append(f"无法检测安装状态：{name}")
-        # 版本列表
-        mirror_url = PYPI_MIRRORS.get(self._last_mirror_name or '', '')
+        return msgs
+
+    def _pip_index_versions(self, py: str, name: str) -> List[str]:
+        """通过 pip index versions 获取版本列表（索引直连失败时使用）。"""
+        msgs: List[str] = []
         
         # 首先尝试使用 pip index versions（推荐方法）
         try:
-            cmd = [py, '-m', 'pip', 'index', 'versions', name]
-            if mirror_url:
-                host = mirror_url.split('/')[2]
-                cmd += ['--index-url', mirror_url, '--trusted-host', host]
+            cmd = [py, '-m', 'pip', 'index', 'versions', name] + mirror_pip_args(self._last_mirror_name)
             
             r = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors='replace', timeout=15, creationflags=CREATE_NO_WINDOW)
             if r.returncode == 0 and r.stdout:
@@ -833,7 +3416,7 @@ class ComfyVenvTools:
             except Exception as alt_e:
                 msgs.append(f"获取版本异常：{alt_e}")
         
-        return '\n'.join(msgs)
+        return msgs
 
     def search_library_fuzzy(self, name: str) -> str:
         """在本地环境包列表中进行模糊匹配。"""
@@ -865,55 +3448,27 @@ class ComfyVenvTools:
     def install_source_code(self, src_path: str, python_exe: str, mirror_name: str) -> str:
         return self.install_from_source(src_path, python_exe, mirror_name)
 
-    def install_library(self, name: str, version: str, python_exe: str, mirror_name: str) -> str:
+    def install_library(self, name: str, version: str, python_exe: str, mirror_name: str, progress_cb: Callable[[float], None] | None = None) -> str:
         """安装指定库及版本。"""
         if not name:
             return "请输入库名"
         self._last_python_exe = python_exe or self._last_python_exe
         self._last_mirror_name = mirror_name or self._last_mirror_name
         py = python_exe or 'python'
+        version = (version or '').replace(SDIST_ONLY_MARK, '').strip()
         target = f"{name}=={version}" if version else name
-        mirror_url = PYPI_MIRRORS.get(mirror_name or '', '')
         cmd: List[str] = [py, '-m', 'pip', 'install', target]
-        if mirror_url:
-            host = mirror_url.split('/')[2]
-            cmd += ['-i', mirror_url, '--trusted-host', host]
+        preview = self.preview_install(py, [target], mirror_name)
+        if preview.get('ok') and preview.get('items'):
+            self.log(f"[库安装] {self.format_install_preview(preview, limit=10)}")
+        txn = self.begin_install_transaction(py, [target], mirror_name, label=f"库安装 {target}", fallback_names=[target], preview=preview)
         try:
-            # 使用实时输出捕获，提供更好的安装过程反馈
-            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
-            
-            output_lines = []
-            collected_packages = []
-            downloaded_packages = []
-            installed_packages = []
-            
-            # 实时读取输出
-            while True:
-                try:
-                    line = proc.stdout.readline()
-                except UnicodeDecodeError:
-                    # 如果遇到编码错误，尝试跳过这一行
-                    continue
-                if not line and proc.poll() is not None:
-                    break
-                if line:
-                    msg = line.strip()
-                    output_lines.append(msg)
-                    try:
-                        # 实时输出到日志
-                        self.log(f"[库安装] {msg}")
-                    except Exception:
-                        pass
-                    # 解析安装过程信息
-                    if 'Collecting' in msg:
-                        collected_packages.append(msg)
-                    elif 'Downloading' in msg:
-                        downloaded_packages.append(msg)
-                    elif 'Successfully installed' in msg:
-                        success_part = msg.split('Successfully installed')[1].strip()
-                        installed_packages.extend([pkg.strip() for pkg in success_part.split()])
-            
-            returncode = proc.poll()
+            # 实时输出安装过程，按下载字节推进进度
+            returncode, output_lines = self._run_pip_streaming(cmd, '[库安装]', preview, progress_cb, lo=0.1, hi=0.95, mirror_name=mirror_name or '')
+            installed_packages: List[str] = []
+            for msg in output_lines:
+                if msg.startswith('Successfully installed'):
+                    installed_packages.extend(pkg.strip() for pkg in msg.split('Successfully installed', 1)[1].split())
             full_output = '\n'.join(output_lines)
             
             if returncode == 0:
@@ -931,11 +3486,13 @@ class ComfyVenvTools:
                         downloaded_count = len([line for line in output_lines if 'Downloaded' in line])
                         if cached_count > 0 or downloaded_count > 0:
                             summary += f"\n[库安装] 缓存使用：{cached_count}个，新下载：{downloaded_count}个"
+                    summary += self._conflict_note(py, '[库安装]')
                     
                     return summary + f"\n\n{full_output}"
                 else:
                     return f"[库安装] ✅ 安装完成！{target}\n\n{full_output}"
             else:
+                full_output += self._rollback_failed_install(txn, '[库安装]')
                 # 分析错误类型，提供更具体的建议
                 if "No matching distribution found" in full_output:
                     return f"[库安装] ❌ 失败：找不到匹配的包版本\n建议：检查包名是否正确或尝试其他版本\n\n{full_output}"
@@ -959,12 +3516,11 @@ class ComfyVenvTools:
         self._last_python_exe = python_exe or self._last_python_exe
         py = python_exe or 'python'
         try:
-            proc = subprocess.run([py, '-m', 'pip', 'uninstall', name, '-y'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
-            out = (proc.stdout or '') + ("\n" + proc.stderr if proc.stderr else '')
-            if proc.returncode == 0:
+            code, out = _run_captured([py, '-m', 'pip', 'uninstall', name, '-y'], 600)
+            if code == 0:
                 return f"删除成功：{name}\n\n{out[:1800]}"
             else:
-                return f"删除失败（返回码{proc.returncode}）：{name}\n\n{out[:1800]}"
+                return f"删除失败（返回码{code}）：{name}\n\n{out[:1800]}"
         except Exception as e:
             return f"删除执行异常: {e}"
 
@@ -977,9 +3533,9 @@ class ComfyVenvTools:
         whl_name = os.path.basename(whl_path)
         try:
             # 使用实时输出捕获，提供更好的安装过程反馈
-            proc = subprocess.Popen([py, '-m', 'pip', 'install', whl_path], 
-                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT, 
-                                  text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
+            proc = spawn_process([py, '-m', 'pip', 'install', whl_path], 
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, 
+                               text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
             
             output_lines = []
             
@@ -1020,15 +3576,11 @@ class ComfyVenvTools:
         self._last_python_exe = python_exe or self._last_python_exe
         self._last_mirror_name = mirror_name or self._last_mirror_name
         py = python_exe or 'python'
-        mirror_url = PYPI_MIRRORS.get(mirror_name or '', '')
-        cmd: List[str] = [py, '-m', 'pip', 'install', src_path]
-        if mirror_url:
-            host = mirror_url.split('/')[2]
-            cmd += ['-i', mirror_url, '--trusted-host', host]
+        cmd: List[str] = [py, '-m', 'pip', 'install', src_path] + mirror_pip_args(mirror_name)
         src_name = os.path.basename(src_path)
         try:
             # 使用实时输出捕获，提供更好的安装过程反馈
-            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
+            proc = spawn_process(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
             
             output_lines = []
             
@@ -1065,7 +3617,7 @@ class ComfyVenvTools:
     # ---------------------- CMD 执行 ----------------------
     def execute_command(self, cmd: str) -> str:
         try:
-            proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
+            proc = spawn_process(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
             out, err = proc.communicate(timeout=60)
             return out or err or "(无输出)"
         except Exception as e:
@@ -1157,47 +3709,20 @@ class ComfyVenvTools:
         仅扫描根目录和一级子目录中的 requirements.txt 文件，并判断依赖是否已安装。
         - 只检查根目录和第一层子目录中的 requirements.txt
         - 跳过 cache_list 中已确认全部安装的文件
-        - progress_cb(0~1) 可选，用于实时反馈进度
-        - 返回 missing_files（未安装的依赖文件路径列表）、all_ok_files（已安装的依赖文件路径列表）、
-          missing_packages（未安装的包名列表）、message（汇总信息）
-        """
-        missing_files: List[str] = []
-        all_ok_files: List[str] = []
-        missing_packages: List[str] = []  # 新增：收集所有未安装的包名
-        cache_set = set(cache_list or [])
-        if not dir_path or not os.path.isdir(dir_path):
-            return {"missing_files": [], "all_ok_files": [], "message": "[插件维护] 目录不存在或不可访问"}
-
-        py = python_exe or "python"
-
-        candidates: List[str] = []
-        try:
-            # 根目录：仅 requirements.txt
-            root_files = set(os.listdir(dir_path))
-            if "requirements.txt" in root_files:
-                candidates.append(os.path.join(dir_path, "requirements.txt"))
-
-            # 一级子目录中的依赖文件（扫描所有第一层子目录）
-            for name in root_files:
-                sub = os.path.join(dir_path, name)
-                if os.path.isdir(sub):
-                    try:
-                        # 只检查第一层子目录中的 requirements.txt
-                        req_file = os.path.join(sub, "requirements.txt")
-                        if os.path.exists(req_file):
-                            candidates.append(req_file)
-                    except Exception:
-                        pass
-        except Exception:
-            pass
+        - progress_cb(0~1) 可选，用于实时反馈进度
+        - 返回 missing_files（未安装的依赖文件路径列表）、all_ok_files（已安装的依赖文件路径列表）、
+          missing_packages（未安装的包名列表）、message（汇总信息）
+        """
+        missing_files: List[str] = []
+        all_ok_files: List[str] = []
+        missing_packages: List[str] = []  # 新增：收集所有未安装的包名
+        cache_set = set(cache_list or [])
+        if not dir_path or not os.path.isdir(dir_path):
+            return {"missing_files": [], "all_ok_files": [], "message": "[插件维护] 目录不存在或不可访问"}
+
+        py = python_exe or "python"
 
-        # 去重
-        unique_candidates = []
-        seen = set()
-        for p in candidates:
-            if p not in seen:
-                seen.add(p)
-                unique_candidates.append(p)
+        unique_candidates = self._find_requirement_files(dir_path)
 
         # 优化：批量获取已安装包，避免对每个文件都重复查询
         total = len(unique_candidates)
@@ -1266,6 +3791,235 @@ class ComfyVenvTools:
             
         return {"missing_files": missing_files, "all_ok_files": all_ok_files, "missing_packages": unique_missing_packages, "message": msg}
 
+    def _find_requirement_files(self, dir_path: str) -> List[str]:
+        """custom_nodes 根目录与一级子目录（各插件）中的 requirements.txt，去重后返回。"""
+        candidates: List[str] = []
+        try:
+            # 根目录：仅 requirements.txt
+            root_files = set(os.listdir(dir_path))
+            if "requirements.txt" in root_files:
+                candidates.append(os.path.join(dir_path, "requirements.txt"))
+
+            # 一级子目录中的依赖文件（扫描所有第一层子目录）
+            for name in root_files:
+                sub = os.path.join(dir_path, name)
+                if os.path.isdir(sub):
+                    try:
+                        # 只检查第一层子目录中的 requirements.txt
+                        req_file = os.path.join(sub, "requirements.txt")
+                        if os.path.exists(req_file):
+                            candidates.append(req_file)
+                    except Exception:
+                        pass
+        except Exception:
+            pass
+        return list(dict.fromkeys(candidates))
+
+    # ---------------------- 跨插件冲突预测 ----------------------
+    def predict_plugin_conflicts(self, dir_path: str, python_exe: str | None = None) -> Dict[str, object]:
+        """安装前预测插件之间的依赖冲突（纯本地计算，不访问网络、不调用 pip）。
+        读取所有插件的 requirements.txt（含 -r 引用），按规范化包名汇总版本约束，
+        把每组约束化为版本区间求交：交集为空即不可满足，并指出互相矛盾的插件对。
+        提供 python_exe 时按其标记环境过滤条件依赖，并标出当前已安装版本不满足的约束。
+        返回 {files, packages, conflicts:[{name, reason, pairs, constraints}], mismatched:[...], elapsed}。"""
+        start = time.time()
+        files = self._find_requirement_files(dir_path) if dir_path and os.path.isdir(dir_path) else []
+        markers: Dict[str, str] = {}
+        installed: Dict[str, Dict[str, object]] = {}
+        if python_exe:
+            markers = dict(self._get_env_info(python_exe).get('markers') or {})  # type: ignore[arg-type]
+            installed = self._read_installed_distributions(python_exe)
+        grouped: Dict[str, List[Dict[str, object]]] = {}
+        for path in files:
+            plugin = os.path.basename(os.path.dirname(path)) if os.path.normpath(os.path.dirname(path)) != os.path.normpath(dir_path) else '(根目录)'
+            for line_no, req in self._read_requirement_specs(path):
+                if req.marker is not None and markers:
+                    try:
+                        if not req.marker.evaluate(markers):
+                            continue
+                    except Exception:
+                        pass
+                grouped.setdefault(canonicalize_name(req.name), []).append({
+                    'plugin': plugin, 'file': path, 'line': line_no,
+                    'spec': str(req.specifier), 'url': req.url or '', 'specifier': req.specifier})
+
+        conflicts: List[Dict[str, object]] = []
+        mismatched: List[Dict[str, object]] = []
+        for name, cons in sorted(grouped.items()):
+            constrained = [c for c in cons if str(c['spec'])]
+            if len(constrained) > 1:
+                total = self._specifier_interval(SpecifierSet(','.join(str(c['spec']) for c in constrained)))
+                if self._interval_empty(total):
+                    pairs = []
+                    for i in range(len(constrained)):
+                        for j in range(i + 1, len(constrained)):
+                            a, b = constrained[i], constrained[j]
+                            if a['plugin'] == b['plugin']:
+                                continue
+                            iv = self._interval_intersect(self._specifier_interval(a['specifier']), self._specifier_interval(b['specifier']))  # type: ignore[arg-type]
+                            if self._interval_empty(iv):
+                                pairs.append((a, b))
+                    conflicts.append({'name': name, 'pairs': pairs, 'constraints': constrained,
+                                      'reason': self._describe_interval_conflict(constrained)})
+            dist = installed.get(name)
+            if dist is not None:
+                bad = [c for c in constrained if not c['specifier'].contains(str(dist['version']), prereleases=True)]  # type: ignore[union-attr]
+                if bad:
+                    mismatched.append({'name': name, 'installed': dist['version'], 'constraints': bad})
+        for cons in grouped.values():
+            for c in cons:
+                c.pop('specifier', None)
+        return {'files': files, 'packages': len(grouped), 'conflicts': conflicts, 'mismatched': mismatched,
+                'elapsed': time.time() - start}
+
+    def format_plugin_conflicts(self, result: Dict[str, object], limit: int = 30) -> str:
+        """跨插件冲突预测结果的文本报告。"""
+        conflicts: List[Dict[str, object]] = result.get('conflicts') or []  # type: ignore[assignment]
+        mismatched: List[Dict[str, object]] = result.get('mismatched') or []  # type: ignore[assignment]
+        head = (f"[冲突预测] 分析 {len(result.get('files') or [])} 个依赖文件、{result.get('packages', 0)} 个包，"  # type: ignore[arg-type]
+                f"耗时 {float(result.get('elapsed') or 0) * 1000:.0f}ms")  # type: ignore[arg-type]
+        if not conflicts and not mismatched:
+            return head + "\n[冲突预测] ✅ 各插件的版本约束可以同时满足"
+        lines = [head]
+        if conflicts:
+            lines.append(f"[冲突预测] ❌ {len(conflicts)} 个包的版本约束无法同时满足：")
+            for c in conflicts[:limit]:
+                lines.append(f"  - {c['name']}：{c['reason']}")
+                pairs = c.get('pairs') or []
+                for a, b in pairs[:5]:  # type: ignore[misc]
+                    lines.append(f"      {a['plugin']} 要求 {c['name']}{a['spec']}  ↔  {b['plugin']} 要求 {c['name']}{b['spec']}")
+                if not pairs:
+                    for con in c['constraints']:  # type: ignore[union-attr]
+                        lines.append(f"      {con['plugin']}: {c['name']}{con['spec']}")
+        if mismatched:
+            lines.append(f"[冲突预测] ⚠️ {len(mismatched)} 个包的已安装版本不满足部分插件的要求：")
+            for m in mismatched[:limit]:
+                who = ', '.join(f"{con['plugin']}({con['spec']})" for con in m['constraints'])  # type: ignore[union-attr]
+                lines.append(f"  - {m['name']}=={m['installed']}：{who}")
+        return '\n'.join(lines)
+
+    def _read_requirement_specs(self, file_path: str, _seen: set | None = None) -> List[Tuple[int, Requirement]]:
+        """按 PEP 508 解析 requirements 文件（处理续行、行内注释与 -r 引用），返回 [(行号, Requirement)]。
+        选项行、可编辑安装与无法解析的条目被忽略。"""
+        seen = _seen if _seen is not None else set()
+        key = os.path.normcase(os.path.abspath(file_path))
+        if key in seen:
+            return []
+        seen.add(key)
+        out: List[Tuple[int, Requirement]] = []
+        try:
+            with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                text = f.read()
+        except OSError:
+            return out
+        buf, start_no = '', 0
+        for no, raw in enumerate(text.splitlines(), 1):
+            line = re.sub(r'(^|\s)#.*$', '', raw).strip()
+            if not buf:
+                start_no = no
+            if line.endswith('\\'):
+                buf += line[:-1] + ' '
+                continue
+            line = (buf + line).strip()
+            buf = ''
+            if not line:
+                continue
+            m = re.match(r'^(-r|--requirement)\s*=?\s*(\S+)', line)
+            if m:
+                out.extend(self._read_requirement_specs(os.path.join(os.path.dirname(file_path), m.group(2)), seen))
+                continue
+            if line.startswith('-'):
+                continue
+            req = self._parse_requirement(line.split(' --', 1)[0])
+            if req is not None:
+                out.append((start_no, req))
+        return out
+
+    def _specifier_interval(self, specs: SpecifierSet) -> Tuple[object, bool, object, bool, set]:
+        """把一组版本约束化为区间 (下界, 含下界, 上界, 含上界, 排除版本集合)；界为 None 表示无界。
+        ==X.* 与 ~= 展开为半开区间；=== 与无法解析的版本不参与计算。"""
+        lo: Optional[Version] = None
+        lo_inc = True
+        hi: Optional[Version] = None
+        hi_inc = True
+        excluded: set = set()
+
+        def _raise_lo(v: Version, inc: bool) -> None:
+            nonlocal lo, lo_inc
+            if lo is None or v > lo or (v == lo and not inc):
+                lo, lo_inc = v, inc
+
+        def _cut_hi(v: Version, inc: bool) -> None:
+            nonlocal hi, hi_inc
+            if hi is None or v < hi or (v == hi and not inc):
+                hi, hi_inc = v, inc
+
+        def _prefix_bounds(release: Tuple[int, ...]) -> Tuple[Version, Version]:
+            nxt = list(release[:-1]) + [release[-1] + 1]
+            return Version('.'.join(map(str, release)) + '.dev0'), Version('.'.join(map(str, nxt)) + '.dev0')
+
+        for sp in specs:
+            op, ver = sp.operator, sp.version
+            try:
+                if op == '==' and ver.endswith('.*'):
+                    a, b = _prefix_bounds(Version(ver[:-2]).release)
+                    _raise_lo(a, True)
+                    _cut_hi(b, False)
+                elif op == '==':
+                    v = Version(ver)
+                    _raise_lo(v, True)
+                    _cut_hi(v, True)
+                elif op == '!=':
+                    if not ver.endswith('.*'):
+                        excluded.add(Version(ver))
+                elif op == '>=':
+                    _raise_lo(Version(ver), True)
+                elif op == '>':
+                    _raise_lo(Version(ver), False)
+                elif op == '<=':
+                    _cut_hi(Version(ver), True)
+                elif op == '<':
+                    _cut_hi(Version(ver), False)
+                elif op == '~=':
+                    v = Version(ver)
+                    _raise_lo(v, True)
+                    _cut_hi(_prefix_bounds(v.release[:-1])[1], False)
+            except (InvalidVersion, IndexError, ValueError):
+                continue
+        return lo, lo_inc, hi, hi_inc, excluded
+
+    def _interval_intersect(self, a: Tuple[object, bool, object, bool, set], b: Tuple[object, bool, object, bool, set]) -> Tuple[object, bool, object, bool, set]:
+        lo, lo_inc, hi, hi_inc, ex = a
+        if b[0] is not None and (lo is None or b[0] > lo or (b[0] == lo and not b[1])):  # type: ignore[operator]
+            lo, lo_inc = b[0], b[1]
+        if b[2] is not None and (hi is None or b[2] < hi or (b[2] == hi and not b[3])):  # type: ignore[operator]
+            hi, hi_inc = b[2], b[3]
+        return lo, lo_inc, hi, hi_inc, set(ex) | set(b[4])
+
+    def _interval_empty(self, iv: Tuple[object, bool, object, bool, set]) -> bool:
+        lo, lo_inc, hi, hi_inc, ex = iv
+        if lo is None or hi is None:
+            return False
+        if lo > hi:  # type: ignore[operator]
+            return True
+        if lo == hi:
+            return not (lo_inc and hi_inc) or lo in ex
+        return False
+
+    def _describe_interval_conflict(self, constrained: List[Dict[str, object]]) -> str:
+        """说明不可满足的原因：最严格的下界高于最严格的上界，或固定版本被排除。"""
+        lo_c = hi_c = None
+        lo_v = hi_v = None
+        for c in constrained:
+            lo, _, hi, _, _ = self._specifier_interval(c['specifier'])  # type: ignore[arg-type]
+            if lo is not None and (lo_v is None or lo > lo_v):  # type: ignore[operator]
+                lo_v, lo_c = lo, c
+            if hi is not None and (hi_v is None or hi < hi_v):  # type: ignore[operator]
+                hi_v, hi_c = hi, c
+        if lo_c is not None and hi_c is not None and lo_c is not hi_c:
+            return f"{lo_c['plugin']} 要求 {lo_c['spec']}，而 {hi_c['plugin']} 要求 {hi_c['spec']}，不存在同时满足的版本"
+        return "固定版本被其他插件的约束排除"
+
     def git_check_updates(self, plugin_dirs: List[str]) -> Dict[str, object]:
         """
         检查多个插件目录是否有Git更新。
@@ -1431,8 +4185,8 @@ class ComfyVenvTools:
             cmd = ["git", "clone", url]
             
             # 使用Popen实时获取输出
-            proc = subprocess.Popen(cmd, cwd=dest, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, 
-                                  text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
+            proc = spawn_process(cmd, cwd=dest, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, 
+                               text=True, errors='replace', creationflags=CREATE_NO_WINDOW)
             
             full_output = []
             # 实时读取输出
@@ -1479,6 +4233,1068 @@ class ComfyVenvTools:
             pass
         return None
 
+    # ---------------------- 目录复制引擎 ----------------------
+    def scan_tree(self, root: str, exclude: Tuple[str, ...] = ()) -> Dict[str, object]:
+        """单次 os.scandir 遍历生成目录清单，复制、进度与备份统计都由它派生，不再重复遍历。
+        返回 {root, created, dirs:[相对路径], files:[[相对路径, 大小, mtime_ns]], links:[[相对路径, 链接目标]],
+              total_files, total_bytes, errors:[(路径, 原因)]}；相对路径统一用 '/' 分隔。
+        exclude 为根目录下需要跳过的名称（如备份清单文件本身）。"""
+        root = os.path.abspath(root)
+        dirs: List[str] = []
+        files: List[List[object]] = []
+        links: List[List[str]] = []
+        errors: List[Tuple[str, str]] = []
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            dirs.append(rel)
+            path = os.path.join(root, rel) if rel else root
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if not rel and entry.name in exclude:
+                            continue
+                        child = f"{rel}/{entry.name}" if rel else entry.name
+                        try:
+                            # DirEntry 在 Windows 上自带 stat 信息，Linux 上每个文件也只 stat 一次
+                            if entry.is_symlink():
+                                links.append([child, os.readlink(entry.path)])
+                            elif entry.is_dir(follow_symlinks=False):
+                                stack.append(child)
+                            elif entry.is_file(follow_symlinks=False):
+                                st = entry.stat(follow_symlinks=False)
+                                files.append([child, st.st_size, st.st_mtime_ns])
+                        except OSError as e:
+                            errors.append((entry.path, str(e)))
+            except OSError as e:
+                errors.append((path, str(e)))
+        return {'root': root, 'created': time.time(), 'dirs': dirs, 'files': files, 'links': links,
+                'total_files': len(files), 'total_bytes': sum(int(f[1]) for f in files), 'errors': errors}
+
+    def write_backup_manifest(self, backup_dir: str, manifest: Dict[str, object], extra: Dict[str, object] | None = None) -> Optional[str]:
+        """把目录清单写入备份目录的 .backup_manifest.json，供还原、校验与增量备份使用。"""
+        data = {'version': 1, 'source': manifest.get('root'), 'created': manifest.get('created'),
+                'total_files': manifest.get('total_files'), 'total_bytes': manifest.get('total_bytes'),
+                'dirs': manifest.get('dirs'), 'files': manifest.get('files'), 'links': manifest.get('links'),
+                'hash_algo': manifest.get('hash_algo')}
+        data.update(extra or {})
+        path = os.path.join(backup_dir, BACKUP_MANIFEST)
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(path + '.tmp', path)
+            return path
+        except OSError as e:
+            self.log(f"[备份] 写入备份清单失败: {e}")
+            return None
+
+    def load_backup_manifest(self, backup_dir: str) -> Optional[Dict[str, object]]:
+        try:
+            with open(os.path.join(backup_dir, BACKUP_MANIFEST), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def verify_backup(self, backup_dir: str, manifest: Dict[str, object] | None = None, quick: bool = False,
+                      workers: int | None = None, progress_cb: Callable[[float], None] | None = None,
+                      stats_cb: Callable[[Dict[str, object]], None] | None = None,
+                      cancel: threading.Event | None = None) -> Dict[str, object]:
+        """按清单并行校验备份目录：检查文件是否存在、大小是否一致，清单带哈希时重新计算并比对（quick=True 只比对大小）。
+        manifest 缺省时读取备份目录中的 .backup_manifest.json。
+        返回 {ok, checked, total_files, bytes, total_bytes, missing, size_mismatch, corrupted, missing_dirs, unhashed,
+              errors, elapsed, hash_algo, cancelled}；列表项为相对路径（size_mismatch 为 (路径, 期望, 实际)）。"""
+        start = time.time()
+        backup_dir = os.path.abspath(backup_dir)
+        data = manifest if manifest is not None else self.load_backup_manifest(backup_dir)
+        result: Dict[str, object] = {'ok': False, 'checked': 0, 'total_files': 0, 'bytes': 0, 'total_bytes': 0,
+                                     'missing': [], 'size_mismatch': [], 'corrupted': [], 'missing_dirs': [], 'unhashed': 0,
+                                     'errors': [], 'elapsed': 0.0, 'hash_algo': None, 'cancelled': False}
+        if not data or data.get('files') is None:
+            result['errors'] = [(backup_dir, '备份目录中没有清单文件，无法校验')]
+            return result
+        algo = None if quick else (data.get('hash_algo') or ('sha256' if any(len(f) >= 4 and f[3] for f in data['files']) else None))  # type: ignore[union-attr, index]
+        if algo:
+            try:
+                _new_hasher(str(algo))
+            except ValueError as e:
+                result['errors'] = [(backup_dir, str(e))]
+                return result
+        result['hash_algo'] = algo
+        files = list(data['files'])  # type: ignore[call-overload]
+        total_bytes = sum(int(f[1]) for f in files)
+        result.update(total_files=len(files), total_bytes=total_bytes)
+        missing: List[str] = result['missing']  # type: ignore[assignment]
+        mismatch: List[Tuple[str, int, int]] = result['size_mismatch']  # type: ignore[assignment]
+        corrupted: List[str] = result['corrupted']  # type: ignore[assignment]
+        errors: List[Tuple[str, str]] = result['errors']  # type: ignore[assignment]
+        for d in data.get('dirs') or []:  # type: ignore[union-attr]
+            if d and not os.path.isdir(os.path.join(backup_dir, *d.split('/'))):
+                result['missing_dirs'].append(d)  # type: ignore[union-attr]
+        lock = threading.Lock()
+        counters = {'files': 0, 'bytes': 0, 'unhashed': 0, 'last': 0.0}
+
+        def _check(item: List[object]) -> None:
+            if cancel is not None and cancel.is_set():
+                return
+            rel, size = str(item[0]), int(item[1])  # type: ignore[call-overload]
+            expected = str(item[3]) if len(item) >= 4 and item[3] else None
+            path = os.path.join(backup_dir, *rel.split('/'))
+            problem = None
+            try:
+                actual = os.stat(path).st_size
+                if actual != size:
+                    problem = ('size', actual)
+                elif algo and expected:
+                    if self._file_digest(path, str(algo)) != expected:
+                        problem = ('hash', None)
+            except FileNotFoundError:
+                problem = ('missing', None)
+            except OSError as e:
+                problem = ('error', str(e))
+            with lock:
+                counters['files'] += 1
+                counters['bytes'] += size
+                if algo and not expected:
+                    counters['unhashed'] += 1
+                if problem is not None:
+                    kind, detail = problem
+                    if kind == 'missing':
+                        missing.append(rel)
+                    elif kind == 'size':
+                        mismatch.append((rel, size, int(detail)))  # type: ignore[arg-type]
+                    elif kind == 'hash':
+                        corrupted.append(rel)
+                    else:
+                        errors.append((rel, str(detail)))
+                now = time.time()
+                if now - counters['last'] >= 0.5:
+                    counters['last'] = now
+                    if progress_cb:
+                        progress_cb(counters['bytes'] / total_bytes if total_bytes else counters['files'] / max(1, len(files)))
+                    if stats_cb:
+                        stats_cb({'files': counters['files'], 'bytes': counters['bytes'], 'total_files': len(files),
+                                  'total_bytes': total_bytes, 'elapsed': now - start})
+
+        # 大文件先提交，避免最后只剩一个大文件单线程拖尾
+        files.sort(key=lambda f: -int(f[1]))
+        with ThreadPoolExecutor(max_workers=workers or self._copy_workers_for(backup_dir), initializer=_job_thread_initializer()) as pool:
+            list(pool.map(_check, files))
+        missing.sort()
+        corrupted.sort()
+        result.update(checked=counters['files'], bytes=counters['bytes'], unhashed=counters['unhashed'],
+                      elapsed=time.time() - start, cancelled=bool(cancel is not None and cancel.is_set()))
+        result['ok'] = not (missing or mismatch or corrupted or errors or result['missing_dirs'] or result['cancelled'])
+        if progress_cb:
+            progress_cb(1.0)
+        return result
+
+    # ---------------------- 增量快照（硬链接去重） ----------------------
+    def _file_digest(self, path: str, algo: str | None = None, throttle: IoThrottle | None = None) -> str:
+        """计算文件哈希；传入 throttle 时读取的字节同样计入限速（按其 chunk 分块读取，速率更平滑）。"""
+        h = _new_hasher(algo or _fast_hash_algo())
+        block_size = min(_COPY_BUFFER, throttle.chunk) if throttle is not None else _COPY_BUFFER
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                h.update(block)
+                if throttle is not None:
+                    throttle.on_bytes(len(block))
+        return h.hexdigest()
+
+    def list_snapshots(self, backup_root: str) -> List[Dict[str, object]]:
+        """列出备份根目录下带清单的备份（按创建时间从新到旧），含增量快照与完整复制备份。
+        每项：{name, path, kind, created, total_files, total_bytes, stored_files, stored_bytes, linked_files, parent, complete}；
+        kind 为 'snapshot'（增量快照，清单带 kind 标记；旧版快照按 linked_files 字段识别）或 'full'；
+        stored_* 为该快照新写入的数据量，其余文件与之前的快照共享硬链接。"""
+        result: List[Dict[str, object]] = []
+        try:
+            entries = [e for e in os.scandir(backup_root) if e.is_dir(follow_symlinks=False) and e.name.startswith(SNAPSHOT_PREFIX)]
+        except OSError:
+            return result
+        for e in entries:
+            data = self.load_backup_manifest(e.path)
+            if not data:
+                continue
+            kind = data.get('kind') or ('snapshot' if 'linked_files' in data else 'full')
+            result.append({'name': e.name, 'path': e.path, 'kind': kind, 'created': data.get('created') or 0,
+                           'total_files': data.get('total_files') or 0, 'total_bytes': data.get('total_bytes') or 0,
+                           'stored_files': data.get('stored_files', data.get('total_files') or 0),
+                           'stored_bytes': data.get('stored_bytes', data.get('total_bytes') or 0),
+                           'linked_files': data.get('linked_files') or 0, 'parent': data.get('parent'),
+                           'complete': bool(data.get('complete', True)), 'source': data.get('source')})
+        result.sort(key=lambda x: x['created'], reverse=True)  # type: ignore[arg-type, return-value]
+        return result
+
+    def reserve_backup_path(self, backup_root: str, suffix: str = '') -> str:
+        """在 backup_root 下占用一个新的备份路径 comfyui_env_backup_<时间戳>[_序号]<suffix> 并返回：
+        suffix 为空（目录型备份）时直接创建空目录，否则以独占方式创建空文件占位（归档完成后被替换）。
+        创建是原子的，同一秒内发起的多个备份依次得到 _2、_3…，不会写入同一个目录。"""
+        os.makedirs(backup_root, exist_ok=True)
+        base = SNAPSHOT_PREFIX + time.strftime('%Y%m%d_%H%M%S')
+        n = 1
+        while True:
+            path = os.path.join(backup_root, (base if n == 1 else f"{base}_{n}") + suffix)
+            try:
+                if suffix:
+                    os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                else:
+                    os.mkdir(path)
+                return path
+            except FileExistsError:
+                n += 1
+
+    def snapshot_tree(self, src_dir: str, backup_root: str, name: str | None = None,
+                      progress_cb: Callable[[float], None] | None = None,
+                      stats_cb: Callable[[Dict[str, object]], None] | None = None,
+                      cancel: threading.Event | None = None, throttle: IoThrottle | None = None) -> Dict[str, object]:
+        """在 backup_root 下创建增量快照目录 comfyui_env_backup_<时间戳>：
+        - 与上一个完整快照相比 (大小, mtime) 未变的文件直接硬链接，沿用其哈希；
+        - 变化的文件先算哈希，内容已存在于上一快照（移动/仅改 mtime）时同样硬链接，否则才复制数据；
+        - 文件系统不支持硬链接（FAT/exFAT、跨盘、链接数上限）时自动退化为复制。
+        快照目录本身是完整的目录树，可直接用于目录还原；清单中记录每个文件的哈希与本次新写入的数据量。
+        name 缺省时经 reserve_backup_path 取得不重复的名称；指定的目录已有内容时抛出 FileExistsError，不与其他备份混写。
+        返回 copy_tree 的统计并附加 {path, name, parent, stored_files, stored_bytes, linked_files}。"""
+        src_dir = os.path.abspath(src_dir)
+        if name:
+            dst_dir = os.path.join(backup_root, name)
+            if os.path.isdir(dst_dir) and os.listdir(dst_dir):
+                raise FileExistsError(f'快照目录已存在且不为空: {dst_dir}')
+            os.makedirs(dst_dir, exist_ok=True)
+        else:
+            dst_dir = self.reserve_backup_path(backup_root)
+            name = os.path.basename(dst_dir)
+        # 上一个完整快照（优先同一源目录）
+        parent = None
+        snaps = [x for x in self.list_snapshots(backup_root) if x['complete'] and x['name'] != name]
+        for snap in snaps:
+            if snap.get('source') and os.path.normcase(str(snap['source'])) == os.path.normcase(src_dir):
+                parent = snap
+                break
+        if parent is None and snaps:
+            parent = snaps[0]
+        prev_by_path: Dict[str, Tuple[int, int, str | None]] = {}
+        prev_by_hash: Dict[str, str] = {}
+        algo = _fast_hash_algo()
+        if parent is not None:
+            pdata = self.load_backup_manifest(str(parent['path'])) or {}
+            # 沿用上一快照的哈希算法，未变文件的哈希可直接复用；该算法在本机不可用时改用默认算法并重新计算
+            palgo = str(pdata.get('hash_algo') or 'sha256')
+            try:
+                _new_hasher(palgo)
+                algo = palgo
+            except ValueError:
+                pass
+            for item in pdata.get('files') or []:
+                rel, size, mtime = item[0], int(item[1]), int(item[2])
+                digest = str(item[3]) if len(item) >= 4 and item[3] and palgo == algo else None
+                prev_by_path[rel] = (size, mtime, digest)
+                if digest:
+                    prev_by_hash.setdefault(digest, os.path.join(str(parent['path']), *rel.split('/')))
+            self.log(f"[快照] 基于上一快照 {parent['name']}（{len(prev_by_path)} 个文件）做增量备份")
+        else:
+            self.log("[快照] 未找到可用的上一快照，本次为完整备份")
+
+        lock = threading.Lock()
+        digests: Dict[str, str] = {}
+        counts = {'stored_files': 0, 'stored_bytes': 0, 'linked_files': 0}
+        max_chunk = throttle.chunk if throttle is not None else _COPY_CHUNK
+
+        def _link(target: str, dst: str) -> bool:
+            try:
+                if os.path.lexists(dst):
+                    os.remove(dst)
+                os.link(target, dst)
+                return True
+            except OSError:
+                return False
+
+        def _snapshot_file(src: str, dst: str, rel: str, size: int, mtime: int, on_bytes: Callable[[int], None]) -> int:
+            prev = prev_by_path.get(rel)
+            digest: str | None = None
+            target: str | None = None
+            if prev and prev[0] == size and prev[1] == mtime:
+                digest = prev[2]
+                target = os.path.join(str(parent['path']), *rel.split('/'))  # type: ignore[index]
+            elif prev_by_hash:
+                digest = self._file_digest(src, algo, throttle)
+                target = prev_by_hash.get(digest)
+            if target and _link(target, dst):
+                if digest is None:
+                    digest = self._file_digest(dst, algo, throttle)
+                with lock:
+                    digests[rel] = digest
+                    counts['linked_files'] += 1
+                return 0
+            if digest is None:
+                # 无可比对的哈希（首个快照）：复制时顺带计算，只读一遍源文件
+                hasher = _new_hasher(algo)
+                copied = _copy_file_data(src, dst, on_bytes, hasher, max_chunk=max_chunk)
+                digest = hasher.hexdigest()
+            else:
+                copied = _copy_file_data(src, dst, on_bytes, max_chunk=max_chunk)
+            with lock:
+                digests[rel] = digest
+                counts['stored_files'] += 1
+                counts['stored_bytes'] += copied
+            return copied
+
+        manifest = self.scan_tree(src_dir)
+        stats = self.copy_tree(src_dir, dst_dir, progress_cb=progress_cb, stats_cb=stats_cb, cancel=cancel,
+                               manifest=manifest, copy_file=_snapshot_file, throttle=throttle)
+        manifest['files'] = [[rel, size, mtime, digests.get(str(rel))] for rel, size, mtime in manifest['files']]  # type: ignore[union-attr, misc]
+        manifest['hash_algo'] = algo
+        extra = dict(counts, kind='snapshot', parent=parent['name'] if parent else None, complete=bool(stats.get('ok')))
+        self.write_backup_manifest(dst_dir, manifest, extra)
+        stats.update(extra, path=dst_dir, name=name)
+        self.log(f"[快照] {name}: 新写入 {counts['stored_files']} 个文件 {counts['stored_bytes'] / (1024**2):.1f} MB，"
+                 f"硬链接复用 {counts['linked_files']} 个文件")
+        return stats
+
+    def prune_snapshots(self, backup_root: str, keep_last: int = 5, keep_daily: int = 7, dry_run: bool = False) -> List[str]:
+        """按保留策略清理快照：保留最近 keep_last 个，另外最近 keep_daily 天每天保留最新的一个；
+        未完成的快照只在有更新的完整快照时删除。由于未变文件是硬链接，删除旧快照不会影响其他快照。
+        只处理增量快照（kind == 'snapshot'），同目录下的完整复制备份不受影响。
+        返回被删除（dry_run 时为将被删除）的快照路径。"""
+        snaps = [x for x in self.list_snapshots(backup_root) if x['kind'] == 'snapshot']
+        keep: set = set()
+        complete = [x for x in snaps if x['complete']]
+        for snap in complete[:max(0, keep_last)]:
+            keep.add(snap['path'])
+        days: set = set()
+        for snap in complete:
+            day = time.strftime('%Y%m%d', time.localtime(float(snap['created'])))  # type: ignore[arg-type]
+            if day in days:
+                continue
+            if len(days) >= max(0, keep_daily):
+                break
+            days.add(day)
+            keep.add(snap['path'])
+        newest_complete = float(complete[0]['created']) if complete else None  # type: ignore[arg-type]
+        removed: List[str] = []
+        for snap in snaps:
+            if snap['path'] in keep:
+                continue
+            if not snap['complete'] and (newest_complete is None or float(snap['created']) > newest_complete):  # type: ignore[arg-type]
+                continue
+            removed.append(str(snap['path']))
+            if dry_run:
+                continue
+            try:
+                shutil.rmtree(str(snap['path']), onerror=lambda fn, p, exc: (os.chmod(p, 0o666), fn(p)))
+                self.log(f"[快照] 已删除快照: {snap['name']}")
+            except Exception as e:
+                self.log(f"[快照] 删除快照失败 {snap['name']}: {e}")
+        return removed
+
+    # ---------------------- 流式压缩归档 ----------------------
+    def create_archive(self, src_dir: str, archive_path: str, codec: str = 'zlib', level: int | None = None,
+                       workers: int | None = None, chunk_size: int = _ARCHIVE_CHUNK,
+                       progress_cb: Callable[[float], None] | None = None,
+                       stats_cb: Callable[[Dict[str, object]], None] | None = None,
+                       cancel: threading.Event | None = None, members: List[str] | None = None,
+                       extra_index: Dict[str, object] | None = None, throttle: IoThrottle | None = None) -> Dict[str, object]:
+        """把目录打包为 .cvpack 归档：文件按路径顺序首尾相接切成固定大小的块，各块由线程池并行压缩、按顺序流式写盘，
+        内存中最多只有 2×线程数 个块；文件末尾写入索引（每个文件所在块与块内偏移）和定长尾部，支持随机读取单个文件/单个包。
+        格式：MAGIC | 压缩块... | zlib(JSON 索引) | <索引偏移 u64><索引长度 u64> | END。
+        members 为相对 src_dir 的文件列表时只打包这些文件（包级备份）；extra_index 合并进索引；
+        throttle 限制读取源文件的速率，并降低读取线程与压缩线程的 I/O 优先级。
+        返回 {ok, path, files, bytes, compressed, chunks, codec, elapsed, errors, cancelled}。"""
+        import struct
+        import zlib
+        start = time.time()
+        src_dir = os.path.abspath(src_dir)
+        compress, _ = _archive_codec(codec, level)
+        manifest = self.scan_tree(src_dir) if members is None else self._members_manifest(src_dir, members)
+        total_bytes = int(manifest['total_bytes'])  # type: ignore[arg-type]
+        n_workers = workers or max(1, min(16, os.cpu_count() or 4))
+        max_inflight = n_workers * 2
+        stats: Dict[str, object] = {'ok': False, 'path': archive_path, 'files': 0, 'bytes': 0, 'compressed': 0, 'chunks': 0,
+                                    'codec': codec, 'elapsed': 0.0, 'errors': list(manifest['errors']), 'cancelled': False}  # type: ignore[call-overload]
+        errors: List[Tuple[str, str]] = stats['errors']  # type: ignore[assignment]
+        chunks: List[List[int]] = []
+        entries: List[List[object]] = []
+        pending: deque = deque()
+        buf = bytearray()
+        last = [0.0]
+        part = archive_path + '.part'
+        os.makedirs(os.path.dirname(os.path.abspath(archive_path)) or '.', exist_ok=True)
+        if throttle is not None:
+            throttle.enter_thread()  # 读取与写盘都在调用线程中进行
+        with open(part, 'wb') as out, ThreadPoolExecutor(max_workers=n_workers, initializer=_job_thread_initializer(throttle)) as pool:
+            out.write(_ARCHIVE_MAGIC)
+
+            def _drain(block: bool) -> None:
+                # 按提交顺序写出已完成的块；block=True 时等待到在途块数低于上限
+                while pending and (pending[0][1].done() or (block and len(pending) >= max_inflight)):
+                    raw_len, fut = pending.popleft()
+                    data = fut.result()
+                    chunks.append([out.tell(), len(data), raw_len])
+                    out.write(data)
+                    stats['compressed'] = int(stats['compressed']) + len(data)  # type: ignore[arg-type]
+
+            def _submit() -> None:
+                nonlocal buf
+                pending.append((len(buf), pool.submit(compress, bytes(buf))))
+                buf = bytearray()
+                _drain(block=True)
+
+            def _report(force: bool = False) -> None:
+                now = time.time()
+                if not force and now - last[0] < 0.5:
+                    return
+                last[0] = now
+                if progress_cb:
+                    progress_cb(int(stats['bytes']) / total_bytes if total_bytes else 1.0)  # type: ignore[arg-type]
+                if stats_cb:
+                    stats_cb({'files': stats['files'], 'bytes': stats['bytes'], 'total_files': manifest['total_files'],
+                              'total_bytes': total_bytes, 'compressed': stats['compressed'], 'elapsed': now - start})
+
+            # 同一个包的文件路径相邻，按路径排序可让单包提取只涉及少量连续的块
+            for rel, _, mtime in sorted(manifest['files']):  # type: ignore[call-overload]
+                if cancel is not None and cancel.is_set():
+                    stats['cancelled'] = True
+                    break
+                path = os.path.join(src_dir, *str(rel).split('/'))
+                chunk_no, offset, size = len(chunks) + len(pending), len(buf), 0
+                if throttle is not None:
+                    throttle.on_file()
+                try:
+                    with open(path, 'rb') as f:
+                        mode = os.fstat(f.fileno()).st_mode & 0o7777
+                        while True:
+                            block = f.read(min(_COPY_BUFFER, chunk_size - len(buf)))
+                            if not block:
+                                break
+                            buf += block
+                            size += len(block)
+                            if throttle is not None:
+                                throttle.on_bytes(len(block))
+                            if len(buf) >= chunk_size:
+                                _submit()
+                except OSError as e:
+                    # 已读入缓冲的部分数据保持原样，索引按实际读到的长度记录
+                    errors.append((path, str(e)))
+                    if not size:
+                        continue
+                entries.append([rel, size, mtime, mode, chunk_no, offset])
+                stats['files'] = int(stats['files']) + 1  # type: ignore[arg-type]
+                stats['bytes'] = int(stats['bytes']) + size  # type: ignore[arg-type]
+                _report()
+            if buf:
+                _submit()
+            while pending:
+                _drain(block=True)
+            index = {'version': 1, 'codec': codec, 'chunk_size': chunk_size, 'source': src_dir, 'created': time.time(),
+                     'chunks': chunks, 'dirs': manifest['dirs'], 'links': manifest['links'], 'files': entries,
+                     'total_files': len(entries), 'total_bytes': stats['bytes']}
+            index.update(extra_index or {})
+            raw_index = zlib.compress(json.dumps(index, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 6)
+            index_offset = out.tell()
+            out.write(raw_index)
+            out.write(struct.pack('<QQ', index_offset, len(raw_index)) + _ARCHIVE_END)
+        stats.update(chunks=len(chunks), elapsed=time.time() - start)
+        if stats['cancelled']:
+            try:
+                os.remove(part)
+            except OSError:
+                pass
+        else:
+            os.replace(part, archive_path)
+            stats['ok'] = not errors
+        _report(force=True)
+        return stats
+
+    def _members_manifest(self, root: str, members: List[str]) -> Dict[str, object]:
+        """为指定文件列表生成与 scan_tree 同格式的清单（不存在的文件记入 errors）。"""
+        files: List[List[object]] = []
+        dirs = {''}
+        errors: List[Tuple[str, str]] = []
+        for rel in sorted(set(m.replace('\\', '/') for m in members)):
+            try:
+                st = os.stat(os.path.join(root, *rel.split('/')))
+            except OSError as e:
+                errors.append((rel, str(e)))
+                continue
+            files.append([rel, st.st_size, st.st_mtime_ns])
+            parts = rel.split('/')
+            dirs.update('/'.join(parts[:i]) for i in range(1, len(parts)))
+        return {'root': root, 'created': time.time(), 'dirs': sorted(dirs), 'files': files, 'links': [],
+                'total_files': len(files), 'total_bytes': sum(int(f[1]) for f in files), 'errors': errors}
+
+    # ---------------------- 包级备份 ----------------------
+    def backup_packages(self, python_exe: str, names: List[str], bundle_path: str | None = None,
+                        codec: str = 'zlib', cancel: threading.Event | None = None) -> Dict[str, object]:
+        """按 RECORD 把指定的已安装包（含 dist-info 与脚本）打包为 .cvpack 包级备份，体积只有这些包本身。
+        bundle_path 缺省时写入 package_backups/<时间戳>_<包名>.cvpack；cancel 同 create_archive。
+        返回 create_archive 的统计并附加 {packages:[{name, version}], missing:[未安装或无 RECORD 的包]}。"""
+        self._dist_cache.pop(python_exe, None)
+        installed = self._read_installed_distributions(python_exe)
+        abs_files: List[str] = []
+        packages: List[Dict[str, str]] = []
+        missing: List[str] = []
+        for n in names:
+            dist = installed.get(canonicalize_name(n))
+            if dist is None:
+                missing.append(n)
+                continue
+            dist_path = str(dist['path'])
+            base = os.path.dirname(dist_path)
+            try:
+                rels = self._record_paths(dist_path)
+            except OSError:
+                missing.append(n)  # egg-info 等没有 RECORD 的包无法精确备份
+                continue
+            abs_files.extend(os.path.normpath(os.path.join(base, r)) for r in rels)
+            abs_files.extend(os.path.join(dist_path, f) for f in os.listdir(dist_path)
+                             if os.path.isfile(os.path.join(dist_path, f)))
+            packages.append({'name': str(dist['name']), 'version': str(dist['version'])})
+        abs_files = sorted({f for f in abs_files if os.path.isfile(f)})
+        if not abs_files:
+            return {'ok': False, 'files': 0, 'bytes': 0, 'packages': packages, 'missing': missing, 'path': None}
+        root = os.path.commonpath([os.path.dirname(f) for f in abs_files])
+        if not bundle_path:
+            tag = packages[0]['name'] + (f'_等{len(packages)}个' if len(packages) > 1 else '')
+            bundle_path = os.path.join(os.getcwd(), 'package_backups', f"{time.strftime('%Y%m%d_%H%M%S')}_{tag}{ARCHIVE_SUFFIX}")
+        members = [os.path.relpath(f, root).replace(os.sep, '/') for f in abs_files]
+        stats = self.create_archive(root, bundle_path, codec=codec, members=members, cancel=cancel,
+                                    extra_index={'kind': 'packages', 'python_exe': python_exe, 'packages': packages})
+        stats.update(packages=packages, missing=missing)
+        self.log(f"[包备份] 已备份 {len(packages)} 个包（{stats['files']} 个文件，"
+                 f"{int(stats['compressed']) / (1024**2):.1f} MB）→ {bundle_path}")  # type: ignore[arg-type]
+        return stats
+
+    def restore_package_bundle(self, bundle_path: str, python_exe: str | None = None) -> str:
+        """一键还原包级备份：当前已安装版本与备份不同的包先 pip uninstall（清掉新版本多出的文件），
+        再把备份中的文件解回原位置。备份来自其他环境时拒绝还原（抛出 ValueError），
+        保证卸载与解压作用于同一个环境。返回结果说明。"""
+        index = self.read_archive_index(bundle_path)
+        if index.get('kind') != 'packages':
+            raise ValueError('不是包级备份文件')
+        src_py = str(index.get('python_exe') or '')
+        py = python_exe or src_py
+        dest = str(index['source'])
+        if src_py:
+            if py and env_key(py) != env_key(src_py):
+                raise ValueError(f'该包备份来自其他环境（{src_py}），与目标环境（{py}）不一致，已拒绝还原')
+        elif not (py and os.path.normcase(os.path.abspath(dest)).startswith(env_key(py) + os.sep)):
+            raise ValueError(f'无法确认包备份的来源环境，备份目录 {dest} 不在目标环境中，已拒绝还原')
+        if py:
+            self.uninstall_changed_packages(py, index.get('packages') or [], '[包还原]')  # type: ignore[arg-type]
+        stats = self.extract_archive(bundle_path, dest)
+        self._installed_packages_cache = None
+        self._dist_cache.pop(py, None)
+        names = ', '.join(f"{p['name']}=={p['version']}" for p in index.get('packages') or [])  # type: ignore[union-attr]
+        lines = [f"[包还原] {'✅' if stats['ok'] else '⚠️'} 已还原 {names}（{stats['files']} 个文件）"]
+        lines += [f"  - {p}: {r}" for p, r in list(stats['errors'])[:10]]  # type: ignore[call-overload]
+        return '\n'.join(lines)
+
+    def uninstall_changed_packages(self, python_exe: str, packages: List[Dict[str, str]], tag: str = '[包还原]') -> List[str]:
+        """还原前的准备：packages 为 [{name, version}]，当前已安装版本与之不同的包先 pip uninstall，
+        避免解出的旧文件与新版本文件混在一起（两个 dist-info、残留模块）。返回被卸载的包名。"""
+        self._dist_cache.pop(python_exe, None)
+        current = self._read_installed_distributions(python_exe)
+        remove: List[str] = []
+        for pkg in packages:
+            cur = current.get(canonicalize_name(pkg['name']))
+            if cur is not None and cur['version'] != pkg['version']:
+                remove.append(str(cur['name']))
+        if remove:
+            self.log(f"{tag} 卸载当前版本: {', '.join(remove)}")
+            ok, reason = self._run_pip_quiet([python_exe, '-m', 'pip', 'uninstall', '-y'] + remove, timeout=600)
+            if not ok:
+                self.log(f"{tag} 卸载出现问题: {reason}")
+        self._dist_cache.pop(python_exe, None)
+        return remove
+
+    def read_archive_index(self, archive_path: str) -> Dict[str, object]:
+        """读取 .cvpack 尾部索引（只读文件末尾，不触碰数据块）。格式不符时抛出 ValueError。"""
+        import struct
+        import zlib
+        with open(archive_path, 'rb') as f:
+            if f.read(len(_ARCHIVE_MAGIC)) != _ARCHIVE_MAGIC:
+                raise ValueError(f'不是有效的环境归档: {archive_path}')
+            f.seek(-(16 + len(_ARCHIVE_END)), os.SEEK_END)
+            tail = f.read()
+            if tail[16:] != _ARCHIVE_END:
+                raise ValueError(f'归档不完整（缺少索引）: {archive_path}')
+            index_offset, index_len = struct.unpack('<QQ', tail[:16])
+            f.seek(index_offset)
+            return json.loads(zlib.decompress(f.read(index_len)).decode('utf-8'))
+
+    def archive_package_members(self, index: Dict[str, object], package: str) -> List[str]:
+        """按包名在归档索引中找出该包的全部文件：定位 <包名>-<版本>.dist-info，按其中的 RECORD 列出文件；
+        RECORD 缺失时退回到 site-packages 下同名的顶层目录。"""
+        import csv
+        import io
+        import posixpath
+        want = canonicalize_name(package)
+        names = {str(e[0]) for e in index['files']}  # type: ignore[union-attr, index]
+        members: List[str] = []
+        for d in index['dirs']:  # type: ignore[union-attr]
+            base = posixpath.basename(d)
+            if not base.endswith('.dist-info') or '-' not in base:
+                continue
+            if canonicalize_name(base[:-len('.dist-info')].rsplit('-', 1)[0]) != want:
+                continue
+            site = posixpath.dirname(d)
+            members.extend(n for n in names if n.startswith(d + '/'))
+            record = d + '/RECORD'
+            if record in names:
+                text = self.read_archive_member(None, record, index=index).decode('utf-8', 'replace')
+                for row in csv.reader(io.StringIO(text)):
+                    if row:
+                        path = posixpath.normpath(posixpath.join(site, row[0]))
+                        if path in names:
+                            members.append(path)
+            else:
+                top = posixpath.join(site, package.replace('-', '_'))
+                members.extend(n for n in names if n.startswith(top + '/'))
+        return sorted(set(members))
+
+    def archive_package_versions(self, index: Dict[str, object], packages: List[str]) -> List[Dict[str, str]]:
+        """按归档中的 <包名>-<版本>.dist-info 目录得到指定包在归档里的版本：[{name, version}]，归档中没有的包不列出。"""
+        import posixpath
+        want = {canonicalize_name(p) for p in packages}
+        found: List[Dict[str, str]] = []
+        for d in index['dirs']:  # type: ignore[union-attr]
+            base = posixpath.basename(d)
+            if not base.endswith('.dist-info') or '-' not in base:
+                continue
+            name, version = base[:-len('.dist-info')].rsplit('-', 1)
+            if canonicalize_name(name) in want:
+                found.append({'name': name, 'version': version})
+        return found
+
+    def read_archive_member(self, archive_path: str | None, rel: str, index: Dict[str, object] | None = None) -> bytes:
+        """随机读取归档中的单个文件内容（只解压它所在的块）。"""
+        index = index or self.read_archive_index(str(archive_path))
+        archive_path = archive_path or str(index.get('_path'))
+        entry = next((e for e in index['files'] if e[0] == rel), None)  # type: ignore[union-attr, index]
+        if entry is None:
+            raise KeyError(rel)
+        _, decompress = _archive_codec(str(index['codec']))
+        chunks = index['chunks']
+        size, chunk_no, offset = int(entry[1]), int(entry[4]), int(entry[5])
+        data = bytearray()
+        with open(archive_path, 'rb') as f:
+            while len(data) < size:
+                pos, clen, _ = chunks[chunk_no]  # type: ignore[index]
+                f.seek(pos)
+                raw = decompress(f.read(clen))
+                data += raw[offset:offset + size - len(data)]
+                chunk_no, offset = chunk_no + 1, 0
+        return bytes(data)
+
+    def extract_archive(self, archive_path: str, dest_dir: str, members: List[str] | None = None,
+                        packages: List[str] | None = None, workers: int | None = None,
+                        progress_cb: Callable[[float], None] | None = None,
+                        cancel: threading.Event | None = None) -> Dict[str, object]:
+        """从 .cvpack 归档提取到 dest_dir。members 为相对路径（或目录前缀）列表，packages 为包名列表，
+        两者都为空时提取全部。只读取并解压涉及到的块，解压由线程池按顺序预取并行进行；恢复权限位与 mtime。
+        返回 {ok, files, bytes, chunks_read, total_chunks, missing:[未找到的包/路径], errors, elapsed}。"""
+        start = time.time()
+        index = self.read_archive_index(archive_path)
+        index['_path'] = archive_path
+        _, decompress = _archive_codec(str(index['codec']))
+        entries = index['files']
+        missing: List[str] = []
+        if members or packages:
+            wanted: set = set()
+            for pkg in packages or []:
+                found = self.archive_package_members(index, pkg)
+                if not found:
+                    missing.append(pkg)
+                wanted.update(found)
+            for m in members or []:
+                m = m.strip('/').replace('\\', '/')
+                found = [str(e[0]) for e in entries if e[0] == m or str(e[0]).startswith(m + '/')]  # type: ignore[union-attr, index]
+                if not found:
+                    missing.append(m)
+                wanted.update(found)
+            entries = [e for e in entries if e[0] in wanted]  # type: ignore[union-attr, index]
+            dirs = sorted({'/'.join(str(e[0]).split('/')[:i]) for e in entries for i in range(1, str(e[0]).count('/') + 1)})
+            links: List[List[str]] = []
+        else:
+            dirs = list(index['dirs'])  # type: ignore[call-overload]
+            links = list(index['links'])  # type: ignore[call-overload]
+        entries = sorted(entries, key=lambda e: (int(e[4]), int(e[5])))  # type: ignore[index]
+        chunks = index['chunks']
+        needed: List[int] = []
+        for e in entries:
+            size, chunk_no, offset = int(e[1]), int(e[4]), int(e[5])  # type: ignore[index]
+            if not size:
+                continue
+            last_chunk = chunk_no
+            remain = size - (int(chunks[chunk_no][2]) - offset)  # type: ignore[index]
+            while remain > 0:
+                last_chunk += 1
+                remain -= int(chunks[last_chunk][2])  # type: ignore[index]
+            for c in range(chunk_no, last_chunk + 1):
+                if not needed or needed[-1] < c:
+                    needed.append(c)
+        total_bytes = sum(int(e[1]) for e in entries)  # type: ignore[index]
+        stats: Dict[str, object] = {'ok': False, 'files': 0, 'bytes': 0, 'chunks_read': len(needed), 'total_chunks': len(chunks),  # type: ignore[arg-type]
+                                    'missing': missing, 'errors': [], 'elapsed': 0.0}
+        errors: List[Tuple[str, str]] = stats['errors']  # type: ignore[assignment]
+        dest_dir = os.path.abspath(dest_dir)
+        for d in dirs:
+            os.makedirs(os.path.join(dest_dir, *d.split('/')) if d else dest_dir, exist_ok=True)
+        n_workers = workers or max(1, min(8, os.cpu_count() or 4))
+
+        def _chunk_stream():
+            # 主线程顺序读取压缩块，线程池并行解压，按顺序产出
+            window: deque = deque()
+            with open(archive_path, 'rb') as f, ThreadPoolExecutor(max_workers=n_workers, initializer=_job_thread_initializer()) as pool:
+                for c in needed:
+                    pos, clen, _ = chunks[c]  # type: ignore[index]
+                    f.seek(pos)
+                    window.append((c, pool.submit(decompress, f.read(clen))))
+                    if len(window) >= n_workers * 2:
+                        c0, fut = window.popleft()
+                        yield c0, fut.result()
+                while window:
+                    c0, fut = window.popleft()
+                    yield c0, fut.result()
+
+        stream = _chunk_stream()
+        cache: Dict[int, bytes] = {}
+
+        def _get(c: int) -> bytes:
+            while c not in cache:
+                c0, data = next(stream)
+                cache[c0] = data
+            for old in [k for k in cache if k < c]:
+                del cache[old]
+            return cache[c]
+
+        last = 0.0
+        for e in entries:
+            if cancel is not None and cancel.is_set():
+                break
+            rel, size, mtime, mode, chunk_no, offset = str(e[0]), int(e[1]), int(e[2]), int(e[3]), int(e[4]), int(e[5])  # type: ignore[index]
+            path = os.path.join(dest_dir, *rel.split('/'))
+            try:
+                if os.path.lexists(path) and not os.access(path, os.W_OK):
+                    os.chmod(path, 0o666)
+                with open(path, 'wb') as out:
+                    remain = size
+                    while remain > 0:
+                        piece = _get(chunk_no)[offset:offset + remain]
+                        out.write(piece)
+                        remain -= len(piece)
+                        chunk_no, offset = chunk_no + 1, 0
+                os.chmod(path, mode)
+                os.utime(path, ns=(mtime, mtime))
+                stats['files'] = int(stats['files']) + 1  # type: ignore[arg-type]
+                stats['bytes'] = int(stats['bytes']) + size  # type: ignore[arg-type]
+            except (OSError, IndexError) as ex:
+                errors.append((path, str(ex)))
+            now = time.time()
+            if progress_cb and now - last >= 0.5:
+                last = now
+                progress_cb(int(stats['bytes']) / total_bytes if total_bytes else 1.0)  # type: ignore[arg-type]
+        stream.close()
+        for rel, target in links:
+            path = os.path.join(dest_dir, *rel.split('/'))
+            try:
+                if os.path.lexists(path):
+                    os.remove(path)
+                os.symlink(target, path)
+            except OSError as ex:
+                errors.append((path, str(ex)))
+        if progress_cb:
+            progress_cb(1.0)
+        stats['elapsed'] = time.time() - start
+        stats['ok'] = not errors and not missing and int(stats['files']) == len(entries)  # type: ignore[arg-type]
+        return stats
+
+    # ---------------------- 增量还原 ----------------------
+    def plan_restore(self, backup_dir: str, target_dir: str) -> Dict[str, object]:
+        """比较备份清单与当前目录，得出还原所需的最小改动：
+        - 缺失或大小不同的文件需要复制；大小、mtime 都相同视为未变；
+        - 大小相同但 mtime 不同时才计算哈希（备份清单带哈希时只算目标文件）：内容相同只需回写 mtime，否则复制；
+        - 目标中备份里没有的文件/目录/链接记为多余项。
+        返回 {manifest（备份侧清单）, complete（备份清单是否标记为完整）, copy:[相对路径], touch:[(相对路径, mtime_ns)], same,
+              extras:[相对路径], extra_dirs:[相对路径], copy_bytes, hashed}。"""
+        backup_dir = os.path.abspath(backup_dir)
+        target_dir = os.path.abspath(target_dir)
+        data = self.load_backup_manifest(backup_dir)
+        if data and data.get('files') is not None:
+            manifest = {'root': backup_dir, 'created': data.get('created'), 'dirs': data.get('dirs') or [''],
+                        'files': [[f[0], int(f[1]), int(f[2])] for f in data['files']],
+                        'links': data.get('links') or [], 'errors': []}
+            digests = {f[0]: f[3] for f in data['files'] if len(f) >= 4 and f[3]}
+            algo = str(data.get('hash_algo') or 'sha256')
+        else:
+            manifest = self.scan_tree(backup_dir, exclude=(BACKUP_MANIFEST,))
+            digests = {}
+            algo = _fast_hash_algo()
+        live = self.scan_tree(target_dir) if os.path.isdir(target_dir) else {'dirs': [], 'files': [], 'links': []}
+        live_files = {f[0]: (int(f[1]), int(f[2])) for f in live['files']}  # type: ignore[union-attr, index]
+        plan: Dict[str, object] = {'manifest': manifest, 'complete': bool((data or {}).get('complete', True)),
+                                   'copy': [], 'touch': [], 'same': 0, 'extras': [], 'extra_dirs': [], 'copy_bytes': 0, 'hashed': 0}
+        copy: List[str] = plan['copy']  # type: ignore[assignment]
+        touch: List[Tuple[str, int]] = plan['touch']  # type: ignore[assignment]
+        ambiguous: List[Tuple[str, int]] = []
+        for rel, size, mtime in manifest['files']:  # type: ignore[union-attr, misc]
+            cur = live_files.get(rel)
+            if cur is None or cur[0] != size:
+                copy.append(rel)
+                plan['copy_bytes'] = int(plan['copy_bytes']) + size  # type: ignore[arg-type]
+            elif cur[1] == mtime:
+                plan['same'] = int(plan['same']) + 1  # type: ignore[arg-type]
+            else:
+                ambiguous.append((rel, mtime))
+
+        def _same_content(item: Tuple[str, int]) -> bool:
+            rel = item[0]
+            try:
+                expected = digests.get(rel) or self._file_digest(os.path.join(backup_dir, *rel.split('/')), algo)
+                return self._file_digest(os.path.join(target_dir, *rel.split('/')), algo) == expected
+            except (OSError, ValueError):
+                return False
+        if ambiguous:
+            with ThreadPoolExecutor(max_workers=min(8, len(ambiguous)), initializer=_job_thread_initializer()) as pool:
+                for item, same in zip(ambiguous, pool.map(_same_content, ambiguous)):
+                    if same:
+                        touch.append(item)
+                    else:
+                        copy.append(item[0])
+                        plan['copy_bytes'] = int(plan['copy_bytes']) + live_files[item[0]][0]  # type: ignore[arg-type]
+            plan['hashed'] = len(ambiguous)
+        backup_files = {f[0] for f in manifest['files']}  # type: ignore[union-attr]
+        backup_links = {l[0] for l in manifest['links']}  # type: ignore[union-attr]
+        backup_dirs = set(manifest['dirs'])  # type: ignore[arg-type]
+        plan['extras'] = sorted([f[0] for f in live['files'] if f[0] not in backup_files] +  # type: ignore[union-attr, index]
+                                [l[0] for l in live['links'] if l[0] not in backup_links])  # type: ignore[union-attr, index]
+        # 多余目录由深到浅排列，便于逐个删除
+        plan['extra_dirs'] = sorted((d for d in live['dirs'] if d and d not in backup_dirs),  # type: ignore[union-attr]
+                                    key=lambda d: d.count('/'), reverse=True)
+        return plan
+
+    def delta_restore(self, backup_dir: str, target_dir: str, delete_extras: bool = False,
+                      progress_cb: Callable[[float], None] | None = None,
+                      stats_cb: Callable[[Dict[str, object]], None] | None = None,
+                      cancel: threading.Event | None = None, allow_incomplete: bool = False) -> Dict[str, object]:
+        """按 plan_restore 的结果增量还原：只复制缺失/变化的文件，内容相同仅 mtime 不同的文件回写 mtime；
+        delete_extras=True 时删除备份之后新增的文件与目录，使目标目录与备份完全一致（复制出错或取消时不删除）。
+        备份清单标记为未完成（备份中断）时抛出 ValueError，除非调用方已确认并传入 allow_incomplete=True。
+        返回 copy_tree 的统计并附加 {planned_copy, same, touched, hashed, removed, remove_errors, extras_skipped}。"""
+        backup_dir = os.path.abspath(backup_dir)
+        target_dir = os.path.abspath(target_dir)
+        plan = self.plan_restore(backup_dir, target_dir)
+        if not plan['complete'] and not allow_incomplete:
+            raise ValueError(f'备份未完成（创建时被中断或出错），拒绝还原: {backup_dir}')
+        manifest = plan['manifest']
+        to_copy = set(plan['copy'])  # type: ignore[arg-type]
+        sub = dict(manifest)  # type: ignore[arg-type]
+        sub['files'] = [f for f in manifest['files'] if f[0] in to_copy]  # type: ignore[index]
+        sub['total_files'] = len(sub['files'])
+        sub['total_bytes'] = sum(int(f[1]) for f in sub['files'])
+        self.log(f"[增量还原] 需复制 {len(to_copy)} 个文件（{int(sub['total_bytes']) / (1024**2):.1f} MB），"
+                 f"未变 {plan['same']} 个，校验哈希 {plan['hashed']} 个，多余 {len(plan['extras'])} 个文件")  # type: ignore[arg-type]
+        stats = self.copy_tree(backup_dir, target_dir, progress_cb=progress_cb, stats_cb=stats_cb, cancel=cancel, manifest=sub)
+        for rel, mtime in plan['touch']:  # type: ignore[union-attr, misc]
+            try:
+                os.utime(os.path.join(target_dir, *rel.split('/')), ns=(mtime, mtime))
+            except OSError:
+                pass
+        removed = 0
+        remove_errors: List[Tuple[str, str]] = []
+        # 复制有失败时目标只还原了一部分，此时再删多余文件会留下残缺的环境
+        extras_skipped = bool(delete_extras and (stats.get('cancelled') or stats.get('errors')))
+        if extras_skipped and stats.get('errors'):
+            self.log(f"[增量还原] ⚠️ {len(stats['errors'])} 个文件复制失败，未删除多余文件")  # type: ignore[arg-type]
+        if delete_extras and not extras_skipped:
+            for rel in plan['extras']:  # type: ignore[union-attr]
+                path = os.path.join(target_dir, *rel.split('/'))
+                try:
+                    try:
+                        os.remove(path)
+                    except PermissionError:
+                        os.chmod(path, 0o666)
+                        os.remove(path)
+                    removed += 1
+                except OSError as e:
+                    remove_errors.append((path, str(e)))
+            for rel in plan['extra_dirs']:  # type: ignore[union-attr]
+                try:
+                    os.rmdir(os.path.join(target_dir, *rel.split('/')))
+                except OSError as e:
+                    remove_errors.append((rel, str(e)))
+            if remove_errors:
+                stats['ok'] = False
+        stats.update(planned_copy=len(to_copy), same=plan['same'], touched=len(plan['touch']),  # type: ignore[arg-type]
+                     hashed=plan['hashed'], extras=len(plan['extras']), removed=removed, remove_errors=remove_errors,  # type: ignore[arg-type]
+                     extras_skipped=extras_skipped)
+        return stats
+
+    def copy_tree(self, src_dir: str, dst_dir: str, workers: int | None = None,
+                  progress_cb: Callable[[float], None] | None = None,
+                  stats_cb: Callable[[Dict[str, object]], None] | None = None,
+                  cancel: threading.Event | None = None,
+                  manifest: Dict[str, object] | None = None, exclude: Tuple[str, ...] = (),
+                  copy_file: Callable[[str, str, str, int, int, Callable[[int], None]], int] | None = None,
+                  hash_files: bool = False, throttle: IoThrottle | None = None) -> Dict[str, object]:
+        """跨平台并行复制目录（备份/还原使用）：按 scan_tree 的清单（未传入时遍历一次）得到精确的文件数与字节数，
+        再按存储类型确定线程数并发复制；文件数据走 _copy_file_data 的零拷贝路径，保留 mtime 与权限。
+        目标已存在的文件被覆盖（只读文件先去掉只读属性）；符号链接按链接复制。
+        progress_cb 按字节回调 0~1；stats_cb 约每 0.5 秒回调一次当前统计；cancel 置位后停止提交新文件。
+        copy_file(src, dst, rel, size, mtime_ns, on_bytes) -> 实际复制字节数，可替换单文件的复制方式（快照用它做硬链接去重）。
+        hash_files=True 时各复制线程在复制的同时计算快速哈希，写入清单的第 4 列（manifest['hash_algo'] 记录算法）。
+        throttle 为 IoThrottle 时按其字节/文件速率限速并降低复制线程的 I/O 优先级；统计中的 throttle_wait 为限速休眠总秒数。
+        返回 {ok, files, bytes, dirs, total_files, total_bytes, errors:[(路径, 原因)], elapsed, workers, cancelled, manifest}，
+        完成后的文件数/字节数直接来自复制计数，无需再遍历目标目录。"""
+        start = time.time()
+        src_dir = os.path.abspath(src_dir)
+        dst_dir = os.path.abspath(dst_dir)
+        stats: Dict[str, object] = {'ok': False, 'files': 0, 'bytes': 0, 'dirs': 0, 'total_files': 0, 'total_bytes': 0,
+                                    'errors': [], 'elapsed': 0.0, 'workers': 0, 'cancelled': False, 'manifest': None}
+        if not os.path.isdir(src_dir):
+            stats['errors'] = [(src_dir, '源目录不存在')]
+            return stats
+
+        # 1) 清单：一次遍历
+        if manifest is None:
+            manifest = self.scan_tree(src_dir, exclude)
+        stats['manifest'] = manifest
+        errors: List[Tuple[str, str]] = list(manifest.get('errors') or [])  # type: ignore[arg-type]
+        files = [(os.path.join(src_dir, *str(f[0]).split('/')), os.path.join(dst_dir, *str(f[0]).split('/')), int(f[1]), str(f[0]), int(f[2]))
+                 for f in manifest['files']]  # type: ignore[union-attr]
+        total_bytes = int(manifest['total_bytes'])  # type: ignore[arg-type]
+        stats.update(total_files=len(files), total_bytes=total_bytes)
+        dir_pairs = [(os.path.join(src_dir, *d.split('/')) if d else src_dir, os.path.join(dst_dir, *d.split('/')) if d else dst_dir)
+                     for d in manifest['dirs']]  # type: ignore[union-attr]
+        for _, d in dir_pairs:
+            try:
+                os.makedirs(d, exist_ok=True)
+            except OSError as e:
+                errors.append((d, str(e)))
+        stats['dirs'] = len(dir_pairs)
+        for rel, link_target in manifest['links']:  # type: ignore[union-attr, misc]
+            s_link = os.path.join(src_dir, *str(rel).split('/'))
+            d_link = os.path.join(dst_dir, *str(rel).split('/'))
+            try:
+                if os.path.lexists(d_link):
+                    os.remove(d_link)
+                os.symlink(link_target, d_link, target_is_directory=os.path.isdir(s_link))
+            except OSError as e:
+                errors.append((s_link, str(e)))
+
+        # 2) 并发复制：大文件先提交，避免最后只剩一个大文件单线程拖尾
+        n_workers = workers or self._copy_workers_for(src_dir, dst_dir)
+        stats['workers'] = n_workers
+        lock = threading.Lock()
+        counters = {'bytes': 0, 'files': 0, 'last': 0.0}
+
+        def _report(force: bool = False) -> None:
+            now = time.time()
+            if not force and now - counters['last'] < 0.5:
+                return
+            counters['last'] = now
+            if progress_cb:
+                progress_cb(counters['bytes'] / total_bytes if total_bytes else counters['files'] / max(1, len(files)))
+            if stats_cb:
+                stats_cb({'files': counters['files'], 'bytes': counters['bytes'], 'total_files': len(files),
+                          'total_bytes': total_bytes, 'elapsed': now - start})
+
+        def _on_bytes(n: int) -> None:
+            with lock:
+                counters['bytes'] += n
+                _report()
+            if throttle is not None:
+                throttle.on_bytes(n)
+
+        max_chunk = throttle.chunk if throttle is not None else _COPY_CHUNK
+
+        hash_algo = _fast_hash_algo() if hash_files else None
+        digests: Dict[str, str] = {}
+
+        def _copy_data(src: str, dst: str, rel: str, size: int, mtime: int, on_bytes: Callable[[int], None]) -> int:
+            if hash_algo is None:
+                return _copy_file_data(src, dst, on_bytes, max_chunk=max_chunk)
+            hasher = _new_hasher(hash_algo)
+            copied = _copy_file_data(src, dst, on_bytes, hasher, max_chunk=max_chunk)
+            digests[rel] = hasher.hexdigest()
+            return copied
+
+        do_copy = copy_file or _copy_data
+
+        def _copy_one(job: Tuple[str, str, int, str, int]) -> None:
+            src, dst, size, rel, mtime = job
+            if cancel is not None and cancel.is_set():
+                return
+            if throttle is not None:
+                throttle.on_file()
+            try:
+                try:
+                    copied = do_copy(src, dst, rel, size, mtime, _on_bytes)
+                except PermissionError:
+                    # 目标为只读文件（常见于 .pyc / 打包的 dll）：去掉只读属性后重试
+                    os.chmod(dst, 0o666)
+                    copied = do_copy(src, dst, rel, size, mtime, _on_bytes)
+                with lock:
+                    counters['files'] += 1
+                    counters['bytes'] += size - copied  # 复制期间文件大小变化或硬链接（未复制数据）时以清单大小计
+                    _report()
+            except OSError as e:
+                with lock:
+                    errors.append((src, str(e)))
+
+        files.sort(key=lambda f: -f[2])
+        with ThreadPoolExecutor(max_workers=n_workers, initializer=_job_thread_initializer(throttle)) as pool:
+            list(pool.map(_copy_one, files))
+
+        # 3) 目录 mtime 最后设置（写入文件会改变目录 mtime），由深到浅
+        for s_dir, d_dir in reversed(dir_pairs):
+            try:
+                shutil.copystat(s_dir, d_dir)
+            except OSError:
+                pass
+        _report(force=True)
+        if hash_algo is not None:
+            manifest['files'] = [[f[0], f[1], f[2], digests.get(str(f[0]))] for f in manifest['files']]  # type: ignore[union-attr, index]
+            manifest['hash_algo'] = hash_algo
+        stats.update(files=counters['files'], bytes=counters['bytes'], errors=errors,
+                     elapsed=time.time() - start, cancelled=bool(cancel is not None and cancel.is_set()),
+                     throttle_wait=throttle.waited if throttle is not None else 0.0)
+        stats['ok'] = not errors and not stats['cancelled']
+        return stats
+
+    def _copy_workers_for(self, *paths: str) -> int:
+        """按存储类型选择复制线程数：机械硬盘并发过高会增加寻道，固态与网络存储则需要更多并发掩盖延迟。"""
+        cpu = os.cpu_count() or 4
+        if any(p.startswith('\\\\') for p in paths):
+            return 16  # UNC 网络路径：延迟主导
+        rotational = [self._is_rotational(p) for p in paths]
+        if any(r is True for r in rotational):
+            return 2
+        if all(r is False for r in rotational):
+            return min(32, cpu * 2)
+        return min(16, cpu + 4)  # 无法判断（如 Windows）：与线程池默认值相当
+
+    def _is_rotational(self, path: str) -> Optional[bool]:
+        """判断路径所在块设备是否为机械硬盘（仅 Linux 可判断，其他平台返回 None）。"""
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            probe = path
+            while not os.path.exists(probe):
+                parent = os.path.dirname(probe)
+                if parent == probe:
+                    return None
+                probe = parent
+            dev = os.stat(probe).st_dev
+            sys_dev = os.path.realpath(f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}")
+            # 分区的 queue 信息在其父设备目录下
+            for d in (sys_dev, os.path.dirname(sys_dev)):
+                flag = os.path.join(d, 'queue', 'rotational')
+                if os.path.isfile(flag):
+                    with open(flag, 'r') as f:
+                        return f.read().strip() == '1'
+        except (OSError, ValueError):
+            pass
+        return None
+
     # ---------------------- 辅助方法 ----------------------
     def _get_installed_packages_batch(self, python_exe: str, progress_cb: Optional[Callable[[float], None]] = None) -> set[str]:
         """批量获取已安装的包名，返回小写包名集合以提高性能"""
@@ -1613,4 +5429,323 @@ class ComfyVenvTools:
         if spec.startswith('git+'):
             return None
         m = re.match(r'^([A-Za-z0-9_.\-]+)', spec.strip())
-        return m.group(1) if m else None
\ No newline at end of file
+        return m.group(1) if m else None
+
+    def _mirror_pip_args(self, mirror_name: str | None, with_fallback: bool = False) -> List[str]:
+        """根据镜像名生成 pip 索引参数；with_fallback 时追加官方源作为备用。"""
+        return mirror_pip_args(mirror_name, with_fallback)
+
+    # ---------------------- 预演计划缓存 ----------------------
+    def _env_fingerprint(self, python_exe: str) -> str:
+        """环境清单指纹：解释器路径 + 全部已安装包的 名称==版本。"""
+        import hashlib
+        dists = self._read_installed_distributions(python_exe)
+        items = sorted(f"{k}=={d['version']}" for k, d in dists.items())
+        return hashlib.sha1('\n'.join([os.path.abspath(python_exe)] + items).encode('utf-8')).hexdigest()
+
+    def _plan_cache_key(self, python_exe: str, pip_args: List[str], mirror_name: str | None) -> str:
+        """预演缓存键：pip 参数（含 -r/-c 文件内容哈希）、环境指纹与镜像索引参数。"""
+        import hashlib
+        h = hashlib.sha1()
+        args = list(pip_args)
+        for i, a in enumerate(args):
+            h.update(a.encode('utf-8') + b'\0')
+            if a in ('-r', '--requirement', '-c', '--constraint') and i + 1 < len(args):
+                try:
+                    with open(args[i + 1], 'rb') as f:
+                        h.update(hashlib.sha1(f.read()).digest())
+                except OSError:
+                    pass
+        h.update(self._env_fingerprint(python_exe).encode('utf-8'))
+        h.update('\0'.join(mirror_pip_args(mirror_name)).encode('utf-8'))
+        return h.hexdigest()
+
+    def _plan_cache_dir(self) -> str:
+        return os.path.join(os.getcwd(), 'dryrun_cache')
+
+    def cached_install_plan(self, python_exe: str, pip_args: List[str], mirror_name: str | None = None) -> Optional[Dict[str, object]]:
+        """仅查询缓存：返回相同依赖、环境与镜像下已解析过的安装报告，没有时返回 None。"""
+        try:
+            entry = self._plan_cache_load(self._plan_cache_key(python_exe, pip_args, mirror_name))
+            return entry['report'] if entry else None  # type: ignore[return-value]
+        except Exception:
+            return None
+
+    def _plan_cache_load(self, key: str) -> Optional[Dict[str, object]]:
+        entry = self._plan_cache.get(key)
+        if entry is None:
+            try:
+                with open(os.path.join(self._plan_cache_dir(), key + '.json'), 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+            except Exception:
+                return None
+        if time.time() - float(entry.get('created') or 0) > self.plan_cache_ttl:  # type: ignore[union-attr]
+            return None
+        self._plan_cache[key] = entry  # type: ignore[assignment]
+        return entry
+
+    def _plan_cache_store(self, key: str, report: Dict[str, object], output: str) -> None:
+        entry = {'created': time.time(), 'report': report, 'output': output}
+        self._plan_cache[key] = entry
+        root = self._plan_cache_dir()
+        try:
+            os.makedirs(root, exist_ok=True)
+            with open(os.path.join(root, key + '.json'), 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            # 清理过期的缓存与约束文件
+            for name in os.listdir(root):
+                path = os.path.join(root, name)
+                if time.time() - os.path.getmtime(path) > max(self.plan_cache_ttl, 86400):
+                    os.remove(path)
+        except OSError:
+            pass
+
+    def write_plan_constraints(self, report: Dict[str, object] | None) -> Optional[str]:
+        """把已解析的安装计划写成约束文件（名称==版本），实际安装时用 -c 传入以固定预演结果，
+        解析器无需再为每个包比较候选版本。直接 URL / 本地目录 / VCS 的条目无法约束，跳过。"""
+        if not report:
+            return None
+        import hashlib
+        pins = []
+        for item in report.get('install') or []:  # type: ignore[union-attr]
+            meta = item.get('metadata') or {}
+            if item.get('is_direct') or not meta.get('name') or not meta.get('version'):
+                continue
+            pins.append(f"{canonicalize_name(meta['name'])}=={meta['version']}")
+        if not pins:
+            return None
+        content = '\n'.join(sorted(pins)) + '\n'
+        path = os.path.join(self._plan_cache_dir(), f"constraints_{hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]}.txt")
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            return path
+        except OSError:
+            return None
+
+    def _pip_dry_run_report(self, python_exe: str, pip_args: List[str], mirror_name: str | None = None,
+                            timeout: int = 600, use_cache: bool = True) -> Tuple[Optional[Dict[str, object]], str]:
+        """执行 pip install --dry-run --report，返回 (安装报告, pip 输出)；失败时报告为 None。
+        成功的报告按 依赖内容 + 环境指纹 + 镜像 缓存，相同条件下再次预演直接复用。"""
+        key = ''
+        if use_cache:
+            try:
+                key = self._plan_cache_key(python_exe, pip_args, mirror_name)
+                entry = self._plan_cache_load(key)
+                if entry is not None:
+                    self.log(f"[预演缓存] 命中（{time.strftime('%H:%M:%S', time.localtime(float(entry['created'])))} 的解析结果），跳过重新解析")  # type: ignore[arg-type]
+                    return entry['report'], str(entry.get('output') or '')  # type: ignore[return-value]
+            except Exception:
+                key = ''
+        report, output = self._pip_dry_run_report_uncached(python_exe, pip_args, mirror_name, timeout)
+        if key and report is not None:
+            self._plan_cache_store(key, report, output)
+        return report, output
+
+    def _pip_dry_run_report_uncached(self, python_exe: str, pip_args: List[str], mirror_name: str | None,
+                                     timeout: int) -> Tuple[Optional[Dict[str, object]], str]:
+        report_path = ''
+        try:
+            fd, report_path = tempfile.mkstemp(prefix='pip_report_', suffix='.json')
+            os.close(fd)
+            cmd = [python_exe, '-m', 'pip', 'install', '--dry-run', '--quiet', '--report', report_path] + list(pip_args) + self._mirror_pip_args(mirror_name)
+            code, output = _run_captured(cmd, timeout)
+            if code != 0:
+                return None, output
+            with open(report_path, 'r', encoding='utf-8') as f:
+                return json.load(f), output
+        except Exception as e:
+            return None, str(e)
+        finally:
+            if report_path:
+                try:
+                    os.remove(report_path)
+                except OSError:
+                    pass
+
+    def _summarize_pip_error(self, output: str) -> str:
+        """从 pip 输出中提取最有价值的一行错误原因。"""
+        lines = [l.strip() for l in (output or '').split('\n') if l.strip() and not l.strip().startswith('WARNING')]
+        for l in reversed(lines[-6:]):
+            if 'No matching distribution found' in l or 'Could not find a version that satisfies' in l:
+                return l
+        return lines[-1] if lines else 'unknown error'
+
+    def _run_pip_quiet(self, cmd: List[str], timeout: int = 1200) -> Tuple[bool, str]:
+        """执行一条 pip 命令，返回 (是否成功, 失败原因摘要)。"""
+        try:
+            code, out = _run_captured(cmd, timeout)
+            if code is None:
+                return False, '安装超时'
+            if code == 0:
+                return True, ''
+            job = current_job()
+            if job is not None and job.cancelled:
+                return False, '任务已取消'
+            return False, self._summarize_pip_error(out)
+        except Exception as e:
+            return False, str(e)
+
+    def _get_env_info(self, python_exe: str) -> Dict[str, object]:
+        """探测解释器的 site-packages 目录、Python 版本与 PEP 508 标记环境（按解释器缓存）。"""
+        py = python_exe or self._last_python_exe or 'python'
+        cached = self._env_info_cache.get(py)
+        if cached is not None:
+            return cached
+        info: Dict[str, object] = {'site_dirs': [], 'markers': {}, 'version': '', 'scripts': ''}
+        try:
+            proc = subprocess.run([py, '-c', _ENV_PROBE_SCRIPT], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors='replace', timeout=30, creationflags=CREATE_NO_WINDOW)
+            if proc.returncode == 0 and proc.stdout:
+                data = json.loads(proc.stdout.strip().splitlines()[-1])
+                site_dirs: List[str] = []
+                for key in ('purelib', 'platlib'):
+                    d = data.get(key)
+                    if d and os.path.isdir(d) and os.path.normcase(d) not in [os.path.normcase(x) for x in site_dirs]:
+                        site_dirs.append(d)
+                info = {
+                    'site_dirs': site_dirs,
+                    'markers': data.get('markers') or {},
+                    'version': data.get('version') or '',
+                    'scripts': data.get('scripts') or '',
+                    'executable': data.get('executable') or py,
+                }
+                self._env_info_cache[py] = info
+        except Exception as e:
+            self.log(f"探测解释器信息失败: {e}")
+        return info
+
+    def _read_installed_distributions(self, python_exe: str) -> Dict[str, Dict[str, object]]:
+        """直接读取 site-packages 下的 dist-info/egg-info，返回 {规范化包名: 信息}。
+        信息包含 name、version、requires(Requires-Dist 原文列表)、path(元数据目录)。
+        以 site-packages 目录的 mtime 作为缓存键，安装/卸载后自动失效。"""
+        info = self._get_env_info(python_exe)
+        site_dirs = [str(d) for d in (info.get('site_dirs') or [])]
+        try:
+            stamp = tuple((d, os.stat(d).st_mtime_ns) for d in site_dirs)
+        except OSError:
+            stamp = ()
+        cached = self._dist_cache.get(python_exe)
+        if cached is not None and cached[0] == stamp and stamp:
+            return cached[1]
+        dists: Dict[str, Dict[str, object]] = {}
+        parser = Parser()
+        for site in site_dirs:
+            try:
+                entries = list(os.scandir(site))
+            except OSError:
+                continue
+            for entry in entries:
+                name = entry.name
+                if name.endswith('.dist-info') and entry.is_dir():
+                    meta_file = os.path.join(entry.path, 'METADATA')
+                elif name.endswith('.egg-info'):
+                    meta_file = os.path.join(entry.path, 'PKG-INFO') if entry.is_dir() else entry.path
+                else:
+                    continue
+                # 元数据按文件 mtime 缓存：安装少量包后只需重新解析变化的 dist-info
+                try:
+                    mtime = os.stat(meta_file).st_mtime_ns
+                except OSError:
+                    continue
+                hit = self._meta_cache.get(meta_file)
+                if hit is not None and hit[0] == mtime:
+                    parsed = hit[1]
+                else:
+                    try:
+                        with open(meta_file, 'r', encoding='utf-8', errors='replace') as f:
+                            msg = parser.parse(f, headersonly=True)
+                    except OSError:
+                        continue
+                    requires = [r.strip() for r in (msg.get_all('Requires-Dist') or []) if r and r.strip()]
+                    if not requires and name.endswith('.egg-info') and entry.is_dir():
+                        requires = self._read_egg_requires(os.path.join(entry.path, 'requires.txt'))
+                    parsed = {'name': (msg.get('Name') or '').strip(), 'version': (msg.get('Version') or '').strip(),
+                              'requires': requires, 'path': entry.path}
+                    self._meta_cache[meta_file] = (mtime, parsed)
+                if not parsed['name']:
+                    continue
+                key = canonicalize_name(str(parsed['name']))
+                if key in dists:
+                    # 与 sys.path 顺序一致：先出现的生效
+                    continue
+                dists[key] = dict(parsed)
+        if stamp:
+            self._dist_cache[python_exe] = (stamp, dists)
+        return dists
+
+    def _read_egg_requires(self, path: str) -> List[str]:
+        """把 egg-info 的 requires.txt（[extra:marker] 分节格式）转换为 Requires-Dist 形式。"""
+        out: List[str] = []
+        section_marker = ''
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    s = line.strip()
+                    if not s or s.startswith('#'):
+                        continue
+                    if s.startswith('[') and s.endswith(']'):
+                        extra, _, marker = s[1:-1].partition(':')
+                        parts = []
+                        if extra:
+                            parts.append(f'extra == "{extra}"')
+                        if marker:
+                            parts.append(f'({marker})')
+                        section_marker = ' and '.join(parts)
+                        continue
+                    out.append(f"{s}; {section_marker}" if section_marker else s)
+        except OSError:
+            pass
+        return out
+
+    def _dist_installed_size(self, dist_path: str) -> int:
+        """按 RECORD 中登记的文件体积求和（缺失时统计元数据目录本身）。"""
+        total = 0
+        record = os.path.join(dist_path, 'RECORD')
+        try:
+            with open(record, 'r', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    parts = line.rstrip('\n').rsplit(',', 2)
+                    if len(parts) == 3 and parts[2].isdigit():
+                        total += int(parts[2])
+        except OSError:
+            try:
+                for entry in os.scandir(dist_path):
+                    if entry.is_file():
+                        total += entry.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def _parse_requirement(self, spec: str) -> Optional[Requirement]:
+        """解析 PEP 508 依赖规格，失败时返回 None。
+        按原文缓存：旧版 packaging 基于 pyparsing，逐条解析很慢，而各插件的依赖行高度重复。"""
+        if spec in self._req_parse_cache:
+            return self._req_parse_cache[spec]
+        try:
+            req: Optional[Requirement] = Requirement(spec)
+        except (InvalidRequirement, Exception):
+            req = None
+        if len(self._req_parse_cache) > 20000:
+            self._req_parse_cache.clear()
+        self._req_parse_cache[spec] = req
+        return req
+
+    def _topological_batches(self, deps: Dict[str, List[str]]) -> Tuple[List[List[str]], List[str]]:
+        """Kahn 分层：每一批只依赖之前批次中的包；环上的包并入最后一批。
+        deps: {包: [它依赖的包]}，返回 (批次列表, 环上的包)。"""
+        remaining = {k: set(v) for k, v in deps.items()}
+        batches: List[List[str]] = []
+        while remaining:
+            ready = sorted(k for k, v in remaining.items() if not v)
+            if not ready:
+                break
+            batches.append(ready)
+            for k in ready:
+                del remaining[k]
+            for v in remaining.values():
+                v.difference_update(ready)
+        cycles = sorted(remaining)
+        if cycles:
+            batches.append(cycles)
+        return batches, cycles
@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from comfy_venvtools import JobJournal  # noqa: E402
+
+
+class JobJournalResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.journal = JobJournal(os.path.join(self.tmp.name, 'jobs_journal.jsonl'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_failed_steps_are_retried_on_resume(self):
+        steps = ['uninstall:foo', 'install:bar==1.0', 'install:baz==2.0', 'install:qux==3.0']
+        job_id = self.journal.start_job('env_list_restore', steps)
+        self.journal.record_step(job_id, 'uninstall:foo', False, 'pip 返回码 1')
+        self.journal.record_step(job_id, 'install:bar==1.0', True)
+        self.journal.record_step(job_id, 'install:baz==2.0', False, '网络错误')
+
+        (job,) = self.journal.pending_jobs()
+        self.assertEqual(job['remaining'], ['uninstall:foo', 'install:baz==2.0', 'install:qux==3.0'])
+        self.assertEqual(sorted(job['failed']), ['install:baz==2.0', 'uninstall:foo'])
+
+    def test_last_result_wins(self):
+        job_id = self.journal.start_job('install_missing', ['a', 'b'])
+        self.journal.record_step(job_id, 'a', False, 'timeout')
+        self.journal.record_step(job_id, 'a', True)
+        self.journal.record_step(job_id, 'b', True)
+        self.journal.record_step(job_id, 'b', False, 'conflict')
+
+        (job,) = self.journal.pending_jobs()
+        self.assertEqual(job['remaining'], ['b'])
+        self.assertEqual(job['failed'], ['b'])
+
+    def test_finished_job_is_not_pending(self):
+        job_id = self.journal.start_job('install_missing', ['a'])
+        self.journal.record_step(job_id, 'a', False)
+        self.journal.finish_job(job_id)
+        self.assertEqual(self.journal.pending_jobs(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()